@@ -3,11 +3,15 @@ import axios from '../utils/axios'
 import { ElMessage } from 'element-plus'
 import { useUserStore } from './user'
 
+// 聊天记录每次加载的消息条数
+const CHAT_DETAIL_PAGE_SIZE = 30
+
 export const useChatStore = defineStore('chat', {
   state: () => ({
     chatLists: [],
     chatDetails: new Map(), // 使用 Map 存储不同对话的聊天记录
     lastFetchTimes: new Map(), // 记录每个对话的最后获取时间
+    chatCursors: new Map(), // 记录每个对话加载更早消息的游标
     currentChatId: null
   }),
 
@@ -37,9 +41,13 @@ export const useChatStore = defineStore('chat', {
           console.warn('未提供对话ID')
           return
         }
-        const response = await axios.get(`/history_service/detail/${listId}`)
+        // 只加载最新的一页消息，更早的消息在向上滚动时加载
+        const response = await axios.get(`/history_service/detail/${listId}`, {
+          params: { limit: CHAT_DETAIL_PAGE_SIZE }
+        })
         if (response.data.code === 1) {
           this.chatDetails.set(listId, response.data.data)
+          this.chatCursors.set(listId, response.data.next_cursor)
           this.lastFetchTimes.set(listId, new Date())
         } else {
           throw new Error(response.data.msg || '获取聊天记录失败')
@@ -50,6 +58,34 @@ export const useChatStore = defineStore('chat', {
       }
     },
 
+    // 加载更早的聊天记录，返回是否加载到了新消息
+    async fetchOlderChatDetails(listId) {
+      const cursor = this.chatCursors.get(listId)
+      if (!listId || !cursor) {
+        return false
+      }
+      try {
+        const response = await axios.get(`/history_service/detail/${listId}`, {
+          params: { limit: CHAT_DETAIL_PAGE_SIZE, cursor }
+        })
+        if (response.data.code === 1) {
+          const currentMessages = this.chatDetails.get(listId) || []
+          this.chatDetails.set(listId, [...response.data.data, ...currentMessages])
+          this.chatCursors.set(listId, response.data.next_cursor)
+          return response.data.data.length > 0
+        }
+        throw new Error(response.data.msg || '获取聊天记录失败')
+      } catch (error) {
+        console.error('获取更早的聊天记录失败:', error)
+        throw error
+      }
+    },
+
+    // 是否还有更早的聊天记录
+    hasOlderChatDetails(listId) {
+      return !!this.chatCursors.get(listId)
+    },
+
     // 创建新对话
     async createNewChat(name) {
       try {
@@ -105,12 +141,14 @@ export const useChatStore = defineStore('chat', {
     clearChatCache(listId) {
       this.chatDetails.delete(listId)
       this.lastFetchTimes.delete(listId)
+      this.chatCursors.delete(listId)
     },
 
     // 清除所有缓存
     clearAllCache() {
       this.chatDetails.clear()
       this.lastFetchTimes.clear()
+      this.chatCursors.clear()
     },
 
     // 添加新的 action 用于流式更新消息
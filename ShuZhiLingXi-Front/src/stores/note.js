@@ -5,6 +5,17 @@ import { nextTick } from 'vue'
 import http from 'http'
 import https from 'https'
 
+// 将后端的紧凑图谱快照（数组形式的节点和边）展开为组件使用的对象格式
+const expandKnowledgeGraph = (snapshot) => {
+  if (!snapshot) return snapshot
+  return {
+    knowledge_graph_id: snapshot.knowledge_graph_id,
+    created_at: snapshot.created_at,
+    items: snapshot.items.map(([id, name, description]) => ({ id, name, description })),
+    relations: snapshot.edges.map(([id, source, target, relation_type]) => ({ id, source, target, relation_type }))
+  }
+}
+
 export const useNoteStore = defineStore('note', {
   state: () => ({
     chapters: [],
@@ -455,9 +466,10 @@ export const useNoteStore = defineStore('note', {
 
     async fetchKnowledgeGraph(chapterId) {
       try {
+        // 服务端返回ETag，图谱未重新生成时浏览器缓存通过304直接复用
         const response = await axios.get(`/notes_summary_service/knowledge_graph/get/${chapterId}`)
         if (response.status === 200) {
-          return response.data.data
+          return expandKnowledgeGraph(response.data.data)
         }
       } catch (error) {
         console.error('获取知识图谱失败:', error)
@@ -472,15 +484,29 @@ export const useNoteStore = defineStore('note', {
           `/notes_summary_service/knowledge_graph/generate/${chapterId}`,
           {},
           {
+            responseType: 'text',
+            headers: {
+              'Accept': 'text/event-stream',
+            },
             timeout: 60000
           }
         )
 
-        if (response.status === 200 && response.data.data) {
-          return response.data.data
-        } else {
-          throw new Error(response.data.msg || '生成知识图谱失败')
+        // 生成接口以SSE返回，最后的graph帧携带保存后的完整图谱
+        let message = ''
+        for (const line of response.data.split('\n')) {
+          if (!line.startsWith('data: ')) continue
+          const data = line.slice(6)
+          if (data.startsWith('{')) {
+            const frame = JSON.parse(data)
+            if (frame.type === 'graph') {
+              return expandKnowledgeGraph(frame.data)
+            }
+          } else if (data !== '[DONE]' && !data.startsWith('[TOKENS:')) {
+            message = data
+          }
         }
+        throw new Error(message || '生成知识图谱失败')
       } catch (error) {
         console.error('重新生成知识图谱失败:', error)
         if (error.response?.status === 403) {
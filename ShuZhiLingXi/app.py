@@ -5,6 +5,7 @@ from utils.exts import db
 from routes.router import register_routes
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
+import atexit
 import logging
 from scheduler.scheduler import start_scheduler, shutdown_scheduler
 
@@ -49,9 +50,8 @@ register_routes(app)
 
 start_scheduler(app)
 
-@app.teardown_appcontext
-def shutdown_scheduler_handler(exception=None):
-    shutdown_scheduler()
+# 进程退出时关闭调度器；不能挂在teardown_appcontext上，每个请求和后台任务的应用上下文结束时都会触发
+atexit.register(shutdown_scheduler)
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -18,8 +18,89 @@ CACHE_CONFIG = {
     'search_history_ttl': 3600,  # 搜索历史缓存时间（秒）
     'plan_statistics_ttl': 300,  # 计划统计缓存时间（秒）
     'notes_summary_ttl': 3600,  # 笔记总结缓存时间（秒）
+    'media_cache_ttl': 604800,  # 图片/音频识别结果缓存时间（秒）
+    'knowledge_graph_ttl': 604800,  # 知识图谱快照缓存时间（秒），快照不可变，仅在重新生成时替换
     'api_rate_limit': {
         'window': 60,  # 时间窗口（秒）
         'max_requests': 100  # 最大请求数
     }
-}
\ No newline at end of file
+}
+
+# 大模型HTTP连接池配置
+LLM_TRANSPORT_CONFIG = {
+    'pool_connections': 10,  # 每个进程缓存的主机连接池数量
+    'pool_maxsize': 20,  # 每个主机的最大连接数，建议不小于worker线程数
+    'pool_block': False,  # 连接池耗尽时是否阻塞等待
+    'connect_timeout': 5,  # 建立连接超时时间（秒）
+    'read_timeout': 120,  # 读取响应超时时间（秒）
+    'max_retries': 2  # 连接失败时的重试次数
+}
+
+# 运维指标配置
+METRICS_CONFIG = {
+    'admin_user_ids': []  # 可查看全局运维指标的管理员用户ID
+}
+
+# 腾讯云COS上传配置
+COS_UPLOAD_CONFIG = {
+    'pool_connections': 10,  # 缓存的主机连接池数量
+    'pool_maxsize': 20,  # 每个主机的最大连接数，不应小于上传线程数
+    'timeout': 30,  # 单次请求超时时间（秒）
+    'upload_workers': 8,  # 后台上传线程数，超出的上传排队等待
+    'latency_window': 1000  # 计算上传耗时分位数时保留的最近样本数
+}
+
+# 图片上传前的预处理配置
+IMAGE_PROCESSING_CONFIG = {
+    'max_long_edge': 2048,  # 长边超过该像素数时等比缩小，0表示不缩放
+    'quality': 85,  # JPEG/WebP编码质量
+    'output_format': 'JPEG',  # 输出格式，JPEG或WEBP
+    'keep_original': False,  # 是否同时保存未处理的原图
+    'original_prefix': 'originals/'  # 原图保存的文件夹前缀
+}
+
+# 笔记图片/音频并行处理配置
+MEDIA_PROCESSING_CONFIG = {
+    'workers': 8,  # 并行处理媒体的线程数
+    'image_timeout': 60,  # 图片上传与识别的超时时间（秒）
+    'audio_timeout': 90,  # 录音上传与识别的超时时间（秒）
+    'enrichment_workers': 4,  # 异步补全识别结果的后台线程数
+    'enrichment_retry_after': 120,  # 排队超过该时间仍未完成的任务由定时任务重新处理（秒）
+    'enrichment_max_attempts': 3,  # 单条记录的最大处理次数，超过后标记为失败
+    'enrichment_sweep_interval': 60,  # 扫描待重试任务的间隔（秒）
+    'enrichment_lock_ttl': 300  # 单条记录处理锁的过期时间（秒）
+}
+
+# token消耗流水配置
+TOKEN_LEDGER_CONFIG = {
+    'stream_key': 'token:ledger',  # 待落库的token消耗流水
+    'flush_interval': 5,  # 后台落库间隔（秒）
+    'batch_size': 1000,  # 单批落库的最大流水条数
+    'max_batches': 10,  # 单次落库最多处理的批次数
+    'flush_lock_ttl': 60,  # 落库锁过期时间（秒），保证同一时间只有一个进程落库
+    'reservation_estimate': 4000,  # 每次生成预留的token数
+    'reservation_ttl': 600,  # 预留未结算的过期时间（秒），过期后由后台任务退还
+    'sweep_interval': 60,  # 退还过期预留的间隔（秒）
+    'balance_mirror_ttl': 600  # 余额镜像过期时间（秒），过期后按数据库余额重新加载，使其他途径的余额变更生效
+}
+
+# 笔记/错题搜索配置
+SEARCH_CONFIG = {
+    'ngram_token_size': 2,  # 与MySQL ngram_token_size保持一致，短于该长度的关键词退化为LIKE匹配
+    'default_page_size': 20,  # 携带分页参数但未指定page_size时的每页结果数
+    'max_page_size': 100,  # 每页结果数上限
+    'snippet_radius': 30  # 摘要中关键词前后保留的字符数
+}
+
+# 笔记总结分块配置
+SUMMARY_CONFIG = {
+    'chunk_tokens': 3000,  # 单个分块的估算token上限，章节笔记不超过该长度时直接总结
+    'max_workers': 4,  # 同时总结的分块数量上限
+    'chunk_cache_ttl': 604800  # 分块总结缓存时间（秒），按分块内容哈希缓存
+}
+
+# 列表接口游标分页配置
+PAGINATION_CONFIG = {
+    'default_page_size': 50,  # 默认每页条数
+    'max_page_size': 200  # 每页条数上限
+}
@@ -1,12 +1,11 @@
-from openai import OpenAI
 import json
-import requests
 from typing import List, Dict, Generator
 from config.config import Config
 from langchain_core.tools import tool
 from langchain_core.runnables import RunnableLambda
+from llm.transport import transport
 
-kimi_client = OpenAI(
+kimi_client = transport.get_openai_client(
     api_key=Config.LLMConfig.MOONSHOT_API_KEY,
     base_url=Config.LLMConfig.MOONSHOT_BASE_URL,
 )
@@ -29,28 +28,30 @@ class KimiTools:
                 "stream": True
             }
 
-            response = requests.post(url, headers=headers, json=data, stream=True)
-
-            if response.status_code != 200:
-                raise Exception(f"API请求失败，状态码: {response.status_code}")
-
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        line = line[6:]
-
-                    if line == '[DONE]':
-                        break
-
-                    try:
-                        chunk_data = json.loads(line)
-                        if 'usage' not in chunk_data and 'choices' in chunk_data:
-                            content = chunk_data['choices'][0].get('delta', {}).get('content', '')
-                            chunk_data['usage'] = {'total_tokens': len(content.split())}
-                        yield chunk_data
-                    except json.JSONDecodeError:
-                        continue
+            with transport.track('moonshot', pool='requests'):
+                # 使用共享会话复用连接，with语句保证连接归还连接池
+                with transport.session.post(url, headers=headers, json=data, stream=True,
+                                            timeout=transport.get_timeout()) as response:
+                    if response.status_code != 200:
+                        raise Exception(f"API请求失败，状态码: {response.status_code}")
+
+                    for line in response.iter_lines():
+                        if line:
+                            line = line.decode('utf-8')
+                            if line.startswith('data: '):
+                                line = line[6:]
+
+                            if line == '[DONE]':
+                                break
+
+                            try:
+                                chunk_data = json.loads(line)
+                                if 'usage' not in chunk_data and 'choices' in chunk_data:
+                                    content = chunk_data['choices'][0].get('delta', {}).get('content', '')
+                                    chunk_data['usage'] = {'total_tokens': len(content.split())}
+                                yield chunk_data
+                            except json.JSONDecodeError:
+                                continue
 
         except Exception as e:
             raise Exception(f"Kimi流式对话失败: {str(e)}")
@@ -71,7 +72,9 @@ class KimiTools:
                 "stream": False
             }
 
-            response = requests.post(url, headers=headers, json=data)
+            with transport.track('moonshot', pool='requests'):
+                response = transport.session.post(url, headers=headers, json=data,
+                                                  timeout=transport.get_timeout())
 
             if response.status_code != 200:
                 raise Exception(f"API请求失败，状态码: {response.status_code}")
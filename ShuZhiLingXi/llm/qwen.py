@@ -3,34 +3,38 @@ from langchain_core.tools import tool
 from langchain_core.runnables import RunnableLambda
 from config.config import Config
 import dashscope
-from openai import OpenAI
 from typing import List, Dict, Generator
+from llm.transport import transport, tracked_stream
 
 
 dashscope.api_key = Config.LLMConfig.DASHSCOPE_API_KEY
 
+DASHSCOPE_COMPATIBLE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
 
 class QwenTools:
     @tool
     def qwen_vl_recognize(image_url: str) -> str:
-        """图像文字识别工具"""
+        """图像文字识别工具，image_url可以是图片地址或data:image/...;base64,...格式的内联图片"""
         try:
-            client = OpenAI(
+            # 复用进程级共享客户端，避免每张图片重新建立TCP/TLS连接
+            client = transport.get_openai_client(
                 api_key=Config.LLMConfig.DASHSCOPE_API_KEY,
-                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+                base_url=DASHSCOPE_COMPATIBLE_BASE_URL,
             )
 
-            completion = client.chat.completions.create(
-                model="qwen-vl-plus-latest",
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {"type": "text",
-                         "text": "请识别并提取这张图片中的所有文字内容，以文本形式输出，只需要输出图片中的内容，不需要告诉我你的想法等多余的东西"},
-                        {"type": "image_url", "image_url": {"url": image_url}}
-                    ]
-                }]
-            )
+            with transport.track('dashscope-vl', pool='httpx'):
+                completion = client.chat.completions.create(
+                    model="qwen-vl-plus-latest",
+                    messages=[{
+                        "role": "user",
+                        "content": [
+                            {"type": "text",
+                             "text": "请识别并提取这张图片中的所有文字内容，以文本形式输出，只需要输出图片中的内容，不需要告诉我你的想法等多余的东西"},
+                            {"type": "image_url", "image_url": {"url": image_url}}
+                        ]
+                    }]
+                )
             return completion.choices[0].message.content
 
         except Exception as e:
@@ -45,11 +49,13 @@ class QwenTools:
                 "content": [{"audio": audio_url}]
             }]
 
-            response = dashscope.MultiModalConversation.call(
-                model="qwen-audio-asr-1204",
-                messages=messages,
-                result_format="message"
-            )
+            with transport.track('dashscope-audio'):
+                response = dashscope.MultiModalConversation.call(
+                    model="qwen-audio-asr-1204",
+                    messages=messages,
+                    result_format="message",
+                    request_timeout=transport.get_timeout()[1]
+                )
 
             return response.output.choices[0].message.content[0]["text"]
 
@@ -66,16 +72,16 @@ class QwenTools:
                 model="qwen-max",
                 messages=messages,
                 stream=True,
-                result_format='message'
+                incremental_output=True,
+                result_format='message',
+                request_timeout=transport.get_timeout()[1]
             )
 
-            prev_content = ""
-            for chunk in response:
+            # 开启增量输出后，每个chunk只携带新增内容，无需再与上一次的累计内容做差
+            for chunk in tracked_stream('dashscope', response):
                 if chunk.status_code == 200:
-                    current_content = chunk.output.choices[0].message.content
-                    delta_content = current_content[len(prev_content):]
-                    prev_content = current_content
-                    
+                    delta_content = chunk.output.choices[0].message.content or ''
+
                     output = {
                         'output': {
                             'choices': [{
@@ -89,7 +95,8 @@ class QwenTools:
                     # 在最后一个chunk中添加usage信息
                     if hasattr(chunk, 'usage') and chunk.usage:
                         output['usage'] = {
-                            'total_tokens': chunk.usage.total_tokens
+                            'total_tokens': chunk.usage.total_tokens,
+                            'output_tokens': chunk.usage.output_tokens
                         }
                     
                     yield output
@@ -108,16 +115,16 @@ class QwenTools:
                 model="qwen2.5-math-72b-instruct",
                 messages=messages,
                 stream=True,
-                result_format='message'
+                incremental_output=True,
+                result_format='message',
+                request_timeout=transport.get_timeout()[1]
             )
 
-            prev_content = ""
-            for chunk in response:
+            # 开启增量输出后，每个chunk只携带新增内容，无需再与上一次的累计内容做差
+            for chunk in tracked_stream('dashscope', response):
                 if chunk.status_code == 200:
-                    current_content = chunk.output.choices[0].message.content
-                    delta_content = current_content[len(prev_content):]
-                    prev_content = current_content
-                    
+                    delta_content = chunk.output.choices[0].message.content or ''
+
                     output = {
                         'output': {
                             'choices': [{
@@ -131,7 +138,8 @@ class QwenTools:
                     # 在最后一个chunk中添加usage信息
                     if hasattr(chunk, 'usage') and chunk.usage:
                         output['usage'] = {
-                            'total_tokens': chunk.usage.total_tokens
+                            'total_tokens': chunk.usage.total_tokens,
+                            'output_tokens': chunk.usage.output_tokens
                         }
                     
                     yield output
@@ -146,11 +154,13 @@ class QwenTools:
         """Qwen非流式文本生成工具"""
         try:
             from dashscope import Generation
-            response = Generation.call(
-                model="qwen-max",
-                messages=messages,
-                result_format='message'
-            )
+            with transport.track('dashscope'):
+                response = Generation.call(
+                    model="qwen-max",
+                    messages=messages,
+                    result_format='message',
+                    request_timeout=transport.get_timeout()[1]
+                )
 
             if response.status_code != 200:
                 raise Exception(f"API请求失败，状态码: {response.status_code}")
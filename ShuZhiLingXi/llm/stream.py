@@ -0,0 +1,85 @@
+# stream.py
+from utils.redis_utils import RedisUtils
+
+
+class LLMStream:
+    """
+    迭代大模型流式输出，逐段返回新增内容，同时累计完整回答和token用量。
+    客户端断开时（生成器被关闭）立即关闭上游流，中止大模型继续生成。
+    """
+
+    def __init__(self, chain, messages, endpoint):
+        self.chain = chain
+        self.messages = messages
+        self.endpoint = endpoint
+        self.content = ""
+        self.total_tokens = 0
+        self.output_tokens = 0
+        self.finished = False
+        self.cancelled = False
+        self._iterator = None
+
+    def __iter__(self):
+        self._iterator = self._generate()
+        return self._iterator
+
+    def close(self):
+        """关闭输出迭代并中止上游生成，客户端断开时应在保存结果前调用，不依赖生成器被回收"""
+        if self._iterator is not None:
+            self._iterator.close()
+
+    def _generate(self):
+        upstream = self.chain.invoke({'messages': self.messages})
+        try:
+            for chunk in upstream:
+                if chunk and 'output' in chunk:
+                    content = chunk['output']['choices'][0].get('delta', {}).get('content', '')
+                    if content:
+                        self.content += content
+                        yield content
+
+                # usage为截至当前chunk的累计用量，取最新值
+                if chunk and 'usage' in chunk:
+                    self.total_tokens = chunk['usage'].get('total_tokens', 0)
+                    self.output_tokens = chunk['usage'].get('output_tokens', 0)
+
+            self.finished = True
+        except GeneratorExit:
+            self.cancelled = True
+            raise
+        finally:
+            upstream.close()
+            if self.finished:
+                self._record_completion()
+            elif self.cancelled:
+                self._record_cancellation()
+
+    def _record_completion(self):
+        redis_utils = RedisUtils()
+        redis_utils.incr_counter(f"llm_stream:{self.endpoint}:completed")
+        redis_utils.incr_counter(f"llm_stream:{self.endpoint}:completed_output_tokens", self.output_tokens)
+
+    def _record_cancellation(self):
+        """按该接口历史完整回答的平均输出长度估算提前中止节省的token"""
+        redis_utils = RedisUtils()
+        counters = redis_utils.get_counters([
+            f"llm_stream:{self.endpoint}:completed",
+            f"llm_stream:{self.endpoint}:completed_output_tokens"
+        ])
+        completed = counters[f"llm_stream:{self.endpoint}:completed"]
+        average_output = counters[f"llm_stream:{self.endpoint}:completed_output_tokens"] / completed if completed else 0
+        tokens_saved = max(0, int(average_output) - self.output_tokens)
+
+        redis_utils.incr_counter(f"llm_stream:{self.endpoint}:cancelled")
+        redis_utils.incr_counter("llm_stream:cancelled")
+        redis_utils.incr_counter("llm_stream:tokens_saved", tokens_saved)
+        print(f"客户端已断开，中止{self.endpoint}生成，已输出{self.output_tokens}个token，预计节省{tokens_saved}个token")
+
+
+def get_llm_stream_stats():
+    """获取流式生成提前中止的统计"""
+    counters = RedisUtils().get_counters(["llm_stream:cancelled", "llm_stream:tokens_saved"])
+    return {
+        'cancelled_streams': counters["llm_stream:cancelled"],
+        'tokens_saved': counters["llm_stream:tokens_saved"]
+    }
@@ -0,0 +1,78 @@
+# summary.py
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import SUMMARY_CONFIG
+from llm.qwen import textgen_chain
+from utils.redis_utils import RedisUtils
+
+
+def estimate_tokens(text):
+    """粗略估算token数，中文约每字一个token，按字符数估算"""
+    return len(text)
+
+
+def split_chunks(contents, chunk_tokens=None):
+    """
+    按顺序将笔记内容装入估算token数不超过上限的分块，超长的单条笔记单独成块
+    新增笔记排在最后，只会改变最后一个分块，其余分块的内容和缓存保持不变
+    :param contents: 按创建顺序排列的笔记内容列表
+    :param chunk_tokens: 单个分块的估算token上限
+    :return: 分块文本列表
+    """
+    if chunk_tokens is None:
+        chunk_tokens = SUMMARY_CONFIG['chunk_tokens']
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for content in contents:
+        tokens = estimate_tokens(content)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append("\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(content)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _summarize_chunk(chunk):
+    """总结单个分块，返回(分块总结, 消耗的token数)"""
+    messages = [
+        {"role": "system", "content": "你是一个专业的笔记总结助手。请提炼笔记片段中的要点和关键信息，保留重要的概念、公式和结论。"},
+        {"role": "user", "content": f"这是我的一部分笔记内容：\n{chunk}\n请简洁地总结这部分笔记的要点。"}
+    ]
+    response = textgen_chain.invoke({'messages': messages})
+    return response['output']['text'], response['output'].get('usage', 0)
+
+
+def summarize_chunks(chunks):
+    """
+    并发总结各分块，命中缓存的分块不调用模型
+    :param chunks: 分块文本列表
+    :return: (按分块顺序排列的总结列表，失败的分块为None, 本次消耗的token数)
+    """
+    redis_utils = RedisUtils()
+    hashes = [hashlib.sha256(chunk.encode('utf-8')).hexdigest() for chunk in chunks]
+    summaries = [redis_utils.get_summary_chunk_cache(chunk_hash) for chunk_hash in hashes]
+    missing = [index for index, summary in enumerate(summaries) if summary is None]
+    if not missing:
+        return summaries, 0
+
+    total_tokens = 0
+    with ThreadPoolExecutor(max_workers=min(SUMMARY_CONFIG['max_workers'], len(missing))) as executor:
+        futures = {index: executor.submit(_summarize_chunk, chunks[index]) for index in missing}
+        for index, future in futures.items():
+            # 单个分块失败不影响其他分块的结果写入缓存和token计量，重试时只需重新总结失败的分块
+            try:
+                summary, tokens = future.result()
+            except Exception as e:
+                print(f"总结笔记分块失败: {str(e)}")
+                continue
+            summaries[index] = summary
+            total_tokens += tokens
+            redis_utils.set_summary_chunk_cache(hashes[index], summary)
+    return summaries, total_tokens
@@ -0,0 +1,172 @@
+# transport.py
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+import requests
+from openai import OpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config.settings import LLM_TRANSPORT_CONFIG
+
+
+class ProviderTransport:
+    """进程级共享的大模型HTTP传输层，复用连接池并统计连接池占用情况"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(ProviderTransport, cls).__new__(cls)
+                    instance._init_transport()
+                    cls._instance = instance
+        return cls._instance
+
+    def _init_transport(self):
+        self.pool_maxsize = LLM_TRANSPORT_CONFIG['pool_maxsize']
+        self.timeout = (
+            LLM_TRANSPORT_CONFIG['connect_timeout'],
+            LLM_TRANSPORT_CONFIG['read_timeout']
+        )
+
+        # requests会话，供Kimi等直接走HTTP的调用使用
+        adapter = HTTPAdapter(
+            pool_connections=LLM_TRANSPORT_CONFIG['pool_connections'],
+            pool_maxsize=self.pool_maxsize,
+            pool_block=LLM_TRANSPORT_CONFIG['pool_block'],
+            max_retries=Retry(
+                total=LLM_TRANSPORT_CONFIG['max_retries'],
+                connect=LLM_TRANSPORT_CONFIG['max_retries'],
+                read=0,
+                status=0
+            )
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # httpx连接池，供OpenAI兼容客户端共享
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.pool_maxsize,
+                max_keepalive_connections=self.pool_maxsize
+            ),
+            timeout=httpx.Timeout(
+                LLM_TRANSPORT_CONFIG['read_timeout'],
+                connect=LLM_TRANSPORT_CONFIG['connect_timeout']
+            )
+        )
+
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self._pools = {
+            pool: {'in_flight': 0, 'peak_in_flight': 0, 'saturated': 0}
+            for pool in ('requests', 'httpx')
+        }
+
+    def get_openai_client(self, api_key, base_url):
+        """获取共享的OpenAI兼容客户端，同一base_url只创建一次"""
+        key = (base_url, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = OpenAI(
+                        api_key=api_key,
+                        base_url=base_url,
+                        http_client=self.http_client,
+                        max_retries=LLM_TRANSPORT_CONFIG['max_retries']
+                    )
+                    self._clients[key] = client
+        return client
+
+    def get_timeout(self, connect_timeout=None, read_timeout=None):
+        """获取单次调用的(连接超时, 读取超时)"""
+        return (
+            connect_timeout if connect_timeout is not None else self.timeout[0],
+            read_timeout if read_timeout is not None else self.timeout[1]
+        )
+
+    @contextmanager
+    def track(self, provider, pool=None):
+        """
+        记录一次调用占用连接的情况，用于评估连接池是否饱和
+        :param provider: 服务商名称
+        :param pool: 调用使用的共享连接池，'requests'或'httpx'；DashScope SDK等不经过共享连接池的调用为None
+        """
+        with self._stats_lock:
+            stats = self._stats.setdefault(provider, {
+                'requests': 0,
+                'in_flight': 0,
+                'peak_in_flight': 0,
+                'errors': 0,
+                'total_seconds': 0.0
+            })
+            stats['requests'] += 1
+            stats['in_flight'] += 1
+            stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+
+            # 连接池由多个服务商共享，按连接池内所有服务商的并发数判断是否饱和
+            pool_stats = self._pools[pool] if pool else None
+            if pool_stats is not None:
+                pool_stats['in_flight'] += 1
+                pool_stats['peak_in_flight'] = max(pool_stats['peak_in_flight'], pool_stats['in_flight'])
+                if pool_stats['in_flight'] > self.pool_maxsize:
+                    pool_stats['saturated'] += 1
+
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            with self._stats_lock:
+                stats['errors'] += 1
+            raise
+        finally:
+            with self._stats_lock:
+                stats['in_flight'] -= 1
+                stats['total_seconds'] += time.time() - start
+                if pool_stats is not None:
+                    pool_stats['in_flight'] -= 1
+
+    def get_stats(self):
+        """获取各服务商的调用统计和共享连接池占用统计"""
+        with self._stats_lock:
+            providers = {}
+            for provider, stats in self._stats.items():
+                providers[provider] = dict(stats)
+                providers[provider]['avg_seconds'] = round(
+                    stats['total_seconds'] / stats['requests'], 3
+                ) if stats['requests'] else 0
+            pools = {}
+            for pool, stats in self._pools.items():
+                pools[pool] = dict(stats)
+                pools[pool]['saturation'] = round(stats['in_flight'] / self.pool_maxsize, 3)
+                pools[pool]['peak_saturation'] = round(stats['peak_in_flight'] / self.pool_maxsize, 3)
+        return {
+            'pool_maxsize': self.pool_maxsize,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'pools': pools,
+            'providers': providers
+        }
+
+def tracked_stream(provider, iterator):
+    """在整个流式响应期间保持连接占用统计，迭代结束或被关闭时释放"""
+    with ProviderTransport().track(provider):
+        try:
+            for item in iterator:
+                yield item
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+
+transport = ProviderTransport()
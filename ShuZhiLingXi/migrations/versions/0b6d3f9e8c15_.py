@@ -0,0 +1,29 @@
+"""add knowledge_graph.note_digests and notes_fingerprint for incremental graphs
+
+Revision ID: 0b6d3f9e8c15
+Revises: f2a8c4e6b1d9
+Create Date: 2026-10-18 16:48:37.902416
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6d3f9e8c15'
+down_revision = 'f2a8c4e6b1d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 已有图谱没有摘要记录，下次生成时按全量生成一次
+    with op.batch_alter_table('knowledge_graph', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('note_digests', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('notes_fingerprint', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_graph', schema=None) as batch_op:
+        batch_op.drop_column('notes_fingerprint')
+        batch_op.drop_column('note_digests')
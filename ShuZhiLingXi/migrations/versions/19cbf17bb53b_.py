@@ -0,0 +1,42 @@
+"""add token_usage_daily rollup and backfill from token_usage
+
+Revision ID: 19cbf17bb53b
+Revises: c174a19be2cc
+Create Date: 2026-10-18 10:03:27.618442
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '19cbf17bb53b'
+down_revision = 'c174a19be2cc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_usage_daily',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('spand', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.user_id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'day', name='uq_token_usage_daily_user_day')
+    )
+
+    # 按(用户, 日期)汇总历史token使用记录
+    op.execute("""
+        INSERT INTO token_usage_daily (user_id, day, spand, updated_at)
+        SELECT user_id, DATE(created_at), COALESCE(SUM(spand), 0), MAX(created_at)
+        FROM token_usage
+        WHERE user_id IS NOT NULL AND created_at IS NOT NULL
+        GROUP BY user_id, DATE(created_at)
+    """)
+
+
+def downgrade():
+    op.drop_table('token_usage_daily')
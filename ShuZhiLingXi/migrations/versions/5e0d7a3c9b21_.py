@@ -0,0 +1,29 @@
+"""add token_ledger_checkpoint for write-behind token ledger
+
+Revision ID: 5e0d7a3c9b21
+Revises: 19cbf17bb53b
+Create Date: 2026-10-18 11:20:41.305117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0d7a3c9b21'
+down_revision = '19cbf17bb53b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_ledger_checkpoint',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('last_entry_id', sa.String(length=32), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('token_ledger_checkpoint')
@@ -0,0 +1,32 @@
+"""add media_status to note and mistaken_question for async media enrichment
+
+Revision ID: 7c2e5a9d4f08
+Revises: 0b6d3f9e8c15
+Create Date: 2026-10-18 17:41:09.264830
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e5a9d4f08'
+down_revision = '0b6d3f9e8c15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('note', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('media_status', sa.String(length=16), server_default='ready', nullable=False))
+
+    with op.batch_alter_table('mistaken_question', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('media_status', sa.String(length=16), server_default='ready', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('mistaken_question', schema=None) as batch_op:
+        batch_op.drop_column('media_status')
+
+    with op.batch_alter_table('note', schema=None) as batch_op:
+        batch_op.drop_column('media_status')
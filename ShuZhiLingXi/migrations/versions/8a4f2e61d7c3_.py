@@ -0,0 +1,33 @@
+"""add ngram fulltext indexes for note and mistaken question search
+
+Revision ID: 8a4f2e61d7c3
+Revises: 5e0d7a3c9b21
+Create Date: 2026-10-18 13:42:09.518734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4f2e61d7c3'
+down_revision = '5e0d7a3c9b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "CREATE FULLTEXT INDEX ft_note_content "
+        "ON note (words, image_describe, audio_describe) WITH PARSER ngram"
+    )
+    op.execute(
+        "CREATE FULLTEXT INDEX ft_mistaken_question_content "
+        "ON mistaken_question (content, answer, image_describe, similar_question, similar_answer) "
+        "WITH PARSER ngram"
+    )
+
+
+def downgrade():
+    op.drop_index('ft_mistaken_question_content', table_name='mistaken_question')
+    op.drop_index('ft_note_content', table_name='note')
@@ -0,0 +1,34 @@
+"""recount notes_chapter.notes_count from existing notes
+
+Revision ID: b3e9c5d1a7f4
+Revises: 8a4f2e61d7c3
+Create Date: 2026-10-18 14:25:51.770362
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e9c5d1a7f4'
+down_revision = '8a4f2e61d7c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 章节列表改为直接读取计数列，先按现有笔记校正一次
+    op.execute("""
+        UPDATE notes_chapter c
+        LEFT JOIN (
+            SELECT chapter_id, COUNT(*) AS cnt
+            FROM note
+            WHERE is_deleted = 0
+            GROUP BY chapter_id
+        ) n ON n.chapter_id = c.chapter_id
+        SET c.notes_count = COALESCE(n.cnt, 0)
+    """)
+
+
+def downgrade():
+    pass
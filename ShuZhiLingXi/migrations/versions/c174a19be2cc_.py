@@ -0,0 +1,33 @@
+"""add media_cache table
+
+Revision ID: c174a19be2cc
+Revises: efca7c13e621
+Create Date: 2026-10-18 09:12:41.503127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c174a19be2cc'
+down_revision = 'efca7c13e621'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_cache',
+    sa.Column('media_cache_id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('media_type', sa.Enum('image', 'audio'), nullable=False),
+    sa.Column('media_hash', sa.String(length=64), nullable=False),
+    sa.Column('url', sa.String(length=255), nullable=False),
+    sa.Column('describe', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('media_cache_id'),
+    sa.UniqueConstraint('media_type', 'media_hash', name='uq_media_cache_type_hash')
+    )
+
+
+def downgrade():
+    op.drop_table('media_cache')
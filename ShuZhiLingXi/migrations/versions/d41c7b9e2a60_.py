@@ -0,0 +1,51 @@
+"""add composite indexes for hot query patterns
+
+Revision ID: d41c7b9e2a60
+Revises: b3e9c5d1a7f4
+Create Date: 2026-10-18 15:08:36.204917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7b9e2a60'
+down_revision = 'b3e9c5d1a7f4'
+branch_labels = None
+depends_on = None
+
+# (索引名, 表名, 列)，首列均为外键列
+INDEXES = [
+    ('ix_notes_chapter_user_deleted_created', 'notes_chapter', ['user_id', 'is_deleted', 'created_at']),
+    ('ix_note_chapter_deleted_created', 'note', ['chapter_id', 'is_deleted', 'created_at']),
+    ('ix_note_summary_chapter_deleted_created', 'note_summary', ['chapter_id', 'is_deleted', 'created_at']),
+    ('ix_knowledge_graph_chapter_deleted', 'knowledge_graph', ['chapter_id', 'is_deleted']),
+    ('ix_knowledge_item_graph_deleted', 'knowledge_item', ['knowledge_graph_id', 'is_deleted']),
+    ('ix_knowledge_relation_graph_deleted', 'knowledge_relation', ['knowledge_graph_id', 'is_deleted']),
+    ('ix_mistaken_question_list_user_deleted_created', 'mistaken_question_list', ['user_id', 'is_deleted', 'created_at']),
+    ('ix_mistaken_question_question_list_deleted_created', 'mistaken_question', ['question_list_id', 'is_deleted', 'created_at']),
+    ('ix_chat_history_list_user_deleted_created', 'chat_history_list', ['user_id', 'is_deleted', 'created_at']),
+    ('ix_chat_history_detail_list_deleted_created', 'chat_history_detail', ['chat_history_list_id', 'is_deleted', 'created_at']),
+    ('ix_plan_user_deleted_deadline', 'plan', ['user_id', 'is_deleted', 'deadline']),
+    ('ix_search_history_user_deleted_created', 'search_history', ['user_id', 'is_deleted', 'created_at']),
+    ('ix_token_usage_user_created', 'token_usage', ['user_id', 'created_at']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in reversed(INDEXES):
+        # MySQL可能已用组合索引替代外键自动创建的索引，删除前若没有其他以外键列开头的索引则先补回
+        covered = any(
+            index['name'] != name and index['column_names'][:1] == columns[:1]
+            for index in inspector.get_indexes(table)
+        )
+        if not covered:
+            op.create_index(f'{table}_{columns[0]}_fk', table, [columns[0]], unique=False)
+        op.drop_index(name, table_name=table)
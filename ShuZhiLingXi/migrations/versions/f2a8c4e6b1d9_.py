@@ -0,0 +1,28 @@
+"""add knowledge_graph.snapshot for compressed graph snapshots
+
+Revision ID: f2a8c4e6b1d9
+Revises: d41c7b9e2a60
+Create Date: 2026-10-18 16:02:13.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a8c4e6b1d9'
+down_revision = 'd41c7b9e2a60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 已有图谱的快照在首次读取时补写
+    with op.batch_alter_table('knowledge_graph', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('snapshot', mysql.MEDIUMBLOB(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_graph', schema=None) as batch_op:
+        batch_op.drop_column('snapshot')
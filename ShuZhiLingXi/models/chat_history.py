@@ -10,6 +10,10 @@ class ChatHistoryList(db.Model):
     is_deleted = db.Column(db.Boolean, default=False)
     chat_count = db.Column(db.Integer, default=0)
 
+    __table_args__ = (
+        db.Index('ix_chat_history_list_user_deleted_created', 'user_id', 'is_deleted', 'created_at'),
+    )
+
     chat_details = db.relationship('ChatHistoryDetail', backref='chat_list', lazy=True)
 
 class ChatHistoryDetail(db.Model):
@@ -23,3 +27,7 @@ class ChatHistoryDetail(db.Model):
     role = db.Column(db.Enum('system', 'user'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_deleted = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (
+        db.Index('ix_chat_history_detail_list_deleted_created', 'chat_history_list_id', 'is_deleted', 'created_at'),
+    )
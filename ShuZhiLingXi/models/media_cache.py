@@ -0,0 +1,15 @@
+from utils.exts import db
+from datetime import datetime
+
+class MediaCache(db.Model):
+    __tablename__ = 'media_cache'
+    media_cache_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    media_type = db.Column(db.Enum('image', 'audio'), nullable=False)
+    media_hash = db.Column(db.String(64), nullable=False)  # 解码后媒体内容的SHA-256
+    url = db.Column(db.String(255), nullable=False)
+    describe = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('media_type', 'media_hash', name='uq_media_cache_type_hash'),
+    )
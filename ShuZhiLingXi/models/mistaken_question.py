@@ -10,6 +10,10 @@ class MistakenQuestionList(db.Model):
     count = db.Column(db.Integer, default=0)
     is_deleted = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_mistaken_question_list_user_deleted_created', 'user_id', 'is_deleted', 'created_at'),
+    )
+
     mistaken_question = db.relationship('MistakenQuestion', backref='mistaken_question_list', lazy=True)
 
 class MistakenQuestion(db.Model):
@@ -26,4 +30,14 @@ class MistakenQuestion(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_deleted = db.Column(db.Boolean, default=False)
     is_favorite = db.Column(db.Boolean, default=False)
-    error_type = db.Column(db.String(20), nullable=True)
\ No newline at end of file
+    error_type = db.Column(db.String(20), nullable=True)
+    # 图片/录音识别状态：ready已完成，processing后台识别中，failed识别失败
+    media_status = db.Column(db.String(16), nullable=False, default='ready', server_default='ready')
+
+    __table_args__ = (
+        # 错题搜索使用的全文索引，ngram分词支持中文
+        db.Index('ft_mistaken_question_content', 'content', 'answer', 'image_describe',
+                 'similar_question', 'similar_answer',
+                 mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+        db.Index('ix_mistaken_question_question_list_deleted_created', 'question_list_id', 'is_deleted', 'created_at'),
+    )
\ No newline at end of file
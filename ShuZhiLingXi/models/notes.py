@@ -1,3 +1,5 @@
+from sqlalchemy.dialects.mysql import MEDIUMBLOB
+
 from utils.exts import db
 from datetime import datetime
 
@@ -13,6 +15,10 @@ class NotesChapter(db.Model):
     vague_notes_count = db.Column(db.Integer, default=0)
     unclear_notes_count = db.Column(db.Integer, default=0)
     category = db.Column(db.String(50), default='未分类')
+
+    __table_args__ = (
+        db.Index('ix_notes_chapter_user_deleted_created', 'user_id', 'is_deleted', 'created_at'),
+    )
     
     notes = db.relationship('Note', backref='chapter', lazy=True)
 
@@ -28,16 +34,34 @@ class Note(db.Model):
     audio_describe = db.Column(db.Text, nullable=True)
     words = db.Column(db.Text, nullable=True)
     comprehension_level = db.Column(db.Enum('理解', '模糊', '不理解'), default='理解')
+    # 图片/录音识别状态：ready已完成，processing后台识别中，failed识别失败
+    media_status = db.Column(db.String(16), nullable=False, default='ready', server_default='ready')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_deleted = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        # 笔记搜索使用的全文索引，ngram分词支持中文
+        db.Index('ft_note_content', 'words', 'image_describe', 'audio_describe',
+                 mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+        db.Index('ix_note_chapter_deleted_created', 'chapter_id', 'is_deleted', 'created_at'),
+    )
+
 class KnowledgeGraph(db.Model):
     __tablename__ = 'knowledge_graph'
     knowledge_graph_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     chapter_id = db.Column(db.Integer, db.ForeignKey('notes_chapter.chapter_id'), nullable=False)
+    # 生成时写入的压缩快照（节点列表+边列表），图谱生成后不再修改
+    snapshot = db.Column(MEDIUMBLOB, nullable=True)
+    # 已并入图谱的笔记内容摘要{笔记ID: 摘要}及其整体指纹，用于增量生成
+    note_digests = db.Column(db.JSON, nullable=True)
+    notes_fingerprint = db.Column(db.String(64), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_deleted = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_knowledge_graph_chapter_deleted', 'chapter_id', 'is_deleted'),
+    )
+
     chapter = db.relationship('NotesChapter', backref='knowledge_graph', lazy=True, uselist=False)
     items = db.relationship('KnowledgeItem', backref='knowledge_graph', lazy=True)
     relations = db.relationship('KnowledgeRelation', backref='knowledge_graph', lazy=True)
@@ -51,6 +75,10 @@ class KnowledgeItem(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_deleted = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_knowledge_item_graph_deleted', 'knowledge_graph_id', 'is_deleted'),
+    )
+
     relations_as_a = db.relationship('KnowledgeRelation',
                                    backref='item_a',
                                    foreign_keys='KnowledgeRelation.item_a_id',
@@ -70,6 +98,10 @@ class KnowledgeRelation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_deleted = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_knowledge_relation_graph_deleted', 'knowledge_graph_id', 'is_deleted'),
+    )
+
 class NoteSummary(db.Model):
     __tablename__ = 'note_summary'
     note_summary_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -78,4 +110,8 @@ class NoteSummary(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_deleted = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_note_summary_chapter_deleted_created', 'chapter_id', 'is_deleted', 'created_at'),
+    )
+
     chapter = db.relationship('NotesChapter', backref='note_summaries', lazy=True)
\ No newline at end of file
@@ -11,6 +11,10 @@ class Plan(db.Model):
     is_deleted = db.Column(db.Boolean, default=False)
     level = db.Column(db.Enum('紧急', '非紧急'), default='非紧急')
 
+    __table_args__ = (
+        db.Index('ix_plan_user_deleted_deadline', 'user_id', 'is_deleted', 'deadline'),
+    )
+
 class PlanAdvice(db.Model):
     __tablename__ = 'plan_advice'
     id = db.Column(db.Integer, primary_key=True)
@@ -8,3 +8,7 @@ class SearchHistory(db.Model):
     keyword = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_deleted = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (
+        db.Index('ix_search_history_user_deleted_created', 'user_id', 'is_deleted', 'created_at'),
+    )
@@ -9,3 +9,26 @@ class TokenUsage(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', backref='token_usage', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_token_usage_user_created', 'user_id', 'created_at'),
+    )
+
+class TokenUsageDaily(db.Model):
+    __tablename__ = 'token_usage_daily'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    spand = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', name='uq_token_usage_daily_user_day'),
+    )
+
+class TokenLedgerCheckpoint(db.Model):
+    """记录Redis token流水已落库的位置，与余额和用量在同一事务中更新"""
+    __tablename__ = 'token_ledger_checkpoint'
+    name = db.Column(db.String(64), primary_key=True)
+    last_entry_id = db.Column(db.String(32), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -9,6 +9,7 @@ from service.notes_management import notes_bp
 from service.search_history_management import search_history_bp
 from service.notes_summary_management import knowledge_graph_bp
 from service.mistaken_question_management import mistaken_question_bp
+from service.metrics_management import metrics_bp
 
 def register_routes(app):
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -22,3 +23,4 @@ def register_routes(app):
     app.register_blueprint(search_history_bp, url_prefix='/search_history_service')
     app.register_blueprint(knowledge_graph_bp, url_prefix='/notes_summary_service')
     app.register_blueprint(mistaken_question_bp, url_prefix='/mistaken_question_service')
+    app.register_blueprint(metrics_bp, url_prefix='/metrics_service')
@@ -9,12 +9,18 @@ from models.notes import Note
 from models.user import User
 from llm.qwen import textgen_chain
 from utils.exts import db
+from utils.token_utils import flush_token_ledger, release_expired_reservations
+from utils.media_enrichment import retry_media_enrichment
+from config.settings import TOKEN_LEDGER_CONFIG, MEDIA_PROCESSING_CONFIG
 
 logging.basicConfig()
 logging.getLogger('apscheduler').setLevel(logging.INFO)
 
 scheduler = BackgroundScheduler()
 
+# 后台任务在应用上下文之外执行，需要访问数据库的任务通过该引用进入应用上下文
+_app = None
+
 def init_scheduler(app):
     """初始化调度器配置"""
     jobstores = {
@@ -95,6 +101,34 @@ def update_user_profiles():
         logging.error(f"Error in update_user_profiles: {str(e)}")
         db.session.rollback()
 
+def flush_token_ledger_job():
+    """定期将Redis中的token消耗流水落库"""
+    with _app.app_context():
+        try:
+            flushed = flush_token_ledger()
+            if flushed:
+                logging.info(f"Flushed {flushed} token ledger entries")
+        except Exception as e:
+            logging.error(f"Error flushing token ledger: {str(e)}")
+
+def release_expired_reservations_job():
+    """定期退还过期未结算的token预留"""
+    try:
+        released = release_expired_reservations()
+        if released:
+            logging.info(f"Released {released} expired token reservations")
+    except Exception as e:
+        logging.error(f"Error releasing expired token reservations: {str(e)}")
+
+def retry_media_enrichment_job():
+    """定期重新处理排队过久的图片/录音识别任务"""
+    try:
+        retried = retry_media_enrichment(_app)
+        if retried:
+            logging.info(f"Retried {retried} media enrichment tasks")
+    except Exception as e:
+        logging.error(f"Error retrying media enrichment: {str(e)}")
+
 def add_periodic_tasks():
     try:
         # 每天凌晨更新用户画像
@@ -106,12 +140,44 @@ def add_periodic_tasks():
             id='update_user_profiles',
             replace_existing=True
         )
+        # 定期批量落库token消耗流水
+        scheduler.add_job(
+            flush_token_ledger_job,
+            'interval',
+            seconds=TOKEN_LEDGER_CONFIG['flush_interval'],
+            id='flush_token_ledger',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        # 定期退还过期未结算的token预留
+        scheduler.add_job(
+            release_expired_reservations_job,
+            'interval',
+            seconds=TOKEN_LEDGER_CONFIG['sweep_interval'],
+            id='release_expired_reservations',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        # 定期重试未完成的异步媒体识别
+        scheduler.add_job(
+            retry_media_enrichment_job,
+            'interval',
+            seconds=MEDIA_PROCESSING_CONFIG['enrichment_sweep_interval'],
+            id='retry_media_enrichment',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
         logging.info("Successfully added periodic tasks")
     except Exception as e:
         logging.error(f"Error adding periodic tasks: {str(e)}")
 
 def start_scheduler(app):
     """启动调度器"""
+    global _app
+    _app = app
     with app.app_context():
         try:
             init_scheduler(app)
@@ -5,6 +5,7 @@ from llm.qwen import vl_chain
 from models.chat_history import ChatHistoryList, ChatHistoryDetail
 from utils.cos_utils import COSClient
 from utils.exts import db
+from utils.pagination import keyset_paginate
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 history_bp = Blueprint('history', __name__)
@@ -36,8 +37,11 @@ def delete_chat_list(list_id):
             }), 404
 
         chat_list.is_deleted = True
-        for detail in chat_list.chat_details:
-            detail.is_deleted = True
+        # 一条UPDATE标记对话下所有消息为已删除，无需加载消息
+        ChatHistoryDetail.query.filter_by(
+            chat_history_list_id=list_id,
+            is_deleted=False
+        ).update({'is_deleted': True}, synchronize_session=False)
         db.session.commit()
         return jsonify({
             'code': 1,
@@ -122,6 +126,71 @@ def delete_chat_detail(detail_id):
         }), 500
 
 
+@history_bp.route('/detail/batch_delete', methods=['DELETE'])
+@jwt_required()
+def batch_delete_chat_details():
+    try:
+        current_user_id = get_jwt_identity()
+        detail_ids = (request.get_json() or {}).get('detail_ids') or []
+        if not isinstance(detail_ids, list) or not detail_ids:
+            return jsonify({
+                'code': 0,
+                'msg': '请选择要删除的聊天记录'
+            }), 400
+
+        # 只统计当前用户未删除对话中的消息，按对话分组得到计数扣减量
+        list_counts = dict(db.session.query(
+            ChatHistoryDetail.chat_history_list_id,
+            db.func.count(ChatHistoryDetail.chat_history_detail_id)
+        ).join(
+            ChatHistoryList,
+            ChatHistoryDetail.chat_history_list_id == ChatHistoryList.chat_history_list_id
+        ).filter(
+            ChatHistoryDetail.chat_history_detail_id.in_(detail_ids),
+            ChatHistoryList.user_id == current_user_id,
+            ChatHistoryList.is_deleted == False,
+            ChatHistoryDetail.is_deleted == False
+        ).group_by(ChatHistoryDetail.chat_history_list_id).all())
+
+        if not list_counts:
+            return jsonify({
+                'code': 1,
+                'msg': '聊天记录删除成功',
+                'data': {'deleted': 0}
+            }), 200
+
+        deleted = ChatHistoryDetail.query.filter(
+            ChatHistoryDetail.chat_history_detail_id.in_(detail_ids),
+            ChatHistoryDetail.chat_history_list_id.in_(list(list_counts.keys())),
+            ChatHistoryDetail.is_deleted == False
+        ).update({'is_deleted': True}, synchronize_session=False)
+
+        # 一条UPDATE扣减所有涉及对话的消息数量
+        ChatHistoryList.query.filter(
+            ChatHistoryList.chat_history_list_id.in_(list(list_counts.keys()))
+        ).update({
+            'chat_count': db.func.greatest(
+                ChatHistoryList.chat_count
+                - db.case(list_counts, value=ChatHistoryList.chat_history_list_id, else_=0),
+                0
+            )
+        }, synchronize_session=False)
+
+        db.session.commit()
+        return jsonify({
+            'code': 1,
+            'msg': '聊天记录删除成功',
+            'data': {'deleted': deleted}
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'code': 0,
+            'msg': f'删除失败: {str(e)}'
+        }), 500
+
+
 @history_bp.route('/detail/edit/<int:detail_id>', methods=['PUT'])
 @jwt_required()
 def edit_chat_detail(detail_id):
@@ -189,10 +258,14 @@ def edit_chat_detail(detail_id):
 def get_chat_lists():
     try:
         current_user_id = get_jwt_identity()
-        chat_lists = ChatHistoryList.query.filter_by(
-            user_id=current_user_id,
-            is_deleted=False
-        ).all()
+        try:
+            chat_lists, next_cursor = keyset_paginate(
+                ChatHistoryList.query.filter_by(user_id=current_user_id, is_deleted=False),
+                ChatHistoryList.created_at,
+                ChatHistoryList.chat_history_list_id
+            )
+        except ValueError as e:
+            return jsonify({'code': 0, 'msg': str(e)}), 400
 
         result = [{
             'chat_history_list_id': list_element.chat_history_list_id,
@@ -204,7 +277,8 @@ def get_chat_lists():
         return jsonify({
             'code': 1,
             'msg': '获取成功',
-            'data': result
+            'data': result,
+            'next_cursor': next_cursor
         }), 200
     except Exception as e:
         return jsonify({
@@ -232,11 +306,18 @@ def get_chat_details(list_id):
                 'msg': '无权限访问此聊天记录或聊天记录不存在'
             }), 403
 
-        # 获取聊天详情
-        chat_details = ChatHistoryDetail.query.filter_by(
-            chat_history_list_id=list_id,
-            is_deleted=False
-        ).order_by(ChatHistoryDetail.created_at).all()
+        # 获取聊天详情，分页时从最新的消息开始向前加载，游标指向更早的消息
+        try:
+            chat_details, next_cursor = keyset_paginate(
+                ChatHistoryDetail.query.filter_by(chat_history_list_id=list_id, is_deleted=False),
+                ChatHistoryDetail.created_at,
+                ChatHistoryDetail.chat_history_detail_id,
+                descending=True
+            )
+        except ValueError as e:
+            return jsonify({'code': 0, 'msg': str(e)}), 400
+        # 每一页内仍按时间正序返回，便于前端直接拼接
+        chat_details.reverse()
 
         result = [{
             'chat_history_detail_id': detail.chat_history_detail_id,
@@ -251,7 +332,8 @@ def get_chat_details(list_id):
         return jsonify({
             'code': 1,
             'msg': '获取成功',
-            'data': result
+            'data': result,
+            'next_cursor': next_cursor
         }), 200
     except Exception as e:
         return jsonify({
@@ -1,14 +1,17 @@
-from flask import Blueprint, jsonify, Response, stream_with_context, request
+from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, timedelta
 
-from utils.cos_utils import COSClient
+from utils.media_utils import upload_image
 from utils.redis_utils import RedisUtils
 from utils.exts import db
-from models.token_usage import TokenUsage
+from utils.stream_utils import release_db_connection, short_transaction, sse_response
+from utils.token_utils import reserve_tokens
+from models.token_usage import TokenUsageDaily
 from models.user import User
 from flask_cors import CORS
 from llm.qwen import textgen_stream_chain
+from llm.stream import LLMStream
 from models.mistaken_question import MistakenQuestion, MistakenQuestionList
 
 info_bp = Blueprint('info', __name__)
@@ -86,6 +89,7 @@ def get_user_info(user_id):
 @jwt_required()
 def get_user_advice():
     """获取基于用户画像的个性化建议"""
+    reservation = None
     try:
         current_user_id = get_jwt_identity()
         user = User.query.get(current_user_id)
@@ -93,13 +97,16 @@ def get_user_advice():
         if not user:
             return jsonify({'message': '用户不存在'}), 404
 
-        if not user or user.token_balance <= 0:
+        # 预留本次建议的token额度，余额不足时直接拒绝
+        reservation = reserve_tokens(current_user_id)
+        if reservation is None:
             return jsonify({"code": 0, "msg": "Token余额不足"}), 403
 
         # 尝试从Redis缓存获取用户建议
         redis_utils = RedisUtils()
         cached_advice = redis_utils.get_cache(f"user:advice:{current_user_id}")
         if cached_advice:
+            reservation.release()
             return jsonify(cached_advice), 200
 
         # 构建消息
@@ -118,66 +125,43 @@ def get_user_advice():
                 "content": "请给我一个实用的生活小妙招。"
             })
 
+        # 流式输出期间归还数据库连接，生成结束后再用短事务保存结果
+        app = current_app._get_current_object()
+        release_db_connection()
+
         def generate():
-            advice_content = ""
-            total_tokens = 0
-
-            for chunk in textgen_stream_chain.invoke({'messages': messages}):
-                if chunk and 'output' in chunk:
-                    content = chunk['output']['choices'][0].get('delta', {}).get('content', '')
-                    if content:
-                        advice_content += content
-                        yield f"data: {content}\n\n"
-                    # 从最后一个chunk获取token使用量
-                    if 'usage' in chunk:
-                        total_tokens = chunk['usage'].get('total_tokens', 0)
-            
+            stream = LLMStream(textgen_stream_chain, messages, 'user_advice')
             try:
-                # 只在获取到token使用量时更新数据库
-                if total_tokens > 0:
-                    today = datetime.utcnow().date()
-                    token_usage = TokenUsage.query.filter(
-                        TokenUsage.user_id == current_user_id,
-                        db.func.date(TokenUsage.created_at) == today
-                    ).first()
-
-                    if token_usage:
-                        token_usage.spand += total_tokens
-                    else:
-                        token_usage = TokenUsage(
-                            user_id=current_user_id,
-                            spand=total_tokens
-                        )
-                        db.session.add(token_usage)
-
-                    user.token_balance -= total_tokens
-                    db.session.commit()
-
-                    # 缓存用户建议
-                    advice_data = {
-                        'advice': advice_content,
-                        'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-                    }
-                    redis_utils.set_cache(f"user:advice:{current_user_id}", advice_data, 3600)  # 缓存1小时
-
-            except Exception as e:
-                print(f"保存token使用记录失败: {str(e)}")
-                db.session.rollback()
-
-            yield f"data: [TOKENS:{total_tokens}]\n\n"
+                for content in stream:
+                    yield f"data: {content}\n\n"
+            finally:
+                stream.close()
+                # 客户端中途断开时上游生成已被中止，同样保存已消耗的token用量
+                try:
+                    # 只在获取到token使用量时更新数据库
+                    if stream.total_tokens > 0:
+                        with short_transaction(app):
+                            reservation.settle(stream.total_tokens)
+
+                    # 只缓存完整生成的建议
+                    if stream.finished:
+                        advice_data = {
+                            'advice': stream.content,
+                            'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+                        }
+                        redis_utils.set_cache(f"user:advice:{current_user_id}", advice_data, 3600)  # 缓存1小时
+
+                except Exception as e:
+                    print(f"保存token使用记录失败: {str(e)}")
+
+            yield f"data: [TOKENS:{stream.total_tokens}]\n\n"
             yield "data: [DONE]\n\n"
 
-        return Response(
-            stream_with_context(generate()),
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Credentials': 'true'
-            }
-        )
+        return sse_response(reservation.guard(generate()))
 
     except Exception as e:
+        if reservation is not None:
+            reservation.release()
         return jsonify({'message': f'获取建议失败: {str(e)}'}), 500
 
 
@@ -193,20 +177,20 @@ def get_biweekly_token_usage():
         if cached_usage:
             return jsonify(cached_usage), 200
 
-        # 获取最近7天的日期范围
-        end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=13)
+        # 获取最近14天的日期范围
+        end_day = datetime.utcnow().date()
+        start_day = end_day - timedelta(days=13)
 
-        # 查询最近7天的token使用记录
-        token_usage = TokenUsage.query.filter(
-            TokenUsage.user_id == current_user_id,
-            TokenUsage.created_at >= start_date,
-            TokenUsage.created_at <= end_date
-        ).all()
+        # 按(user_id, day)唯一索引范围查询每日汇总
+        token_usage = TokenUsageDaily.query.filter(
+            TokenUsageDaily.user_id == current_user_id,
+            TokenUsageDaily.day >= start_day,
+            TokenUsageDaily.day <= end_day
+        ).order_by(TokenUsageDaily.day).all()
 
         # 格式化数据
         token_data = [{
-            'created_at': usage.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'created_at': usage.day.strftime('%Y-%m-%d %H:%M:%S'),
             'spand': usage.spand
         } for usage in token_usage]
 
@@ -224,8 +208,7 @@ def edit_user_profile_picture():
     try:
         current_user_id = get_jwt_identity()
         data = request.get_json()
-        cos_client = COSClient()
-        profile_picture = cos_client.upload_base64_image(data['profile_picture'])
+        profile_picture = upload_image(data['profile_picture'])
         user = User.query.get(current_user_id)
         if not user:
             return jsonify({
@@ -2,14 +2,15 @@ from flask_cors import CORS
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from config.config import Config
-from flask import request, jsonify, Blueprint, Response, stream_with_context
+from flask import request, jsonify, Blueprint, current_app
 from utils.exts import db
 from models.user import User
 from models.chat_history import ChatHistoryList, ChatHistoryDetail
-from llm.qwen import vl_chain, mathgen_stream_chain
-from utils.cos_utils import COSClient
-from datetime import datetime
-from models.token_usage import TokenUsage
+from llm.qwen import mathgen_stream_chain
+from llm.stream import LLMStream
+from utils.media_utils import recognize_image
+from utils.stream_utils import release_db_connection, short_transaction, sse_response
+from utils.token_utils import reserve_tokens
 import dashscope
 
 qwen_chat_bp = Blueprint('qwen_chat', __name__)
@@ -28,13 +29,14 @@ dashscope.api_key = Config.LLMConfig.DASHSCOPE_API_KEY
 @qwen_chat_bp.route('/math_chat', methods=['POST'])
 @jwt_required()
 def math_chat():
+    reservation = None
     try:
         # 获取用户ID从JWT中获取
         current_user_id = get_jwt_identity()
 
-        # 检查用户token余额
-        user = User.query.get(current_user_id)
-        if not user or user.token_balance <= 0:
+        # 预留本次回答的token额度，余额不足时直接拒绝
+        reservation = reserve_tokens(current_user_id)
+        if reservation is None:
             return jsonify({"code": 0, "msg": "Token余额不足"}), 403
 
         data = request.get_json()
@@ -49,6 +51,7 @@ def math_chat():
         # 验证用户和聊天列表
         chat_list = ChatHistoryList.query.get(chat_history_list_id)
         if not user or not chat_list:
+            reservation.release()
             return jsonify({"code": 0, "msg": "用户或聊天不存在"}), 404
 
         # 处理图片（如果有）
@@ -56,16 +59,8 @@ def math_chat():
         image_url = None
         if image:
             try:
-                # 需要确保 image 是 base64 格式的字符串
-                if isinstance(image, str) and image.startswith('data:image'):
-                    # 移除 base64 头部信息
-                    image = image.split(',')[1] if ',' in image else image
-
-                cos_client = COSClient()
-                image_url = cos_client.upload_base64_image(image)
-
-                # 使用图片URL进行识别
-                image_text = vl_chain.invoke(image_url)
+                # 上传并识别图片，相同图片命中缓存时跳过上传和模型调用
+                image_url, image_text = recognize_image(image)
 
                 # 保存图片URL和识别结果到聊天记录
                 chat_detail = ChatHistoryDetail(
@@ -79,6 +74,7 @@ def math_chat():
                 db.session.add(chat_detail)
 
             except Exception as e:
+                reservation.release()
                 return jsonify({"code": 0, "msg": f"图片处理失败: {str(e)}"}), 500
 
         # 准备聊天消息
@@ -121,75 +117,45 @@ def math_chat():
                 role='user'
             )
             db.session.add(user_chat_detail)
-            db.session.commit()
+
+        # 流式输出前提交用户消息并归还数据库连接，生成结束后再用短事务保存回答
+        app = current_app._get_current_object()
+        release_db_connection()
 
         def generate():
-            assistant_message = ""
-            total_tokens = 0
-
-            # 使用流式输出
-            for chunk in mathgen_stream_chain.invoke({'messages': messages}):
-                if chunk and 'output' in chunk:  # 检查output字段
-                    content = chunk['output']['choices'][0].get('delta', {}).get('content', '')
-                    if content:
-                        assistant_message += content
-                        yield f"data: {content}\n\n"
-
-                # 统计token使用量
-                if chunk and 'usage' in chunk:
-                    total_tokens += chunk['usage'].get('total_tokens', 0)
-
-            # 保存完整的对话记录到数据库
+            stream = LLMStream(mathgen_stream_chain, messages, 'math_chat')
             try:
-                bot_response = ChatHistoryDetail(
-                    chat_history_list_id=chat_history_list_id,
-                    words=assistant_message,
-                    role='system'
-                )
-                db.session.add(bot_response)
-                chat_list.chat_count += 2
-
-                # 获取今天的token使用记录
-                today = datetime.utcnow().date()
-                token_usage = TokenUsage.query.filter(
-                    TokenUsage.user_id == current_user_id,
-                    db.func.date(TokenUsage.created_at) == today
-                ).first()
-
-                if token_usage:
-                    # 如果今天已有记录，更新spand值
-                    token_usage.spand += total_tokens
-                else:
-                    # 如果今天没有记录，创建新记录
-                    token_usage = TokenUsage(
-                        user_id=current_user_id,
-                        spand=total_tokens
-                    )
-                    db.session.add(token_usage)
-
-                # 更新用户token余额
-                user.token_balance -= total_tokens
-
-                db.session.commit()
-            except Exception as e:
-                print(f"保存对话记录失败: {str(e)}")
-                db.session.rollback()
+                # 使用流式输出
+                for content in stream:
+                    yield f"data: {content}\n\n"
+            finally:
+                stream.close()
+                # 客户端中途断开时上游生成已被中止，同样保存已生成的部分回答和token用量
+                try:
+                    with short_transaction(app) as session:
+                        # 上游调用失败、没有生成任何内容时不保存空回答
+                        if stream.content:
+                            session.add(ChatHistoryDetail(
+                                chat_history_list_id=chat_history_list_id,
+                                words=stream.content,
+                                role='system'
+                            ))
+                            ChatHistoryList.query.filter_by(chat_history_list_id=chat_history_list_id).update(
+                                {'chat_count': ChatHistoryList.chat_count + 2},
+                                synchronize_session=False
+                            )
+                        reservation.settle(stream.total_tokens)
+                except Exception as e:
+                    print(f"保存对话记录失败: {str(e)}")
 
-            # yield f"data: [TOKENS:{total_tokens}]\n\n"
             yield "data: [DONE]\n\n"
 
-        return Response(
-            stream_with_context(generate()),
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Credentials': 'true'
-            }
-        )
+        return sse_response(reservation.guard(generate()))
 
     except Exception as e:
         db.session.rollback()
+        if reservation is not None:
+            reservation.release()
         return jsonify({
             "msg": f"处理失败: {str(e)}"
         }), 500
\ No newline at end of file
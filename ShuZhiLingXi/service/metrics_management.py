@@ -0,0 +1,107 @@
+from functools import wraps
+
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from config.settings import METRICS_CONFIG
+from llm.transport import transport
+from llm.stream import get_llm_stream_stats
+from utils.media_utils import get_media_cache_stats, get_image_preprocess_stats
+from utils.cos_utils import COSClient
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def admin_required(func):
+    """只允许配置中的管理员访问，需放在jwt_required之后"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if int(get_jwt_identity()) not in METRICS_CONFIG['admin_user_ids']:
+            return jsonify({'msg': '无权访问'}), 403
+        return func(*args, **kwargs)
+    return wrapper
+
+
+# 获取大模型连接池占用情况
+@metrics_bp.route('/transport', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_transport_metrics():
+    try:
+        return jsonify({
+            'msg': '获取成功',
+            'data': transport.get_stats()
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'msg': f'获取失败: {str(e)}'
+        }), 500
+
+
+# 获取图片/音频识别缓存命中率
+@metrics_bp.route('/media_cache', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_media_cache_metrics():
+    try:
+        return jsonify({
+            'msg': '获取成功',
+            'data': get_media_cache_stats()
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'msg': f'获取失败: {str(e)}'
+        }), 500
+
+
+# 获取客户端断开后提前中止生成的统计
+@metrics_bp.route('/llm_stream', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_llm_stream_metrics():
+    try:
+        return jsonify({
+            'msg': '获取成功',
+            'data': get_llm_stream_stats()
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'msg': f'获取失败: {str(e)}'
+        }), 500
+
+
+# 获取COS上传并发数和耗时分位数
+@metrics_bp.route('/cos', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_cos_metrics():
+    try:
+        return jsonify({
+            'msg': '获取成功',
+            'data': COSClient().get_stats()
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'msg': f'获取失败: {str(e)}'
+        }), 500
+
+
+# 获取图片预处理节省的字节数
+@metrics_bp.route('/image_preprocess', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_image_preprocess_metrics():
+    try:
+        return jsonify({
+            'msg': '获取成功',
+            'data': get_image_preprocess_stats()
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'msg': f'获取失败: {str(e)}'
+        }), 500
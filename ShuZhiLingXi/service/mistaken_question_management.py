@@ -1,16 +1,21 @@
-from flask import Blueprint, request, jsonify, stream_with_context, Response
+from flask import Blueprint, request, jsonify, current_app
 
-from llm.qwen import vl_chain, textgen_stream_chain
+from llm.qwen import textgen_stream_chain
+from llm.stream import LLMStream
 from models.mistaken_question import MistakenQuestionList, MistakenQuestion
-from models.token_usage import TokenUsage
-from models.user import User
 from utils.exts import db
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from utils.cos_utils import COSClient
+from utils.media_utils import recognize_image
+from utils.media_enrichment import defer_media_enrichment, submit_media_enrichment
 from functools import wraps
 from time import sleep
 from datetime import datetime
 from models.search_history import SearchHistory
+from utils.search_utils import search_condition, paginate_search, highlight
+from utils.pagination import keyset_paginate
+from utils.single_flight import SingleFlight
+from utils.stream_utils import release_db_connection, short_transaction, sse_response
+from utils.token_utils import reserve_tokens
 
 mistaken_question_bp = Blueprint('mistaken_question', __name__)
 
@@ -52,10 +57,14 @@ def create_question_list():
 def get_question_lists():
     try:
         current_user_id = get_jwt_identity()
-        lists = MistakenQuestionList.query.filter_by(
-            user_id=current_user_id,
-            is_deleted=False
-        ).all()
+        try:
+            lists, next_cursor = keyset_paginate(
+                MistakenQuestionList.query.filter_by(user_id=current_user_id, is_deleted=False),
+                MistakenQuestionList.created_at,
+                MistakenQuestionList.question_list_id
+            )
+        except ValueError as e:
+            return jsonify({'msg': str(e)}), 400
 
         result = [{
             'question_list_id': lst.question_list_id,
@@ -66,7 +75,8 @@ def get_question_lists():
 
         return jsonify({
             'msg': '获取成功',
-            'data': result
+            'data': result,
+            'next_cursor': next_cursor
         }), 200
 
     except Exception as e:
@@ -87,11 +97,13 @@ def create_question():
         image_url = None
         image_describe = None
 
-        if data.get('image'):
+        # async_media为真时先保存错题，图片由后台线程识别后补全
+        defer_media = bool(data.get('async_media') and data.get('image'))
+        if defer_media:
             is_image = True
-            cos_client = COSClient()
-            image_url = cos_client.upload_base64_image(data['image'])
-            image_describe = vl_chain.invoke(image_url)
+        elif data.get('image'):
+            is_image = True
+            image_url, image_describe = recognize_image(data['image'])
 
         question = MistakenQuestion(
             question_list_id=question_list_id,
@@ -99,18 +111,32 @@ def create_question():
             is_image=is_image,
             image_url=image_url,
             image_describe=image_describe,
+            media_status='processing' if defer_media else 'ready'
         )
 
         question_list = MistakenQuestionList.query.get(question_list_id)
         question_list.count += 1
 
         db.session.add(question)
+
+        if defer_media:
+            db.session.flush()
+            if not defer_media_enrichment('question', question.question_id, image=data['image']):
+                # 无法保存待识别的图片时退化为同步识别
+                defer_media = False
+                question.image_url, question.image_describe = recognize_image(data['image'])
+                question.media_status = 'ready'
+
         db.session.commit()
 
+        if defer_media:
+            submit_media_enrichment(current_app._get_current_object(), 'question', question.question_id)
+
         return jsonify({
             'msg': '创建成功',
             'data': {
-                'question_id': question.question_id
+                'question_id': question.question_id,
+                'media_status': question.media_status
             }
         }), 200
 
@@ -120,15 +146,52 @@ def create_question():
             'msg': f'创建失败: {str(e)}'
         }), 500
 
+# 查询错题图片的识别状态，异步创建的错题由客户端轮询直到完成
+@mistaken_question_bp.route('/question/status/<int:question_id>', methods=['GET'])
+@jwt_required()
+def get_question_media_status(question_id):
+    try:
+        current_user_id = get_jwt_identity()
+        question = MistakenQuestion.query.join(
+            MistakenQuestionList,
+            MistakenQuestion.question_list_id == MistakenQuestionList.question_list_id
+        ).filter(
+            MistakenQuestion.question_id == question_id,
+            MistakenQuestionList.user_id == current_user_id,
+            MistakenQuestion.is_deleted == False
+        ).first()
+
+        if not question:
+            return jsonify({'msg': '错题不存在或无权访问'}), 404
+
+        return jsonify({
+            'msg': '获取成功',
+            'data': {
+                'question_id': question.question_id,
+                'media_status': question.media_status,
+                'image_url': question.image_url,
+                'image_describe': question.image_describe
+            }
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'msg': f'获取失败: {str(e)}'
+        }), 500
+
 # 获取错题本中的所有错题
 @mistaken_question_bp.route('/question/list/<int:question_list_id>', methods=['GET'])
 @jwt_required()
 def get_questions(question_list_id):
     try:
-        questions = MistakenQuestion.query.filter_by(
-            question_list_id=question_list_id,
-            is_deleted=False
-        ).order_by(MistakenQuestion.created_at).all()
+        try:
+            questions, next_cursor = keyset_paginate(
+                MistakenQuestion.query.filter_by(question_list_id=question_list_id, is_deleted=False),
+                MistakenQuestion.created_at,
+                MistakenQuestion.question_id
+            )
+        except ValueError as e:
+            return jsonify({'msg': str(e)}), 400
 
         result = [{
             'question_id': q.question_id,
@@ -140,12 +203,14 @@ def get_questions(question_list_id):
             'similar_question': q.similar_question,
             'similar_answer': q.similar_answer,
             'created_at': q.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'is_favorite': q.is_favorite
+            'is_favorite': q.is_favorite,
+            'media_status': q.media_status
         } for q in questions]
 
         return jsonify({
             'msg': '获取成功',
-            'data': result
+            'data': result,
+            'next_cursor': next_cursor
         }), 200
 
     except Exception as e:
@@ -160,15 +225,12 @@ def delete_question_list(question_list_id):
     try:
         question_list = MistakenQuestionList.query.get_or_404(question_list_id)
         
-        # 标记所有相关的错题为已删除
-        questions = MistakenQuestion.query.filter_by(
+        # 一条UPDATE标记所有相关的错题为已删除
+        MistakenQuestion.query.filter_by(
             question_list_id=question_list_id,
             is_deleted=False
-        ).all()
-        
-        for question in questions:
-            question.is_deleted = True
-            
+        ).update({'is_deleted': True}, synchronize_session=False)
+
         question_list.is_deleted = True
         question_list.count = 0
         
@@ -198,6 +260,56 @@ def delete_question(question_id):
         db.session.rollback()
         return jsonify({'msg': f'删除失败: {str(e)}'}), 500
 
+# 批量删除错题
+@mistaken_question_bp.route('/question/batch_delete', methods=['PUT'])
+@jwt_required()
+def batch_delete_questions():
+    try:
+        current_user_id = get_jwt_identity()
+        question_ids = (request.get_json() or {}).get('question_ids') or []
+        if not isinstance(question_ids, list) or not question_ids:
+            return jsonify({'msg': '请选择要删除的错题'}), 400
+
+        # 只统计当前用户错题本中未删除的错题，按错题本分组得到计数扣减量
+        list_counts = dict(db.session.query(
+            MistakenQuestion.question_list_id,
+            db.func.count(MistakenQuestion.question_id)
+        ).join(
+            MistakenQuestionList,
+            MistakenQuestion.question_list_id == MistakenQuestionList.question_list_id
+        ).filter(
+            MistakenQuestion.question_id.in_(question_ids),
+            MistakenQuestionList.user_id == current_user_id,
+            MistakenQuestion.is_deleted == False
+        ).group_by(MistakenQuestion.question_list_id).all())
+
+        if not list_counts:
+            return jsonify({'msg': '删除成功', 'data': {'deleted': 0}}), 200
+
+        deleted = MistakenQuestion.query.filter(
+            MistakenQuestion.question_id.in_(question_ids),
+            MistakenQuestion.question_list_id.in_(list(list_counts.keys())),
+            MistakenQuestion.is_deleted == False
+        ).update({'is_deleted': True}, synchronize_session=False)
+
+        # 一条UPDATE扣减所有涉及错题本的题目数量
+        MistakenQuestionList.query.filter(
+            MistakenQuestionList.question_list_id.in_(list(list_counts.keys()))
+        ).update({
+            'count': db.func.greatest(
+                MistakenQuestionList.count
+                - db.case(list_counts, value=MistakenQuestionList.question_list_id, else_=0),
+                0
+            )
+        }, synchronize_session=False)
+
+        db.session.commit()
+        return jsonify({'msg': '删除成功', 'data': {'deleted': deleted}}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': f'删除失败: {str(e)}'}), 500
+
 @mistaken_question_bp.route('/question/edit/<int:chapter_id>', methods=['PUT'])
 @jwt_required()
 def edit_chapter(chapter_id):
@@ -229,9 +341,7 @@ def edit_question(question_id):
 
         if data['image']:
             question.is_image = 1
-            cos_client = COSClient()
-            question.image_url = cos_client.upload_base64_image(data['image'])
-            question.image_describe = vl_chain.invoke(question.image_url)
+            question.image_url, question.image_describe = recognize_image(data['image'])
         if data['content']:
             question.words = data['content']
 
@@ -269,11 +379,13 @@ def retry_on_failure(max_retries=3, delay=1):
 @mistaken_question_bp.route('/question/update_answer/<int:question_id>', methods=['POST'])
 @jwt_required()
 def update_answer(question_id):
+    reservation = None
     try:
         current_user_id = get_jwt_identity()
 
-        user = User.query.get(current_user_id)
-        if not user or user.token_balance <= 0:
+        # 预留本次生成的token额度，余额不足时直接拒绝
+        reservation = reserve_tokens(current_user_id)
+        if reservation is None:
             return jsonify({"code": 0, "msg": "Token余额不足"}), 403
 
         question = MistakenQuestion.query.get_or_404(question_id)
@@ -290,78 +402,69 @@ def update_answer(question_id):
              "content": f"这是题目：\n" + "\n".join(question_content) + "\n请你给出这题的答案，尽量简练一点。"}
         ]
 
+        # 流式输出期间归还数据库连接，生成结束后再用短事务保存结果
+        app = current_app._get_current_object()
+        release_db_connection()
+
         @retry_on_failure(max_retries=3)
         def generate():
-            answer_content = ""
-            total_tokens = 0
+            stream = LLMStream(textgen_stream_chain, messages, 'update_answer')
+            error = None
             try:
-                for chunk in textgen_stream_chain.invoke({'messages': messages}):
-                    if chunk and 'output' in chunk:
-                        content = chunk['output']['choices'][0].get('delta', {}).get('content', '')
-                        if content:
-                            answer_content += content
-                            yield f"data: {content}\n\n"
-                        if 'usage' in chunk:
-                            total_tokens = chunk['usage'].get('total_tokens', 0)
-
+                for content in stream:
+                    yield f"data: {content}\n\n"
+            except Exception as e:
+                print(f"生成答案时出错: {str(e)}")
+                error = f"生成失败: {str(e)}"
+            finally:
+                stream.close()
+                # 客户端中途断开时上游生成已被中止，同样保存已生成的部分内容和token用量
                 try:
-                    today = datetime.utcnow().date()
-                    token_usage = TokenUsage.query.filter(
-                        TokenUsage.user_id == current_user_id,
-                        db.func.date(TokenUsage.created_at) == today
-                    ).first()
-
-                    if total_tokens > 0:
-                        if token_usage:
-                            token_usage.spand += total_tokens
-                        else:
-                            token_usage = TokenUsage(
-                                user_id=current_user_id,
-                                spand=total_tokens
-                            )
-                            db.session.add(token_usage)
-
-                        user.token_balance -= total_tokens
-
-                    question.answer = answer_content
-                    db.session.commit()
-
+                    # 只在获取到token使用量时更新数据库
+                    if stream.total_tokens > 0:
+                        with short_transaction(app):
+                            reservation.settle(stream.total_tokens)
+                            # 没有生成任何内容时保留原有答案
+                            if stream.content:
+                                MistakenQuestion.query.filter_by(question_id=question_id).update(
+                                    {'answer': stream.content},
+                                    synchronize_session=False
+                                )
                 except Exception as e:
                     print(f"保存数据到数据库时出错: {str(e)}")
-                    db.session.rollback()
+                    error = error or f"保存token使用记录失败: {str(e)}"
 
-                yield "data: [DONE]\n\n"
-            except Exception as e:
-                print(f"生成总结时出错: {str(e)}")
-                yield f"data: 生成失败: {str(e)}\n\n"
-                yield "data: [DONE]\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Credentials': 'true'
-            }
-        )
+            if error:
+                yield f"data: {error}\n\n"
+            else:
+                yield f"data: [TOKENS:{stream.total_tokens}]\n\n"
+            yield "data: [DONE]\n\n"
+
+        # 合并重复点击或客户端重试触发的相同生成请求
+        single_flight = SingleFlight('update_answer', current_user_id, question_id, messages)
+        return sse_response(reservation.guard(single_flight.stream(generate)))
 
     except Exception as e:
         print(f"生成答案失败: {str(e)}")
+        if reservation is not None:
+            reservation.release()
         return jsonify({'message': f'生成答案失败: {str(e)}'}), 500
 
 @mistaken_question_bp.route('/question/update_similar_answer/<int:question_id>', methods=['POST'])
 @jwt_required()
 def update_similar_answer(question_id):
+    reservation = None
     try:
         current_user_id = get_jwt_identity()
 
-        user = User.query.get(current_user_id)
-        if not user or user.token_balance <= 0:
+        # 预留本次生成的token额度，余额不足时直接拒绝
+        reservation = reserve_tokens(current_user_id)
+        if reservation is None:
             return jsonify({"code": 0, "msg": "Token余额不足"}), 403
 
         question = MistakenQuestion.query.get_or_404(question_id)
         if not question.similar_question:
+            reservation.release()
             return jsonify({"code": 0, "msg": "请先生成题目"}), 404
 
         question_content = []
@@ -373,80 +476,64 @@ def update_similar_answer(question_id):
              "content": f"这是题目：\n" + "\n".join(question_content) + "\n请你给出这题的答案，尽量简练一点。"}
         ]
 
+        # 流式输出期间归还数据库连接，生成结束后再用短事务保存结果
+        app = current_app._get_current_object()
+        release_db_connection()
+
         @retry_on_failure(max_retries=3)
         def generate():
-            answer_content = ""
-            total_tokens = 0
+            stream = LLMStream(textgen_stream_chain, messages, 'update_similar_answer')
+            error = None
             try:
-                for chunk in textgen_stream_chain.invoke({'messages': messages}):
-                    if chunk and 'output' in chunk:
-                        content = chunk['output']['choices'][0].get('delta', {}).get('content', '')
-                        if content:
-                            answer_content += content
-                            yield f"data: {content}\n\n"
-                        # 从最后一个chunk获取token使用量
-                        if 'usage' in chunk:
-                            total_tokens = chunk['usage'].get('total_tokens', 0)
-
+                for content in stream:
+                    yield f"data: {content}\n\n"
+            except Exception as e:
+                print(f"生成答案时出错: {str(e)}")
+                error = f"生成失败: {str(e)}"
+            finally:
+                stream.close()
+                # 客户端中途断开时上游生成已被中止，同样保存已生成的部分内容和token用量
                 try:
                     # 只在获取到token使用量时更新数据库
-                    if total_tokens > 0:
-                        today = datetime.utcnow().date()
-                        token_usage = TokenUsage.query.filter(
-                            TokenUsage.user_id == current_user_id,
-                            db.func.date(TokenUsage.created_at) == today
-                        ).first()
-
-                        if token_usage:
-                            token_usage.spand += total_tokens
-                        else:
-                            token_usage = TokenUsage(
-                                user_id=current_user_id,
-                                spand=total_tokens
-                            )
-                            db.session.add(token_usage)
-
-                        user.token_balance -= total_tokens
-                        question.similar_answer = answer_content
-                        db.session.commit()
-
-                    yield f"data: [TOKENS:{total_tokens}]\n\n"
-                    yield "data: [DONE]\n\n"
-
+                    if stream.total_tokens > 0:
+                        with short_transaction(app):
+                            reservation.settle(stream.total_tokens)
+                            # 没有生成任何内容时保留原有内容
+                            if stream.content:
+                                MistakenQuestion.query.filter_by(question_id=question_id).update(
+                                    {'similar_answer': stream.content},
+                                    synchronize_session=False
+                                )
                 except Exception as e:
                     print(f"保存数据到数据库时出错: {str(e)}")
-                    db.session.rollback()
-                    yield f"data: 保存token使用记录失败: {str(e)}\n\n"
-                    yield "data: [DONE]\n\n"
+                    error = error or f"保存token使用记录失败: {str(e)}"
 
-            except Exception as e:
-                print(f"生成答案时出错: {str(e)}")
-                db.session.rollback()
-                yield f"data: 生成失败: {str(e)}\n\n"
-                yield "data: [DONE]\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Credentials': 'true'
-            }
-        )
+            if error:
+                yield f"data: {error}\n\n"
+            else:
+                yield f"data: [TOKENS:{stream.total_tokens}]\n\n"
+            yield "data: [DONE]\n\n"
+
+        # 合并重复点击或客户端重试触发的相同生成请求
+        single_flight = SingleFlight('update_similar_answer', current_user_id, question_id, messages)
+        return sse_response(reservation.guard(single_flight.stream(generate)))
 
     except Exception as e:
         print(f"生成答案失败: {str(e)}")
+        if reservation is not None:
+            reservation.release()
         return jsonify({'message': f'生成答案失败: {str(e)}'}), 500
 
 @mistaken_question_bp.route('/question/update_similar_question/<int:question_id>', methods=['POST'])
 @jwt_required()
 def update_similar_question(question_id):
+    reservation = None
     try:
         current_user_id = get_jwt_identity()
 
-        user = User.query.get(current_user_id)
-        if not user or user.token_balance <= 0:
+        # 预留本次生成的token额度，余额不足时直接拒绝
+        reservation = reserve_tokens(current_user_id)
+        if reservation is None:
             return jsonify({"code": 0, "msg": "Token余额不足"}), 403
 
         question = MistakenQuestion.query.get_or_404(question_id)
@@ -462,70 +549,52 @@ def update_similar_question(question_id):
              "content": f"这是原题目题目：\n" + "\n".join(question_content) + "\n请你帮一道生成相似的题目，不需要给出答案。"}
         ]
 
+        # 流式输出期间归还数据库连接，生成结束后再用短事务保存结果
+        app = current_app._get_current_object()
+        release_db_connection()
+
         @retry_on_failure(max_retries=3)
         def generate():
-            similar_question_content = ""
-            total_tokens = 0
+            stream = LLMStream(textgen_stream_chain, messages, 'update_similar_question')
+            error = None
             try:
-                for chunk in textgen_stream_chain.invoke({'messages': messages}):
-                    if chunk and 'output' in chunk:
-                        content = chunk['output']['choices'][0].get('delta', {}).get('content', '')
-                        if content:
-                            similar_question_content += content
-                            yield f"data: {content}\n\n"
-                        # 从最后一个chunk获取token使用量
-                        if 'usage' in chunk:
-                            total_tokens = chunk['usage'].get('total_tokens', 0)
-
+                for content in stream:
+                    yield f"data: {content}\n\n"
+            except Exception as e:
+                print(f"生成答案时出错: {str(e)}")
+                error = f"生成失败: {str(e)}"
+            finally:
+                stream.close()
+                # 客户端中途断开时上游生成已被中止，同样保存已生成的部分内容和token用量
                 try:
                     # 只在获取到token使用量时更新数据库
-                    if total_tokens > 0:
-                        today = datetime.utcnow().date()
-                        token_usage = TokenUsage.query.filter(
-                            TokenUsage.user_id == current_user_id,
-                            db.func.date(TokenUsage.created_at) == today
-                        ).first()
-
-                        if token_usage:
-                            token_usage.spand += total_tokens
-                        else:
-                            token_usage = TokenUsage(
-                                user_id=current_user_id,
-                                spand=total_tokens
-                            )
-                            db.session.add(token_usage)
-
-                        user.token_balance -= total_tokens
-                        question.similar_question = similar_question_content
-                        db.session.commit()
-
-                    yield f"data: [TOKENS:{total_tokens}]\n\n"
-                    yield "data: [DONE]\n\n"
-
+                    if stream.total_tokens > 0:
+                        with short_transaction(app):
+                            reservation.settle(stream.total_tokens)
+                            # 没有生成任何内容时保留原有内容
+                            if stream.content:
+                                MistakenQuestion.query.filter_by(question_id=question_id).update(
+                                    {'similar_question': stream.content},
+                                    synchronize_session=False
+                                )
                 except Exception as e:
                     print(f"保存数据到数据库时出错: {str(e)}")
-                    db.session.rollback()
-                    yield f"data: 保存token使用记录失败: {str(e)}\n\n"
-                    yield "data: [DONE]\n\n"
+                    error = error or f"保存token使用记录失败: {str(e)}"
 
-            except Exception as e:
-                print(f"生成答案时出错: {str(e)}")
-                db.session.rollback()
-                yield f"data: 生成失败: {str(e)}\n\n"
-                yield "data: [DONE]\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Credentials': 'true'
-            }
-        )
+            if error:
+                yield f"data: {error}\n\n"
+            else:
+                yield f"data: [TOKENS:{stream.total_tokens}]\n\n"
+            yield "data: [DONE]\n\n"
+
+        # 合并重复点击或客户端重试触发的相同生成请求
+        single_flight = SingleFlight('update_similar_question', current_user_id, question_id, messages)
+        return sse_response(reservation.guard(single_flight.stream(generate)))
 
     except Exception as e:
         print(f"生成答案失败: {str(e)}")
+        if reservation is not None:
+            reservation.release()
         return jsonify({'message': f'生成答案失败: {str(e)}'}), 500
 
 @mistaken_question_bp.route('/question/toggle_favorite/<int:question_id>', methods=['PUT'])
@@ -582,47 +651,48 @@ def search_questions():
 
         db.session.commit()
 
-        # 查询当前用户的所有错题本
-        user_question_lists = MistakenQuestionList.query.filter_by(
-            user_id=current_user_id,
-            is_deleted=False
-        ).all()
-
-        question_list_ids = [question_list.question_list_id for question_list in user_question_lists]
-
-        # 在用户的错题本中搜索包含关键词的错题
-        questions = MistakenQuestion.query.filter(
-            MistakenQuestion.question_list_id.in_(question_list_ids),
+        # 在用户的错题本中通过全文索引搜索错题，按相关度排序，请求携带分页参数时分页
+        # 联表取错题本名称，并在SQL中限定用户，整个搜索只有一次查询
+        condition, relevance = search_condition(
+            [
+                MistakenQuestion.content,
+                MistakenQuestion.answer,
+                MistakenQuestion.image_describe,
+                MistakenQuestion.similar_question,
+                MistakenQuestion.similar_answer
+            ],
+            keyword
+        )
+        query = db.session.query(MistakenQuestion, MistakenQuestionList.name, relevance.label('relevance')).join(
+            MistakenQuestionList,
+            MistakenQuestion.question_list_id == MistakenQuestionList.question_list_id
+        ).filter(
+            MistakenQuestionList.user_id == current_user_id,
+            MistakenQuestionList.is_deleted == False,
             MistakenQuestion.is_deleted == False,
-            db.or_(
-                MistakenQuestion.content.like(f'%{keyword}%'),
-                MistakenQuestion.answer.like(f'%{keyword}%'),
-                MistakenQuestion.image_describe.like(f'%{keyword}%'),
-                MistakenQuestion.similar_question.like(f'%{keyword}%'),
-                MistakenQuestion.similar_answer.like(f'%{keyword}%')
-            )
-        ).all()
+            condition
+        ).order_by(
+            db.desc('relevance'),
+            MistakenQuestion.created_at.desc()
+        )
+        hits, page, page_size, has_more = paginate_search(query)
 
         result = []
-        for question in questions:
-            question_list = MistakenQuestionList.query.get(question.question_list_id)
-            match_type = []
-
-            if question.content and keyword in question.content:
-                match_type.append('content')
-            if question.answer and keyword in question.answer:
-                match_type.append('answer')
-            if question.image_describe and keyword in question.image_describe:
-                match_type.append('image')
-            if question.similar_question and keyword in question.similar_question:
-                match_type.append('similar_question')
-            if question.similar_answer and keyword in question.similar_answer:
-                match_type.append('similar_answer')
+        for question, question_list_name, score in hits:
+            # 各字段中关键词附近的高亮摘要，同时用于标记匹配类型
+            snippets = {
+                'content': highlight(question.content, keyword),
+                'answer': highlight(question.answer, keyword),
+                'image': highlight(question.image_describe, keyword),
+                'similar_question': highlight(question.similar_question, keyword),
+                'similar_answer': highlight(question.similar_answer, keyword)
+            }
+            match_type = [field for field, snippet in snippets.items() if snippet]
 
             result.append({
                 'question_id': question.question_id,
                 'question_list_id': question.question_list_id,
-                'question_list_name': question_list.name,
+                'question_list_name': question_list_name,
                 'content': question.content,
                 'answer': question.answer,
                 'is_image': question.is_image,
@@ -631,13 +701,18 @@ def search_questions():
                 'similar_question': question.similar_question,
                 'similar_answer': question.similar_answer,
                 'match_type': match_type,
+                'relevance': float(score or 0),
+                'snippets': snippets,
                 'created_at': question.created_at.strftime('%Y-%m-%d %H:%M:%S'),
                 'is_favorite': question.is_favorite
             })
 
         return jsonify({
             'msg': '搜索成功',
-            'data': result
+            'data': result,
+            'page': page,
+            'page_size': page_size,
+            'has_more': has_more
         }), 200
 
     except Exception as e:
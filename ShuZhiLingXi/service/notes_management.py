@@ -1,14 +1,17 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 
-from llm.qwen import vl_chain, audio_chain
 from models.notes import Note, NotesChapter
 from models.note_category import NoteCategory
-from utils.cos_utils import COSClient
 from utils.exts import db
+from utils.media_utils import recognize_image, recognize_media
+from utils.media_enrichment import defer_media_enrichment, submit_media_enrichment
 from datetime import datetime, timedelta
 from models.user import User
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.search_history import SearchHistory
+from utils.search_utils import search_condition, paginate_search, highlight
+from utils.pagination import keyset_paginate
+from utils.redis_utils import RedisUtils
 
 notes_bp = Blueprint('notes', __name__)
 
@@ -66,7 +69,7 @@ def get_chapters():
             'name': chapter.name,
             'category': chapter.category,
             'created_at': chapter.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'note_count': len([note for note in chapter.notes if not note.is_deleted])
+            'note_count': chapter.notes_count or 0
         } for chapter in chapters]
 
         return jsonify({
@@ -106,41 +109,60 @@ def edit_chapter(chapter_id):
         }), 500
 
 
+def _user_notes_count_decrements(level_counts, chapter_count=0):
+    """
+    根据按理解程度分组的笔记数量，构建扣减用户计数的UPDATE字段，计数不会小于0
+    :param level_counts: {理解程度: 笔记数量}
+    :param chapter_count: 同时扣减的章节数量
+    """
+    def decrement(column, amount):
+        return db.func.greatest(column - amount, 0)
+
+    values = {
+        'notes_count': decrement(User.notes_count, sum(level_counts.values())),
+        'clear_notes_count': decrement(User.clear_notes_count, level_counts.get('理解', 0)),
+        'vague_notes_count': decrement(User.vague_notes_count, level_counts.get('模糊', 0)),
+        'unclear_notes_count': decrement(User.unclear_notes_count, level_counts.get('不理解', 0))
+    }
+    if chapter_count:
+        values['chapter_count'] = decrement(User.chapter_count, chapter_count)
+    return values
+
+
 # 删除笔记章节
 @notes_bp.route('/chapter/delete/<int:chapter_id>', methods=['PUT'])
 @jwt_required()
 def delete_chapter(chapter_id):
     try:
         chapter = NotesChapter.query.get_or_404(chapter_id)
-        user = User.query.get(chapter.user_id)
 
-        # 获取该章节下所有未删除的笔记
-        notes = Note.query.filter_by(chapter_id=chapter_id, is_deleted=False).all()
-        
-        # 更新用户的各类笔记计数
-        for note in notes:
-            # 更新总笔记计数
-            user.notes_count = max(0, user.notes_count - 1)
-            
-            # 根据笔记的理解程度更新对应计数
-            if note.comprehension_level == '理解':
-                user.clear_notes_count = max(0, user.clear_notes_count - 1)
-            elif note.comprehension_level == '模糊':
-                user.vague_notes_count = max(0, user.vague_notes_count - 1)
-            elif note.comprehension_level == '不理解':
-                user.unclear_notes_count = max(0, user.unclear_notes_count - 1)
-            
-            # 标记笔记为已删除
-            note.is_deleted = True
-
-        # 更新用户的章节计数
-        user.chapter_count = max(0, user.chapter_count - 1)
+        # 按理解程度分组统计章节下未删除的笔记，一次查询得到各计数的扣减量
+        level_counts = dict(db.session.query(
+            Note.comprehension_level,
+            db.func.count(Note.note_id)
+        ).filter(
+            Note.chapter_id == chapter_id,
+            Note.is_deleted == False
+        ).group_by(Note.comprehension_level).all())
+
+        # 一条UPDATE标记章节下所有笔记为已删除
+        Note.query.filter_by(chapter_id=chapter_id, is_deleted=False).update(
+            {'is_deleted': True},
+            synchronize_session=False
+        )
+
+        # 在数据库中扣减用户的章节和各类笔记计数
+        User.query.filter_by(user_id=chapter.user_id).update(
+            _user_notes_count_decrements(level_counts, chapter_count=1),
+            synchronize_session=False
+        )
 
         # 标记章节为已删除
         chapter.is_deleted = True
         chapter.notes_count = 0
 
         db.session.commit()
+        RedisUtils().delete_knowledge_graph_cache(chapter.user_id, chapter_id)
         return jsonify({'msg': '删除成功'}), 200
 
     except Exception as e:
@@ -161,19 +183,21 @@ def create_note():
         is_audio = 0
         audio_url = ''
         audio_describe = ''
-        if data['image']:
-            is_image = 1
-            cos_client = COSClient()
-            image_url = cos_client.upload_base64_image(data['image'])
-            # 原调用方式：image_describe = qwen_vl_recognize(image_url)
-            image_describe = vl_chain.invoke(image_url)  # 使用LangChain调用
-
-        if data['audio']:
-            is_audio = 1
-            cos_client = COSClient()
-            audio_url = cos_client.upload_base64_audio(data['audio'])
-            # 原调用方式：audio_describe = qwen_audio_recognize(audio_url)
-            audio_describe = audio_chain.invoke(audio_url)  # 使用LangChain调用
+        # async_media为真时先保存笔记，图片和录音由后台线程识别后补全
+        defer_media = bool(data.get('async_media') and (data['image'] or data['audio']))
+        if defer_media:
+            is_image = 1 if data['image'] else 0
+            is_audio = 1 if data['audio'] else 0
+        else:
+            # 图片和录音并行上传、识别，相同内容命中缓存时直接复用已有的URL和识别结果
+            media = recognize_media(image=data['image'], audio=data['audio'])
+            if 'image' in media:
+                is_image = 1
+                image_url, image_describe = media['image']
+
+            if 'audio' in media:
+                is_audio = 1
+                audio_url, audio_describe = media['audio']
 
         words = data.get('words')
 
@@ -195,8 +219,11 @@ def create_note():
         elif comprehension_level == '不理解':
             user.unclear_notes_count += 1
 
-        # 更新章节的笔记计数
-        chapter.notes_count = len([n for n in chapter.notes if not n.is_deleted]) + 1
+        # 在数据库中原子地累加章节的笔记计数，无需加载章节下的所有笔记
+        NotesChapter.query.filter_by(chapter_id=chapter_id).update(
+            {'notes_count': db.func.coalesce(NotesChapter.notes_count, 0) + 1},
+            synchronize_session=False
+        )
 
         note = Note(
             chapter_id=chapter_id,
@@ -207,17 +234,35 @@ def create_note():
             audio_url=audio_url,
             audio_describe=audio_describe,
             words=words,
-            comprehension_level=comprehension_level  # 添加理解程度字段
+            comprehension_level=comprehension_level,  # 添加理解程度字段
+            media_status='processing' if defer_media else 'ready'
         )
         db.session.add(note)
+
+        if defer_media:
+            db.session.flush()
+            if not defer_media_enrichment('note', note.note_id, image=data['image'], audio=data['audio']):
+                # 无法保存待识别的媒体时退化为同步识别
+                defer_media = False
+                media = recognize_media(image=data['image'], audio=data['audio'])
+                if 'image' in media:
+                    note.image_url, note.image_describe = media['image']
+                if 'audio' in media:
+                    note.audio_url, note.audio_describe = media['audio']
+                note.media_status = 'ready'
+
         db.session.commit()
 
+        if defer_media:
+            submit_media_enrichment(current_app._get_current_object(), 'note', note.note_id)
+
         return jsonify({
             'code': 1,
             'msg': '创建成功',
             'data': {
                 'note_id': note.note_id,
-                'comprehension_level': note.comprehension_level  # 返回理解程度
+                'comprehension_level': note.comprehension_level,  # 返回理解程度
+                'media_status': note.media_status
             }
         }), 200
 
@@ -233,10 +278,14 @@ def create_note():
 @notes_bp.route('/note/list/<int:chapter_id>', methods=['GET'])
 def get_notes(chapter_id):
     try:
-        notes = Note.query.filter_by(
-            chapter_id=chapter_id,
-            is_deleted=False
-        ).order_by(Note.created_at).all()
+        try:
+            notes, next_cursor = keyset_paginate(
+                Note.query.filter_by(chapter_id=chapter_id, is_deleted=False),
+                Note.created_at,
+                Note.note_id
+            )
+        except ValueError as e:
+            return jsonify({'code': 0, 'msg': str(e)}), 400
 
         result = [{
             'note_id': note.note_id,
@@ -248,12 +297,54 @@ def get_notes(chapter_id):
             'audio_describe': note.audio_describe,
             'words': note.words,
             'created_at': note.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'comprehension_level': note.comprehension_level  # 添加理解程度
+            'comprehension_level': note.comprehension_level,  # 添加理解程度
+            'media_status': note.media_status
         } for note in notes]
 
         return jsonify({
             'msg': '获取成功',
-            'data': result
+            'data': result,
+            'next_cursor': next_cursor
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'code': 0,
+            'msg': f'获取失败: {str(e)}'
+        }), 500
+
+
+# 查询笔记图片/录音的识别状态，异步创建的笔记由客户端轮询直到完成
+@notes_bp.route('/note/status/<int:note_id>', methods=['GET'])
+@jwt_required()
+def get_note_media_status(note_id):
+    try:
+        current_user_id = get_jwt_identity()
+        note = Note.query.join(
+            NotesChapter, Note.chapter_id == NotesChapter.chapter_id
+        ).filter(
+            Note.note_id == note_id,
+            NotesChapter.user_id == current_user_id,
+            Note.is_deleted == False
+        ).first()
+
+        if not note:
+            return jsonify({
+                'code': 0,
+                'msg': '笔记不存在或无权访问'
+            }), 404
+
+        return jsonify({
+            'code': 1,
+            'msg': '获取成功',
+            'data': {
+                'note_id': note.note_id,
+                'media_status': note.media_status,
+                'image_url': note.image_url,
+                'image_describe': note.image_describe,
+                'audio_url': note.audio_url,
+                'audio_describe': note.audio_describe
+            }
         }), 200
 
     except Exception as e:
@@ -273,10 +364,7 @@ def edit_note(note_id):
         # 修改edit_note中的调用
         if data['image']:
             note.is_image = 1
-            cos_client = COSClient()
-            note.image_url = cos_client.upload_base64_image(data['image'])
-            # 原调用方式：note.image_describe = qwen_vl_recognize(note.image_url)
-            note.image_describe = vl_chain.invoke(note.image_url)
+            note.image_url, note.image_describe = recognize_image(data['image'])
         if 'is_audio' in data:
             note.is_audio = data['is_audio']
         if 'audio_url' in data:
@@ -313,6 +401,12 @@ def edit_note(note_id):
 def delete_note(note_id):
     try:
         note = Note.query.get_or_404(note_id)
+        # 重复删除时不再扣减各项计数，避免计数偏差
+        if note.is_deleted:
+            return jsonify({
+                'code': 1,
+                'msg': '删除成功'
+            }), 200
         note.is_deleted = True
 
         # 获取章节和用户信息
@@ -330,9 +424,12 @@ def delete_note(note_id):
         elif note.comprehension_level == '不理解':
             user.unclear_notes_count = max(0, user.unclear_notes_count - 1)
 
-        # 更新章节的笔记计数
+        # 在数据库中原子地扣减章节的笔记计数，无需加载章节下的所有笔记
         if chapter:
-            chapter.notes_count = len([n for n in chapter.notes if not n.is_deleted])
+            NotesChapter.query.filter_by(chapter_id=chapter.chapter_id).update(
+                {'notes_count': db.func.greatest(db.func.coalesce(NotesChapter.notes_count, 0) - 1, 0)},
+                synchronize_session=False
+            )
 
         db.session.commit()
 
@@ -349,6 +446,83 @@ def delete_note(note_id):
         }), 500
 
 
+# 批量删除笔记
+@notes_bp.route('/note/batch_delete', methods=['PUT'])
+@jwt_required()
+def batch_delete_notes():
+    try:
+        current_user_id = get_jwt_identity()
+        note_ids = (request.get_json() or {}).get('note_ids') or []
+        if not isinstance(note_ids, list) or not note_ids:
+            return jsonify({
+                'code': 0,
+                'msg': '请选择要删除的笔记'
+            }), 400
+
+        # 只统计当前用户章节下未删除的笔记，按章节和理解程度分组得到计数扣减量
+        rows = db.session.query(
+            Note.chapter_id,
+            Note.comprehension_level,
+            db.func.count(Note.note_id)
+        ).join(
+            NotesChapter,
+            Note.chapter_id == NotesChapter.chapter_id
+        ).filter(
+            Note.note_id.in_(note_ids),
+            NotesChapter.user_id == current_user_id,
+            Note.is_deleted == False
+        ).group_by(Note.chapter_id, Note.comprehension_level).all()
+
+        if not rows:
+            return jsonify({
+                'code': 1,
+                'msg': '删除成功',
+                'data': {'deleted': 0}
+            }), 200
+
+        chapter_counts = {}
+        level_counts = {}
+        for chapter_id, level, count in rows:
+            chapter_counts[chapter_id] = chapter_counts.get(chapter_id, 0) + count
+            level_counts[level] = level_counts.get(level, 0) + count
+
+        deleted = Note.query.filter(
+            Note.note_id.in_(note_ids),
+            Note.chapter_id.in_(list(chapter_counts.keys())),
+            Note.is_deleted == False
+        ).update({'is_deleted': True}, synchronize_session=False)
+
+        # 一条UPDATE扣减所有涉及章节的笔记计数
+        NotesChapter.query.filter(
+            NotesChapter.chapter_id.in_(list(chapter_counts.keys()))
+        ).update({
+            'notes_count': db.func.greatest(
+                db.func.coalesce(NotesChapter.notes_count, 0)
+                - db.case(chapter_counts, value=NotesChapter.chapter_id, else_=0),
+                0
+            )
+        }, synchronize_session=False)
+
+        User.query.filter_by(user_id=current_user_id).update(
+            _user_notes_count_decrements(level_counts),
+            synchronize_session=False
+        )
+
+        db.session.commit()
+        return jsonify({
+            'code': 1,
+            'msg': '删除成功',
+            'data': {'deleted': deleted}
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'code': 0,
+            'msg': f'删除失败: {str(e)}'
+        }), 500
+
+
 # 获取所有笔记分类
 @notes_bp.route('/categories', methods=['GET'])
 @jwt_required()
@@ -437,43 +611,40 @@ def search_notes():
 
         db.session.commit()
 
-        # 查询当前用户的所有章节
-        user_chapters = NotesChapter.query.filter_by(
-            user_id=current_user_id,
-            is_deleted=False
-        ).all()
-
-        chapter_ids = [chapter.chapter_id for chapter in user_chapters]
-
-        # 在用户的章节中搜索包含关键词的笔记
-        notes = Note.query.filter(
-            Note.chapter_id.in_(chapter_ids),
+        # 在用户的章节中通过全文索引搜索笔记，按相关度排序，请求携带分页参数时分页
+        # 联表取章节名称，并在SQL中限定用户，整个搜索只有一次查询
+        condition, relevance = search_condition(
+            [Note.words, Note.image_describe, Note.audio_describe],
+            keyword
+        )
+        query = db.session.query(Note, NotesChapter.name, relevance.label('relevance')).join(
+            NotesChapter,
+            Note.chapter_id == NotesChapter.chapter_id
+        ).filter(
+            NotesChapter.user_id == current_user_id,
+            NotesChapter.is_deleted == False,
             Note.is_deleted == False,
-            db.or_(
-                Note.words.like(f'%{keyword}%'),
-                Note.image_describe.like(f'%{keyword}%'),
-                Note.audio_describe.like(f'%{keyword}%')
-            )
-        ).all()
+            condition
+        ).order_by(
+            db.desc('relevance'),
+            Note.created_at.desc()
+        )
+        hits, page, page_size, has_more = paginate_search(query)
 
         result = []
-        for note in notes:
-            chapter = NotesChapter.query.get(note.chapter_id)
-            match_type = []
-
-            if note.words and keyword in note.words:
-                match_type.append('text')
-
-            if note.image_describe and keyword in note.image_describe:
-                match_type.append('image')
-
-            if note.audio_describe and keyword in note.audio_describe:
-                match_type.append('audio')
+        for note, chapter_name, score in hits:
+            # 各字段中关键词附近的高亮摘要，同时用于标记匹配类型
+            snippets = {
+                'text': highlight(note.words, keyword),
+                'image': highlight(note.image_describe, keyword),
+                'audio': highlight(note.audio_describe, keyword)
+            }
+            match_type = [field for field, snippet in snippets.items() if snippet]
 
             result.append({
                 'note_id': note.note_id,
                 'chapter_id': note.chapter_id,
-                'chapter_name': chapter.name,
+                'chapter_name': chapter_name,
                 'is_image': note.is_image,
                 'image_url': note.image_url,
                 'image_describe': note.image_describe,
@@ -482,12 +653,17 @@ def search_notes():
                 'audio_describe': note.audio_describe,
                 'words': note.words,
                 'match_type': match_type,
+                'relevance': float(score or 0),
+                'snippets': snippets,
                 'created_at': note.created_at.strftime('%Y-%m-%d %H:%M:%S')
             })
 
         return jsonify({
             'msg': '搜索成功',
-            'data': result
+            'data': result,
+            'page': page,
+            'page_size': page_size,
+            'has_more': has_more
         }), 200
 
     except Exception as e:
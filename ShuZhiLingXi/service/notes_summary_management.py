@@ -1,17 +1,24 @@
-from flask import Blueprint, jsonify, Response
+import json
+from datetime import datetime
+
+from flask import Blueprint, jsonify, current_app, request
 from flask_cors import CORS
 
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import insert
 from models.notes import KnowledgeGraph, KnowledgeItem, KnowledgeRelation, Note, NotesChapter, NoteSummary
-from models.token_usage import TokenUsage
-from models.user import User
 from utils.exts import db
-from llm.qwen import textgen_chain, textgen_stream_chain
-from flask import stream_with_context
-from time import sleep
-from functools import wraps
-from datetime import datetime
+from llm.qwen import textgen_stream_chain
+from llm.stream import LLMStream
+from llm.summary import split_chunks, summarize_chunks
 from utils.redis_utils import RedisUtils
+from utils.single_flight import SingleFlight
+from utils.stream_utils import release_db_connection, short_transaction, sse_response
+from utils.token_utils import reserve_tokens
+from utils.knowledge_graph_utils import (
+    GraphStreamParser, build_snapshot, dump_snapshot, compress_snapshot, decompress_snapshot, snapshot_response,
+    note_digest, notes_fingerprint, snapshot_graph_data
+)
 
 knowledge_graph_bp = Blueprint('knowledge_graph', __name__)
 
@@ -24,16 +31,113 @@ CORS(knowledge_graph_bp, resources={
 })
 
 
+def _retire_knowledge_graph(chapter_id):
+    """标记章节现有的知识图谱及其节点、关系为已删除，由调用方提交事务"""
+    existing_graph = KnowledgeGraph.query.filter_by(
+        chapter_id=chapter_id,
+        is_deleted=False
+    ).first()
+    if not existing_graph:
+        return
+
+    KnowledgeRelation.query.filter_by(
+        knowledge_graph_id=existing_graph.knowledge_graph_id
+    ).update({'is_deleted': True}, synchronize_session=False)
+    KnowledgeItem.query.filter_by(
+        knowledge_graph_id=existing_graph.knowledge_graph_id
+    ).update({'is_deleted': True}, synchronize_session=False)
+    existing_graph.is_deleted = True
+    db.session.flush()
+
+
+def _persist_knowledge_graph(chapter_id, graph_data, note_digests):
+    """
+    批量写入知识图谱，语句数量与节点、关系数量无关，由调用方提交事务
+    :param chapter_id: 章节ID
+    :param graph_data: 按名称引用节点的{'items': [...], 'relations': [...]}
+    :param note_digests: 已并入图谱的笔记内容摘要{笔记ID: 摘要}
+    :return: 图谱快照，同时压缩写入图谱记录
+    """
+    knowledge_graph = KnowledgeGraph(
+        chapter_id=chapter_id,
+        note_digests=note_digests,
+        notes_fingerprint=notes_fingerprint(note_digests)
+    )
+    db.session.add(knowledge_graph)
+    db.session.flush()
+    graph_id = knowledge_graph.knowledge_graph_id
+    now = datetime.utcnow()
+
+    # 同名节点只保留第一个，关系按名称引用节点
+    item_rows = {}
+    for item in graph_data.get('items', []):
+        if item.get('name') and item['name'] not in item_rows:
+            item_rows[item['name']] = {
+                'knowledge_graph_id': graph_id,
+                'name': item['name'],
+                'description': item.get('description'),
+                'created_at': now
+            }
+    if item_rows:
+        db.session.execute(insert(KnowledgeItem), list(item_rows.values()))
+
+    # 一次查询取回所有节点ID，MySQL的批量插入无法直接返回自增主键
+    items_map = dict(db.session.query(
+        KnowledgeItem.name,
+        KnowledgeItem.knowledge_item_id
+    ).filter_by(knowledge_graph_id=graph_id).all())
+
+    relation_rows = []
+    seen_relations = set()
+    for relation in graph_data.get('relations', []):
+        item_a_id = items_map.get(relation.get('item_a'))
+        item_b_id = items_map.get(relation.get('item_b'))
+        if item_a_id is None or item_b_id is None:
+            print(f"忽略引用了不存在节点的关系: {relation}")
+            continue
+        # 增量合并时新旧关系可能重复
+        if (item_a_id, item_b_id, relation['relation_type']) in seen_relations:
+            continue
+        seen_relations.add((item_a_id, item_b_id, relation['relation_type']))
+        relation_rows.append({
+            'knowledge_graph_id': graph_id,
+            'item_a_id': item_a_id,
+            'item_b_id': item_b_id,
+            'relation_type': relation['relation_type'],
+            'created_at': now
+        })
+    relation_ids = []
+    if relation_rows:
+        db.session.execute(insert(KnowledgeRelation), relation_rows)
+        # 同一语句插入的行自增主键按插入顺序递增，按主键排序即可与内存中的关系一一对应
+        relation_ids = [row[0] for row in db.session.query(
+            KnowledgeRelation.knowledge_relation_id
+        ).filter_by(
+            knowledge_graph_id=graph_id
+        ).order_by(KnowledgeRelation.knowledge_relation_id).all()]
+
+    snapshot = build_snapshot(
+        graph_id,
+        knowledge_graph.created_at,
+        [[items_map[name], row['name'], row['description']] for name, row in item_rows.items()],
+        [[relation_id, row['item_a_id'], row['item_b_id'], row['relation_type']]
+         for relation_id, row in zip(relation_ids, relation_rows)]
+    )
+    knowledge_graph.snapshot = compress_snapshot(dump_snapshot(snapshot))
+    return snapshot
+
+
 @knowledge_graph_bp.route('/knowledge_graph/generate/<int:chapter_id>', methods=['POST'])
 @jwt_required()
 def generate_knowledge_graph(chapter_id):
+    """
+    生成知识图谱，已有图谱时只把新增或修改过的笔记连同现有节点发给模型，将结果合并为新版本
+    请求参数mode=full时忽略现有图谱，按章节全部笔记重新生成
+    """
+    reservation = None
     try:
         current_user_id = get_jwt_identity()
-
-        # 检查用户token余额
-        user = User.query.get(current_user_id)
-        if not user or user.token_balance <= 0:
-            return jsonify({"code": 0, "msg": "Token余额不足"}), 403
+        full = request.args.get('mode') == 'full'
 
         # 检查章节是否存在且属于当前用户
         chapter = NotesChapter.query.filter_by(
@@ -47,27 +151,6 @@ def generate_knowledge_graph(chapter_id):
                 'msg': '章节不存在或无权访问'
             }), 404
 
-        # 删除已存在的知识图谱及其相关数据
-        existing_graph = KnowledgeGraph.query.filter_by(
-            chapter_id=chapter_id,
-            is_deleted=False
-        ).first()
-
-        if existing_graph:
-            # 删除相关的关系
-            KnowledgeRelation.query.filter_by(
-                knowledge_graph_id=existing_graph.knowledge_graph_id
-            ).update({'is_deleted': True})
-
-            # 删除相关的节点
-            KnowledgeItem.query.filter_by(
-                knowledge_graph_id=existing_graph.knowledge_graph_id
-            ).update({'is_deleted': True})
-
-            # 删除知识图谱
-            existing_graph.is_deleted = True
-            db.session.flush()
-
         notes = Note.query.filter_by(
             chapter_id=chapter_id,
             is_deleted=False
@@ -78,8 +161,9 @@ def generate_knowledge_graph(chapter_id):
                 'msg': '该章节没有笔记内容'
             }), 400
 
-        # 构建笔记内容列表
-        notes_content = []
+        # 构建笔记内容列表，并记录每条笔记的内容摘要
+        notes_content = {}
+        note_digests = {}
         for note in notes:
             content = []
             if note.words:
@@ -88,16 +172,60 @@ def generate_knowledge_graph(chapter_id):
                 content.append(f"图片描述: {note.image_describe}")
             if note.audio_describe:
                 content.append(f"音频描述: {note.audio_describe}")
-            notes_content.append(" ".join(content))
+            notes_content[str(note.note_id)] = " ".join(content)
+            note_digests[str(note.note_id)] = note_digest(notes_content[str(note.note_id)])
+
+        existing_graph = None if full else KnowledgeGraph.query.filter_by(
+            chapter_id=chapter_id,
+            is_deleted=False
+        ).first()
+        # 快照或摘要缺失的旧图谱无法增量合并，按全量生成
+        if existing_graph is not None and (existing_graph.snapshot is None or existing_graph.note_digests is None):
+            existing_graph = None
+
+        existing_data = {'items': [], 'relations': []}
+        changed_notes = list(notes_content.values())
+        if existing_graph is not None:
+            existing_snapshot = decompress_snapshot(existing_graph.snapshot)
+            changed_notes = [
+                content for note_id, content in notes_content.items()
+                if existing_graph.note_digests.get(note_id) != note_digests[note_id]
+            ]
+            if not changed_notes:
+                # 没有新增或修改的笔记（指纹相同，或只删除了笔记），不调用模型，直接返回现有图谱
+                if existing_graph.notes_fingerprint != notes_fingerprint(note_digests):
+                    existing_graph.note_digests = note_digests
+                    existing_graph.notes_fingerprint = notes_fingerprint(note_digests)
+                    db.session.commit()
+                return sse_response(iter([
+                    f'data: {{"type":"graph","data":{existing_snapshot}}}\n\n',
+                    "data: [TOKENS:0]\n\n",
+                    "data: [DONE]\n\n"
+                ]))
+            existing_data = snapshot_graph_data(json.loads(existing_snapshot))
+
+        # 预留本次生成的token额度，余额不足时直接拒绝
+        reservation = reserve_tokens(current_user_id)
+        if reservation is None:
+            return jsonify({"code": 0, "msg": "Token余额不足"}), 403
+
+        if existing_data['items']:
+            existing_names = '、'.join(item['name'] for item in existing_data['items'])
+            task = f"""
+                                        知识图谱中已有以下节点：{existing_names}
+                                        请根据以下新增或修改的笔记内容补充知识图谱，只输出已有节点中没有的新节点，以及新节点之间、新节点与已有节点之间的关系(关系中引用已有节点时使用完全相同的名称；如果两个item的关系是"无关"，你不必要输出他们的关系，避免存储的浪费):
+                                        {' '.join(changed_notes)}
+"""
+        else:
+            task = f"""
+                                        请根据以下笔记内容构建知识图谱(你要找到item之间的关系，如果这两个item的关系是"无关"，你不必要输出他们的关系，避免存储的浪费):
+                                        {' '.join(changed_notes)}
+"""
 
-        # 原提示词部分修改为：
         messages = [
             {"role": "system", "content": f"你是一个专业的知识图谱构建助手。请根据用户提供的笔记内容，提取"
                                           f"关键概念和进行一定并构建知识图谱。输出格式应为JSON，包含items(节点)和relations(关系)两个数组。"},
-            {"role": "user", "content": f"""
-                                        请根据以下笔记内容构建知识图谱(你要找到item之间的关系，如果这两个item的关系是"无关"，你不必要输出他们的关系，避免存储的浪费):
-                                        {' '.join(notes_content)}
-
+            {"role": "user", "content": task + f"""
                                         请以如下JSON格式返回（不得输出"根据您提供的笔记内容"等多余废话，否则会导致后端解析失败）:
                                         {{
                                             "items": [
@@ -109,158 +237,104 @@ def generate_knowledge_graph(chapter_id):
                                         }}
                                         "请严格确保：\n"
                                         "1. JSON格式合法，无重复键\n"
-                                        "2. relations中的item_a/item_b必须在items中存在\n"
+                                        "2. relations中的item_a/item_b必须在items或已有节点中存在\n"
                                         "3. 描述字段用双引号包裹"
                                         """}
         ]
 
-        response = textgen_chain.invoke({'messages': messages})
-
-        try:
-            graph_data = response['output']['text']
-        except KeyError as e:
-            raise Exception(f"API返回格式异常: {str(e)}")
-
-        # 记录token使用情况
-        total_tokens = response.get('usage', {}).get('total_tokens', 0)
-        try:
-            # 获取今天的token使用记录
-            today = datetime.utcnow().date()
-            token_usage = TokenUsage.query.filter(
-                TokenUsage.user_id == current_user_id,
-                db.func.date(TokenUsage.created_at) == today
-            ).first()
-
-            if token_usage:
-                token_usage.spand += total_tokens
-            else:
-                token_usage = TokenUsage(
-                    user_id=current_user_id,
-                    spand=total_tokens
-                )
-                db.session.add(token_usage)
-
-            # 更新用户token余额
-            user.token_balance -= total_tokens
-
-        except Exception as e:
-            print(f"保存token使用记录到数据库时出错: {str(e)}")
-            db.session.rollback()
-
-        # 解析返回的JSON数据
-        graph_data = eval(graph_data)
-
-        # 创建知识图谱
-        try:
-            # 创建知识图谱
-            knowledge_graph = KnowledgeGraph(chapter_id=chapter_id)
-            db.session.add(knowledge_graph)
-            db.session.flush()
-
-            # 创建节点
-            items_map = {}  # 用于存储节点名称到ID的映射
-            for item in graph_data['items']:
-                knowledge_item = KnowledgeItem(
-                    knowledge_graph_id=knowledge_graph.knowledge_graph_id,
-                    name=item['name'],
-                    description=item['description']
-                )
-                db.session.add(knowledge_item)
-                db.session.flush()
-                items_map[item['name']] = knowledge_item.knowledge_item_id
-
-            # 创建关系
-            for relation in graph_data['relations']:
-                knowledge_relation = KnowledgeRelation(
-                    knowledge_graph_id=knowledge_graph.knowledge_graph_id,
-                    item_a_id=items_map[relation['item_a']],
-                    item_b_id=items_map[relation['item_b']],
-                    relation_type=relation['relation_type']
-                )
-                db.session.add(knowledge_relation)
+        # 流式输出期间归还数据库连接，生成结束后再用短事务保存图谱
+        app = current_app._get_current_object()
+        release_db_connection()
 
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            print(f"数据库操作失败: {str(e)}")
-            return jsonify({'msg': '知识图谱生成失败: 数据库操作错误'}), 500
-
-        items = KnowledgeItem.query.filter_by(
-            knowledge_graph_id=knowledge_graph.knowledge_graph_id
-        ).all()
-        relations = KnowledgeRelation.query.filter_by(
-            knowledge_graph_id=knowledge_graph.knowledge_graph_id
-        ).all()
-
-        # 构建返回数据
-        items_data = [{
-            'id': item.knowledge_item_id,
-            'name': item.name,
-            'description': item.description
-        } for item in items]
+        def generate():
+            stream = LLMStream(textgen_stream_chain, messages, 'knowledge_graph')
+            parser = GraphStreamParser(item['name'] for item in existing_data['items'])
+            snapshot = None
+            error = None
+            try:
+                for content in stream:
+                    # 节点和关系一闭合就推送给客户端，不等待整个图谱生成完毕
+                    for kind, data in parser.feed(content):
+                        yield f"data: {json.dumps(dict(data, type=kind), ensure_ascii=False)}\n\n"
+            except Exception as e:
+                print(f"生成知识图谱时出错: {str(e)}")
+                error = f"生成失败: {str(e)}"
+            finally:
+                stream.close()
+                # 客户端中途断开时只结算已消耗的token，不保存不完整的图谱
+                try:
+                    graph_data = parser.finish()
+                    with short_transaction(app):
+                        reservation.settle(stream.total_tokens)
+                        if stream.finished and (graph_data['items'] or existing_data['items']):
+                            # 合并为新版本图谱，旧版本整体标记删除
+                            _retire_knowledge_graph(chapter_id)
+                            snapshot = _persist_knowledge_graph(chapter_id, {
+                                'items': existing_data['items'] + graph_data['items'],
+                                'relations': existing_data['relations'] + graph_data['relations']
+                            }, note_digests)
+                    if snapshot is not None:
+                        # 用新版本快照替换缓存，旧版本随之失效
+                        RedisUtils().set_knowledge_graph_cache(
+                            current_user_id, chapter_id, snapshot['knowledge_graph_id'], dump_snapshot(snapshot)
+                        )
+                except Exception as e:
+                    print(f"保存知识图谱时出错: {str(e)}")
+                    snapshot = None
+                    error = error or "知识图谱生成失败: 数据库操作错误"
+
+            if error:
+                yield f"data: {error}\n\n"
+            elif snapshot is None:
+                yield "data: 知识图谱生成失败: 未能从模型输出中解析出节点\n\n"
+            else:
+                yield f"data: {json.dumps({'type': 'graph', 'data': snapshot}, ensure_ascii=False)}\n\n"
+                yield f"data: [TOKENS:{stream.total_tokens}]\n\n"
+            yield "data: [DONE]\n\n"
 
-        relations_data = [{
-            'id': relation.knowledge_relation_id,
-            'source': relation.item_a_id,
-            'target': relation.item_b_id,
-            'relation_type': relation.relation_type
-        } for relation in relations]
-
-        return jsonify({
-            'msg': '知识图谱生成成功',
-            'data': {
-                'knowledge_graph_id': knowledge_graph.knowledge_graph_id,
-                'items': items_data,
-                'relations': relations_data,
-                'created_at': knowledge_graph.created_at.isoformat()
-            }
-        }), 200
+        # 合并重复点击或客户端重试触发的相同生成请求，后到的请求直接订阅执行中请求的输出
+        single_flight = SingleFlight('knowledge_graph', current_user_id, chapter_id, messages)
+        return sse_response(reservation.guard(single_flight.stream(generate)))
 
     except Exception as e:
         db.session.rollback()
+        if reservation is not None:
+            reservation.release()
         return jsonify({
             'msg': f'知识图谱生成失败: {str(e)}'
         }), 500
 
 
-def retry_on_failure(max_retries=3, delay=1):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            retries = 0
-            while retries < max_retries:
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    retries += 1
-                    if retries == max_retries:
-                        raise e
-                    sleep(delay * retries)  # 指数退避
-            return None
-
-        return wrapper
-
-    return decorator
-
-
 @knowledge_graph_bp.route('/notes/summary/generate/<int:chapter_id>', methods=['POST'])
 @jwt_required()
 def generate_notes_summary(chapter_id):
     """生成笔记总结"""
+    reservation = None
     try:
         current_user_id = get_jwt_identity()
 
-        # 检查用户token余额
-        user = User.query.get(current_user_id)
-        if not user or user.token_balance <= 0:
+        # 检查章节是否存在且属于当前用户
+        chapter = NotesChapter.query.filter_by(
+            chapter_id=chapter_id,
+            user_id=current_user_id,
+            is_deleted=False
+        ).first()
+        if not chapter:
+            return jsonify({'message': '章节不存在或无权访问'}), 404
+
+        # 预留本次生成的token额度，余额不足时直接拒绝
+        reservation = reserve_tokens(current_user_id)
+        if reservation is None:
             return jsonify({"code": 0, "msg": "Token余额不足"}), 403
 
+        # 按创建顺序排列，新增笔记只会落入最后一个分块
         notes = Note.query.filter_by(
             chapter_id=chapter_id,
             is_deleted=False
-        ).all()
+        ).order_by(Note.created_at, Note.note_id).all()
 
         if not notes:
+            reservation.release()
             return jsonify({'message': '该章节没有笔记内容'}), 400
 
         # 构建笔记内容列表
@@ -275,85 +349,87 @@ def generate_notes_summary(chapter_id):
                 content.append(f"音频描述: {note.audio_describe}")
             notes_content.append(" ".join(content))
 
-        # 构建消息
-        messages = [
-            {"role": "system", "content": "你是一个专业的笔记总结助手。请帮助用户总结笔记要点，并保持逻辑清晰。"},
-            {"role": "user", "content": f"这是我的笔记内容：\n" + "\n".join(
-                notes_content) + "\n请帮我总结这些笔记的主要内容，要点和关键信息。"}
-        ]
+        # 笔记较多时先分块总结，再由最后一步流式汇总各分块的总结
+        chunks = split_chunks(notes_content)
+
+        def build_messages(chunk_summaries):
+            if chunk_summaries is None:
+                return [
+                    {"role": "system", "content": "你是一个专业的笔记总结助手。请帮助用户总结笔记要点，并保持逻辑清晰。"},
+                    {"role": "user", "content": f"这是我的笔记内容：\n" + "\n".join(
+                        notes_content) + "\n请帮我总结这些笔记的主要内容，要点和关键信息。"}
+                ]
+            return [
+                {"role": "system", "content": "你是一个专业的笔记总结助手。请帮助用户总结笔记要点，并保持逻辑清晰。"},
+                {"role": "user", "content": f"这是我的笔记按顺序分段总结后的内容：\n" + "\n\n".join(
+                    chunk_summaries) + "\n请将这些分段总结整合为一份完整的总结，给出这些笔记的主要内容，要点和关键信息。"}
+            ]
+
+        # 流式输出期间归还数据库连接，生成结束后再用短事务保存结果
+        app = current_app._get_current_object()
+        release_db_connection()
 
-        @retry_on_failure(max_retries=3)
         def generate():
-            summary_content = ""
-            total_tokens = 0
+            map_tokens = 0
+            stream = None
+            error = None
             try:
-                for chunk in textgen_stream_chain.invoke({'messages': messages}):
-                    if chunk and 'output' in chunk:
-                        content = chunk['output']['choices'][0].get('delta', {}).get('content', '')
-                        if content:
-                            summary_content += content
-                            yield f"data: {content}\n\n"
-                        # 从最后一个chunk获取token使用量
-                        if 'usage' in chunk:
-                            total_tokens = chunk['usage'].get('total_tokens', 0)
-
+                chunk_summaries = None
+                if len(chunks) > 1:
+                    chunk_summaries, map_tokens = summarize_chunks(chunks)
+                    if None in chunk_summaries:
+                        raise Exception("部分笔记分块总结失败，请稍后重试")
+
+                stream = LLMStream(textgen_stream_chain, build_messages(chunk_summaries), 'notes_summary')
+                for content in stream:
+                    yield f"data: {content}\n\n"
+            except Exception as e:
+                print(f"生成总结时出错: {str(e)}")
+                error = f"生成失败: {str(e)}"
+            finally:
+                if stream:
+                    stream.close()
+                # 客户端中途断开时上游生成已被中止，同样保存已生成的部分内容和token用量
+                total_tokens = map_tokens + (stream.total_tokens if stream else 0)
                 try:
                     # 只在获取到token使用量时更新数据库
                     if total_tokens > 0:
-                        today = datetime.utcnow().date()
-                        token_usage = TokenUsage.query.filter(
-                            TokenUsage.user_id == current_user_id,
-                            db.func.date(TokenUsage.created_at) == today
-                        ).first()
-
-                        if token_usage:
-                            token_usage.spand += total_tokens
-                        else:
-                            token_usage = TokenUsage(
-                                user_id=current_user_id,
-                                spand=total_tokens
-                            )
-                            db.session.add(token_usage)
-
-                        user.token_balance -= total_tokens
-                        
-                        # 保存总结到数据库
-                        note_summary = NoteSummary(
-                            chapter_id=chapter_id,
-                            summary=summary_content
-                        )
-                        db.session.add(note_summary)
-                        
-                        # 提交事务
-                        db.session.commit()
-
-                    yield f"data: [TOKENS:{total_tokens}]\n\n"
-                    yield "data: [DONE]\n\n"
-
+                        with short_transaction(app) as session:
+                            reservation.settle(total_tokens)
+
+                            # 保存总结到数据库，分块阶段失败时没有汇总内容可保存
+                            # 每个章节只保留一份有效总结，旧总结标记删除
+                            if stream is not None and stream.content:
+                                NoteSummary.query.filter_by(
+                                    chapter_id=chapter_id,
+                                    is_deleted=False
+                                ).update({'is_deleted': True}, synchronize_session=False)
+                                session.add(NoteSummary(
+                                    chapter_id=chapter_id,
+                                    summary=stream.content
+                                ))
+
+                        # 事务提交后再删除缓存，避免并发读取把旧总结重新写入缓存
+                        if stream is not None and stream.content:
+                            RedisUtils().delete_notes_summary_cache(chapter_id)
                 except Exception as e:
                     print(f"保存数据到数据库时出错: {str(e)}")
-                    db.session.rollback()
-                    yield f"data: 保存token使用记录失败: {str(e)}\n\n"
-                    yield "data: [DONE]\n\n"
+                    error = error or f"保存token使用记录失败: {str(e)}"
 
-            except Exception as e:
-                print(f"生成总结时出错: {str(e)}")
-                db.session.rollback()
-                yield f"data: 生成失败: {str(e)}\n\n"
-                yield "data: [DONE]\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Credentials': 'true'
-            }
-        )
+            if error:
+                yield f"data: {error}\n\n"
+            else:
+                yield f"data: [TOKENS:{total_tokens}]\n\n"
+            yield "data: [DONE]\n\n"
+
+        # 合并重复点击或客户端重试触发的相同生成请求
+        single_flight = SingleFlight('notes_summary', current_user_id, chapter_id, notes_content)
+        return sse_response(reservation.guard(single_flight.stream(generate)))
 
     except Exception as e:
         print(f"生成笔记总结失败: {str(e)}")
+        if reservation is not None:
+            reservation.release()
         return jsonify({'message': f'生成笔记总结失败: {str(e)}'}), 500
 
 
@@ -364,17 +440,7 @@ def get_notes_summary(chapter_id):
     try:
         current_user_id = get_jwt_identity()
 
-        # 尝试从Redis缓存获取笔记总结
-        redis_utils = RedisUtils()
-        cached_summary = redis_utils.get_notes_summary_cache(chapter_id)
-        if cached_summary:
-            return jsonify({
-                'msg': '获取成功',
-                'summary': cached_summary['summary'],
-                'created_at': cached_summary['created_at']
-            }), 200
-
-        # 先检查章节是否存在且属于当前用户
+        # 先检查章节是否存在且属于当前用户，缓存按章节共享，不能在检查前返回
         chapter = NotesChapter.query.filter_by(
             chapter_id=chapter_id,
             user_id=current_user_id,
@@ -388,10 +454,20 @@ def get_notes_summary(chapter_id):
                 'created_at': ''
             }), 404
 
+        # 尝试从Redis缓存获取笔记总结
+        redis_utils = RedisUtils()
+        cached_summary = redis_utils.get_notes_summary_cache(chapter_id)
+        if cached_summary:
+            return jsonify({
+                'msg': '获取成功',
+                'summary': cached_summary['summary'],
+                'created_at': cached_summary['created_at']
+            }), 200
+
         summary = NoteSummary.query.filter_by(
             chapter_id=chapter_id,
             is_deleted=False
-        ).first()
+        ).order_by(NoteSummary.created_at.desc()).first()
 
         if not summary:
             return jsonify({
@@ -426,10 +502,16 @@ def get_notes_summary(chapter_id):
 @knowledge_graph_bp.route('/knowledge_graph/get/<int:chapter_id>', methods=['GET'])
 @jwt_required()
 def get_knowledge_graph(chapter_id):
-    """获取知识图谱及其相关的节点和关系"""
+    """获取知识图谱快照，命中缓存时只需一次Redis查询"""
     try:
         current_user_id = get_jwt_identity()
 
+        # 缓存按用户和章节区分，命中即说明章节属于当前用户
+        redis_utils = RedisUtils()
+        cached = redis_utils.get_knowledge_graph_cache(current_user_id, chapter_id)
+        if cached:
+            return snapshot_response(cached['version'], cached['snapshot'], '获取成功')
+
         # 检查章节是否存在且属于当前用户
         chapter = NotesChapter.query.filter_by(
             chapter_id=chapter_id,
@@ -454,40 +536,32 @@ def get_knowledge_graph(chapter_id):
                 'data': None
             }), 200
 
-        # 查询所有相关的节点和关系
-        items = KnowledgeItem.query.filter_by(
-            knowledge_graph_id=knowledge_graph.knowledge_graph_id,
-            is_deleted=False
-        ).all()
-
-        relations = KnowledgeRelation.query.filter_by(
-            knowledge_graph_id=knowledge_graph.knowledge_graph_id,
-            is_deleted=False
-        ).all()
-
-        # 构建返回数据
-        items_data = [{
-            'id': item.knowledge_item_id,
-            'name': item.name,
-            'description': item.description
-        } for item in items]
-
-        relations_data = [{
-            'id': relation.knowledge_relation_id,
-            'source': relation.item_a_id,
-            'target': relation.item_b_id,
-            'relation_type': relation.relation_type
-        } for relation in relations]
+        if knowledge_graph.snapshot is not None:
+            snapshot = decompress_snapshot(knowledge_graph.snapshot)
+        else:
+            # 快照功能上线前生成的图谱，从节点和关系表构建一次快照并补写
+            items = KnowledgeItem.query.filter_by(
+                knowledge_graph_id=knowledge_graph.knowledge_graph_id,
+                is_deleted=False
+            ).all()
+            relations = KnowledgeRelation.query.filter_by(
+                knowledge_graph_id=knowledge_graph.knowledge_graph_id,
+                is_deleted=False
+            ).all()
+            snapshot = dump_snapshot(build_snapshot(
+                knowledge_graph.knowledge_graph_id,
+                knowledge_graph.created_at,
+                [[item.knowledge_item_id, item.name, item.description] for item in items],
+                [[relation.knowledge_relation_id, relation.item_a_id, relation.item_b_id, relation.relation_type]
+                 for relation in relations]
+            ))
+            knowledge_graph.snapshot = compress_snapshot(snapshot)
+            db.session.commit()
 
-        return jsonify({
-            'msg': '获取成功',
-            'data': {
-                'knowledge_graph_id': knowledge_graph.knowledge_graph_id,
-                'items': items_data,
-                'relations': relations_data,
-                'created_at': knowledge_graph.created_at.isoformat()
-            }
-        }), 200
+        redis_utils.set_knowledge_graph_cache(
+            current_user_id, chapter_id, knowledge_graph.knowledge_graph_id, snapshot
+        )
+        return snapshot_response(knowledge_graph.knowledge_graph_id, snapshot, '获取成功')
 
     except Exception as e:
         return jsonify({
@@ -1,12 +1,15 @@
-from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask import Blueprint, request, jsonify, current_app
 from models.plan import Plan, PlanAdvice
 from utils.exts import db
 from datetime import datetime
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.user import User
 from llm.qwen import textgen_stream_chain
+from llm.stream import LLMStream
 from flask_cors import CORS
-from models.token_usage import TokenUsage
+from utils.stream_utils import release_db_connection, short_transaction, sse_response
+from utils.token_utils import reserve_tokens
+from utils.pagination import keyset_paginate
 from utils.redis_utils import RedisUtils
 
 plan_bp = Blueprint('plan', __name__)
@@ -71,10 +74,15 @@ def get_plans():
     """获取当前用户的所有计划"""
     try:
         current_user_id = get_jwt_identity()
-        plans = Plan.query.filter_by(
-            user_id=current_user_id,
-            is_deleted=False
-        ).order_by(Plan.deadline).all()
+        # 计划按截止时间排序，游标使用(截止时间, 计划ID)
+        try:
+            plans, next_cursor = keyset_paginate(
+                Plan.query.filter_by(user_id=current_user_id, is_deleted=False),
+                Plan.deadline,
+                Plan.plan_id
+            )
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
 
         return jsonify({
             'plans': [{
@@ -83,7 +91,8 @@ def get_plans():
                 'deadline': plan.deadline.isoformat(),
                 'level': plan.level,
                 'created_at': plan.created_at.isoformat()
-            } for plan in plans]
+            } for plan in plans],
+            'next_cursor': next_cursor
         }), 200
     except Exception as e:
         return jsonify({'message': f'获取计划失败: {str(e)}'}), 500
@@ -229,22 +238,25 @@ def get_plan_statistics():
 @jwt_required()
 def get_ai_advice():
     """获取AI定制化建议"""
+    reservation = None
     try:
         current_user_id = get_jwt_identity()
 
-        # 检查用户token余额
-        user = User.query.get(current_user_id)
-        if not user or user.token_balance <= 0:
+        # 预留本次建议的token额度，余额不足时直接拒绝
+        reservation = reserve_tokens(current_user_id)
+        if reservation is None:
             return jsonify({"code": 0, "msg": "Token余额不足"}), 403
 
         user = User.query.get(current_user_id)
 
         if not user:
+            reservation.release()
             return jsonify({'message': '用户不存在'}), 404
 
         # 获取用户的所有计划
         plans = Plan.query.filter_by(user_id=current_user_id, is_deleted=0).all()
         if not plans:
+            reservation.release()
             return jsonify({'message': '没有找到任何计划'}), 404
 
         # 构建计划描述
@@ -263,67 +275,43 @@ def get_ai_advice():
                 plan_descriptions) + "\n请根据我的计划和截止时间给出时间管理建议。"}
         ]
 
+        # 流式输出期间归还数据库连接，生成结束后再用短事务保存结果
+        app = current_app._get_current_object()
+        release_db_connection()
+
         def generate():
-            advice_content = ""
-            total_tokens = 0
-
-            for chunk in textgen_stream_chain.invoke({'messages': messages}):
-                if chunk and 'output' in chunk:
-                    content = chunk['output']['choices'][0].get('delta', {}).get('content', '')
-                    if content:
-                        advice_content += content
-                        yield f"data: {content}\n\n"
-                    # 从最后一个chunk获取token使用量
-                    if 'usage' in chunk:
-                        total_tokens = chunk['usage'].get('total_tokens', 0)
-
-            # 只在获取到token使用量时更新数据库
+            stream = LLMStream(textgen_stream_chain, messages, 'plan_advice')
             try:
-                if total_tokens > 0:
-                    today = datetime.utcnow().date()
-                    token_usage = TokenUsage.query.filter(
-                        TokenUsage.user_id == current_user_id,
-                        db.func.date(TokenUsage.created_at) == today
-                    ).first()
-
-                    if token_usage:
-                        token_usage.spand += total_tokens
-                    else:
-                        token_usage = TokenUsage(
-                            user_id=current_user_id,
-                            spand=total_tokens
-                        )
-                        db.session.add(token_usage)
-
-                    user.token_balance -= total_tokens
-
-                    # 保存建议到数据库
-                    advice = PlanAdvice.query.filter_by(user_id=current_user_id).first()
-                    if advice:
-                        advice.content = advice_content
-                        advice.updated_at = datetime.utcnow()
-                    else:
-                        advice = PlanAdvice(user_id=current_user_id, content=advice_content)
-                        db.session.add(advice)
-                    db.session.commit()
-            except Exception as e:
-                print(f"保存AI建议到数据库时出错: {str(e)}")
-                db.session.rollback()
-
-            yield f"data: [TOKENS:{total_tokens}]\n\n"
+                for content in stream:
+                    yield f"data: {content}\n\n"
+            finally:
+                stream.close()
+                # 客户端中途断开时上游生成已被中止，同样保存已生成的部分建议和token用量
+                try:
+                    # 只在获取到token使用量时更新数据库
+                    if stream.total_tokens > 0:
+                        with short_transaction(app) as session:
+                            reservation.settle(stream.total_tokens)
+
+                            # 保存建议到数据库，没有生成任何内容时保留原有建议
+                            if stream.content:
+                                advice = PlanAdvice.query.filter_by(user_id=current_user_id).first()
+                                if advice:
+                                    advice.content = stream.content
+                                    advice.updated_at = datetime.utcnow()
+                                else:
+                                    session.add(PlanAdvice(user_id=current_user_id, content=stream.content))
+                except Exception as e:
+                    print(f"保存AI建议到数据库时出错: {str(e)}")
+
+            yield f"data: [TOKENS:{stream.total_tokens}]\n\n"
             yield "data: [DONE]\n\n"
 
-        return Response(
-            stream_with_context(generate()),
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Credentials': 'true'
-            }
-        )
+        return sse_response(reservation.guard(generate()))
 
     except Exception as e:
+        if reservation is not None:
+            reservation.release()
         return jsonify({'message': f'获取AI建议失败: {str(e)}'}), 500
 
 
@@ -0,0 +1,51 @@
+"""知识图谱批量写入：语句数与节点数量无关，并输出不同规模图谱的写入耗时"""
+import time
+
+from models.notes import NotesChapter, KnowledgeItem, KnowledgeRelation
+from service.notes_summary_management import _persist_knowledge_graph
+from utils.exts import db
+
+GRAPH_SIZES = (50, 200, 1000)
+
+
+def build_graph(size):
+    """链式图谱：每个节点与下一个节点相连"""
+    return {
+        'items': [{'name': f'概念{i}', 'description': f'第{i}个概念'} for i in range(size)],
+        'relations': [
+            {'item_a': f'概念{i}', 'item_b': f'概念{i + 1}', 'relation_type': '包含'}
+            for i in range(size - 1)
+        ]
+    }
+
+
+def test_persist_knowledge_graph_statement_count_is_constant(app, user, statements):
+    chapter = NotesChapter(user_id=user.user_id, name='章节')
+    db.session.add(chapter)
+    db.session.commit()
+
+    results = {}
+    for size in GRAPH_SIZES:
+        statements.clear()
+        start = time.perf_counter()
+        snapshot = _persist_knowledge_graph(chapter.chapter_id, build_graph(size), {})
+        db.session.commit()
+        elapsed = time.perf_counter() - start
+        results[size] = (len(statements), elapsed)
+
+        assert len(snapshot['items']) == size
+        assert len(snapshot['edges']) == size - 1
+        graph_id = snapshot['knowledge_graph_id']
+        assert KnowledgeItem.query.filter_by(knowledge_graph_id=graph_id).count() == size
+        assert KnowledgeRelation.query.filter_by(knowledge_graph_id=graph_id).count() == size - 1
+
+        # 快照中的关系ID与节点ID必须和数据库中的记录一致
+        relations = {
+            relation.knowledge_relation_id: (relation.item_a_id, relation.item_b_id)
+            for relation in KnowledgeRelation.query.filter_by(knowledge_graph_id=graph_id)
+        }
+        assert {edge[0]: (edge[1], edge[2]) for edge in snapshot['edges']} == relations
+
+    for size, (count, elapsed) in results.items():
+        print(f"{size}个节点: {count}条语句, 耗时{elapsed * 1000:.1f}ms")
+    assert len({count for count, _ in results.values()}) == 1
@@ -0,0 +1,77 @@
+"""同一笔记的图片和录音并行处理：使用模拟的COS/模型耗时对比串行与并行的关键路径"""
+import time
+
+import pytest
+
+from utils import media_utils
+
+IMAGE = 'aW1hZ2U='
+AUDIO = 'YXVkaW8='
+# 模拟的远程调用耗时（秒）：上传+识别
+IMAGE_LATENCY = 0.3
+AUDIO_LATENCY = 0.4
+
+
+@pytest.fixture
+def stubbed_media(monkeypatch):
+    """不访问Redis、数据库、COS和模型，远程处理按固定耗时返回"""
+    stored = {}
+
+    def image_remote(base64_data, cached, prefix):
+        time.sleep(IMAGE_LATENCY)
+        return 'https://cos/image', '图片描述'
+
+    def audio_remote(base64_data, cached, prefix):
+        time.sleep(AUDIO_LATENCY)
+        return 'https://cos/audio', '录音描述'
+
+    monkeypatch.setattr(media_utils, '_lookup', lambda media_type, media_hash: None)
+    monkeypatch.setattr(media_utils, '_store',
+                        lambda media_type, media_hash, url, describe: stored.__setitem__(media_type, (url, describe)))
+    monkeypatch.setattr(media_utils, '_recognize_image_remote', image_remote)
+    monkeypatch.setattr(media_utils, '_recognize_audio_remote', audio_remote)
+    monkeypatch.setattr(media_utils, '_cache_late_result', lambda media_type, media_hash, future: None)
+    return stored
+
+
+def test_media_branches_run_in_parallel(stubbed_media):
+    start = time.perf_counter()
+    media_utils.recognize_media(image=IMAGE)
+    media_utils.recognize_media(audio=AUDIO)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = media_utils.recognize_media(image=IMAGE, audio=AUDIO)
+    parallel = time.perf_counter() - start
+
+    print(f"串行: {sequential * 1000:.0f}ms, 并行: {parallel * 1000:.0f}ms")
+    assert results == {
+        'image': ('https://cos/image', '图片描述'),
+        'audio': ('https://cos/audio', '录音描述')
+    }
+    # 关键路径取决于较慢的一项，而不是两项之和
+    assert parallel < IMAGE_LATENCY + AUDIO_LATENCY
+    assert parallel < sequential
+
+
+def test_failed_branch_keeps_finished_result(stubbed_media, monkeypatch):
+    def audio_remote(base64_data, cached, prefix):
+        raise Exception('识别失败')
+
+    monkeypatch.setattr(media_utils, '_recognize_audio_remote', audio_remote)
+
+    with pytest.raises(Exception, match='录音处理失败'):
+        media_utils.recognize_media(image=IMAGE, audio=AUDIO)
+    # 图片已处理完成，结果写入缓存供重试使用
+    assert stubbed_media == {'image': ('https://cos/image', '图片描述')}
+
+
+def test_branch_timeout(stubbed_media, monkeypatch):
+    monkeypatch.setitem(media_utils.MEDIA_PROCESSING_CONFIG, 'audio_timeout', 0.05)
+
+    start = time.perf_counter()
+    with pytest.raises(Exception, match='录音处理超时'):
+        media_utils.recognize_media(image=IMAGE, audio=AUDIO)
+    # 超时的一项不会拖慢整个请求
+    assert time.perf_counter() - start < AUDIO_LATENCY
+    assert 'image' in stubbed_media
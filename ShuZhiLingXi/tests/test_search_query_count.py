@@ -0,0 +1,81 @@
+"""搜索接口的语句数不随命中数和涉及的章节/错题本数量增长"""
+import uuid
+
+from models.mistaken_question import MistakenQuestionList, MistakenQuestion
+from models.notes import NotesChapter, Note
+from models.user import User
+from utils.exts import db
+
+KEYWORD = '极限'
+
+
+def add_notes(user, chapters, notes_per_chapter):
+    for i in range(chapters):
+        chapter = NotesChapter(user_id=user.user_id, name=f'章节{i}')
+        db.session.add(chapter)
+        db.session.flush()
+        db.session.add_all([
+            Note(chapter_id=chapter.chapter_id, words=f'函数的{KEYWORD}与连续 第{j}条笔记')
+            for j in range(notes_per_chapter)
+        ])
+    db.session.commit()
+
+
+def add_questions(user, lists, questions_per_list):
+    for i in range(lists):
+        question_list = MistakenQuestionList(user_id=user.user_id, name=f'错题本{i}')
+        db.session.add(question_list)
+        db.session.flush()
+        db.session.add_all([
+            MistakenQuestion(question_list_id=question_list.question_list_id, content=f'求函数的{KEYWORD} 第{j}题')
+            for j in range(questions_per_list)
+        ])
+    db.session.commit()
+
+
+def count_search(client, url, headers, statements, **params):
+    statements.clear()
+    response = client.get(url, query_string=dict(params, keyword=KEYWORD), headers=headers)
+    assert response.status_code == 200
+    return len(response.get_json()['data']), len(statements)
+
+
+def test_search_notes_statement_count_is_constant(client, auth_headers, user, statements):
+    url = '/notes_service/note/search'
+    add_notes(user, chapters=1, notes_per_chapter=2)
+    # 首次搜索会插入搜索记录，之后的搜索只更新记录时间，先预热使两次测量执行相同的写入
+    count_search(client, url, auth_headers, statements)
+    few_hits, few_statements = count_search(client, url, auth_headers, statements)
+
+    add_notes(user, chapters=10, notes_per_chapter=5)
+    many_hits, many_statements = count_search(client, url, auth_headers, statements)
+
+    assert (few_hits, many_hits) == (2, 52)
+    assert many_statements == few_statements
+
+    # 分页时语句数同样不变
+    _, paged_statements = count_search(client, url, auth_headers, statements, page=2, page_size=10)
+    assert paged_statements == few_statements
+
+
+def test_search_questions_statement_count_is_constant(client, auth_headers, user, statements):
+    url = '/mistaken_question_service/question/search'
+    add_questions(user, lists=1, questions_per_list=2)
+    count_search(client, url, auth_headers, statements)
+    few_hits, few_statements = count_search(client, url, auth_headers, statements)
+
+    add_questions(user, lists=10, questions_per_list=5)
+    many_hits, many_statements = count_search(client, url, auth_headers, statements)
+
+    assert (few_hits, many_hits) == (2, 52)
+    assert many_statements == few_statements
+
+
+def test_search_does_not_return_other_users_hits(client, auth_headers, user, statements):
+    other = User(username=uuid.uuid4().hex[:10], password='x')
+    db.session.add(other)
+    db.session.commit()
+    add_notes(other, chapters=2, notes_per_chapter=3)
+
+    hits, _ = count_search(client, '/notes_service/note/search', auth_headers, statements)
+    assert hits == 0
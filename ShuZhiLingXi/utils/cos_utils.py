@@ -1,32 +1,180 @@
 from qcloud_cos import CosConfig, CosS3Client
 from config.config import Config
+from config.settings import COS_UPLOAD_CONFIG, IMAGE_PROCESSING_CONFIG
 import sys
 import logging
 import base64
 from io import BytesIO
 import uuid
-from PIL import Image
+from PIL import Image, ImageOps
 import time
 import tempfile
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 # 配置日志输出
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
 
+class ProcessedImage:
+    """预处理后的图片"""
+
+    def __init__(self, data, content_type, extension, original):
+        self.data = data
+        self.content_type = content_type
+        self.extension = extension
+        self.original = original
+
+    def to_data_url(self):
+        """构建可直接传给视觉模型的data URL"""
+        return f"data:{self.content_type};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+def preprocess_image(original):
+    """
+    按EXIF方向旋转图片，长边超过上限时等比缩小，再按配置的格式和质量重新编码
+    :param original: 原始图片字节
+    :return: ProcessedImage
+    """
+    image = Image.open(BytesIO(original))
+    # 手机照片的方向记录在EXIF中，先转正再缩放，重新编码后EXIF不再保留
+    image = ImageOps.exif_transpose(image)
+
+    max_long_edge = IMAGE_PROCESSING_CONFIG['max_long_edge']
+    if max_long_edge and max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+    output_format = IMAGE_PROCESSING_CONFIG['output_format'].upper()
+    if output_format == 'WEBP':
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        content_type, extension = 'image/webp', 'webp'
+    else:
+        output_format = 'JPEG'
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        content_type, extension = 'image/jpeg', 'jpg'
+
+    buffered = BytesIO()
+    image.save(buffered, format=output_format, quality=IMAGE_PROCESSING_CONFIG['quality'], optimize=True)
+    data = buffered.getvalue()
+    logging.info(f"图片预处理: {len(original)} -> {len(data)} 字节, 尺寸 {image.size[0]}x{image.size[1]}")
+    return ProcessedImage(data, content_type, extension, original)
+
+
 class COSClient:
-    def __init__(self):
+    """进程级共享的COS客户端，复用HTTP连接池，并提供有界的后台上传线程池"""
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(COSClient, cls).__new__(cls)
+                    instance._init_client()
+                    cls._instance = instance
+        return cls._instance
+
+    def _init_client(self):
         config = CosConfig(
             Region=Config.COSConfig.REGION,
             SecretId=Config.COSConfig.SECRET_ID,
-            SecretKey=Config.COSConfig.SECRET_KEY
+            SecretKey=Config.COSConfig.SECRET_KEY,
+            Timeout=COS_UPLOAD_CONFIG['timeout'],
+            KeepAlive=True,
+            PoolConnections=COS_UPLOAD_CONFIG['pool_connections'],
+            PoolMaxSize=COS_UPLOAD_CONFIG['pool_maxsize']
         )
+        # CosS3Client内部的requests会话可在线程间共享
         self.client = CosS3Client(config)
         self.bucket = Config.COSConfig.BUCKET
 
+        self.executor = ThreadPoolExecutor(
+            max_workers=COS_UPLOAD_CONFIG['upload_workers'],
+            thread_name_prefix='cos-upload'
+        )
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'uploads': 0,
+            'errors': 0,
+            'queued': 0,
+            'in_flight': 0,
+            'peak_in_flight': 0
+        }
+        self._latencies = deque(maxlen=COS_UPLOAD_CONFIG['latency_window'])
+
+    def submit(self, upload, *args, **kwargs):
+        """
+        在后台线程中执行上传，不阻塞当前请求
+        :param upload: 上传方法，如client.upload_base64_image
+        :return: Future，调用result()等待上传完成并获取URL
+        """
+        with self._stats_lock:
+            self._stats['queued'] += 1
+
+        def run():
+            with self._stats_lock:
+                self._stats['queued'] -= 1
+            return upload(*args, **kwargs)
+
+        def on_done(future):
+            # 开始执行前被取消的任务不会进入run，在此移出排队计数
+            if future.cancelled():
+                with self._stats_lock:
+                    self._stats['queued'] -= 1
+
+        future = self.executor.submit(run)
+        future.add_done_callback(on_done)
+        return future
+
+    @contextmanager
+    def _track(self):
+        """记录一次上传的耗时和并发数"""
+        with self._stats_lock:
+            self._stats['uploads'] += 1
+            self._stats['in_flight'] += 1
+            self._stats['peak_in_flight'] = max(self._stats['peak_in_flight'], self._stats['in_flight'])
+
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            with self._stats_lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self._stats['in_flight'] -= 1
+                self._latencies.append(time.time() - start)
+
+    def get_stats(self):
+        """获取上传并发数和最近上传耗时的分位数"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+        stats.update({
+            'upload_workers': COS_UPLOAD_CONFIG['upload_workers'],
+            'pool_maxsize': COS_UPLOAD_CONFIG['pool_maxsize'],
+            'latency_samples': len(latencies),
+            'p50_seconds': percentile(0.5),
+            'p90_seconds': percentile(0.9),
+            'p99_seconds': percentile(0.99)
+        })
+        return stats
+
     def upload_base64_image(self, base64_data, prefix='chat_images/'):
         """
-        上传base64格式的图片到COS
+        上传base64格式的图片到COS，上传前按配置旋转、缩放并重新编码
         :param base64_data: base64编码的图片数据
         :param prefix: 文件夹前缀
         :return: 图片的访问URL
@@ -37,29 +185,45 @@ class COSClient:
             if padding:
                 base64_data += '=' * (4 - padding)
 
-            # 解码base64数据
-            img_data = base64.b64decode(base64_data)
+            # 解码base64数据并预处理
+            image = preprocess_image(base64.b64decode(base64_data))
 
-            # 验证图片格式并转换
-            image = Image.open(BytesIO(img_data))
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+        except Exception as e:
+            logging.error(f"上传图片到COS失败: {str(e)}")
+            raise Exception(f"上传图片到COS失败: {str(e)}")
 
-            # 重新编码为JPEG
-            buffered = BytesIO()
-            image.save(buffered, format="JPEG")
-            img_data = buffered.getvalue()
+        return self.upload_image(image, prefix)
 
+    def upload_image(self, image, prefix='chat_images/'):
+        """
+        上传预处理后的图片到COS
+        :param image: preprocess_image的返回结果
+        :param prefix: 文件夹前缀
+        :return: 图片的访问URL
+        """
+        try:
             # 生成唯一的文件名
-            file_name = f"{prefix}{str(uuid.uuid4())}.jpg"
+            file_id = str(uuid.uuid4())
+            file_name = f"{prefix}{file_id}.{image.extension}"
 
             # 上传到COS
-            self.client.put_object(
-                Bucket=self.bucket,
-                Body=img_data,
-                Key=file_name,
-                ContentType='image/jpeg'
-            )
+            with self._track():
+                self.client.put_object(
+                    Bucket=self.bucket,
+                    Body=image.data,
+                    Key=file_name,
+                    ContentType=image.content_type
+                )
+
+            # 按配置保留原图，与处理后的图片使用相同的文件ID
+            if IMAGE_PROCESSING_CONFIG['keep_original']:
+                with self._track():
+                    self.client.put_object(
+                        Bucket=self.bucket,
+                        Body=image.original,
+                        Key=f"{IMAGE_PROCESSING_CONFIG['original_prefix']}{prefix}{file_id}",
+                        ContentType='application/octet-stream'
+                    )
 
             # 生成带签名的URL，有效期1小时
             url = self.client.get_object_url(
@@ -106,13 +270,14 @@ class COSClient:
 
             try:
                 # 使用分块上传
-                response = self.client.upload_file(
-                    Bucket=self.bucket,
-                    Key=file_name,
-                    LocalFilePath=temp_file_path,
-                    PartSize=10,  # 分块大小（MB）
-                    MAXThread=10  # 最大并发数
-                )
+                with self._track():
+                    response = self.client.upload_file(
+                        Bucket=self.bucket,
+                        Key=file_name,
+                        LocalFilePath=temp_file_path,
+                        PartSize=10,  # 分块大小（MB）
+                        MAXThread=10  # 最大并发数
+                    )
             finally:
                 # 确保临时文件被删除
                 if os.path.exists(temp_file_path):
@@ -163,13 +328,14 @@ class COSClient:
 
             try:
                 # 使用分块上传
-                response = self.client.upload_file(
-                    Bucket=self.bucket,
-                    Key=file_name,
-                    LocalFilePath=temp_file_path,
-                    PartSize=10,  # 分块大小（MB）
-                    MAXThread=10  # 最大并发数
-                )
+                with self._track():
+                    response = self.client.upload_file(
+                        Bucket=self.bucket,
+                        Key=file_name,
+                        LocalFilePath=temp_file_path,
+                        PartSize=10,  # 分块大小（MB）
+                        MAXThread=10  # 最大并发数
+                    )
             finally:
                 # 确保临时文件被删除
                 if os.path.exists(temp_file_path):
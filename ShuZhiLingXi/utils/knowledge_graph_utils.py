@@ -0,0 +1,235 @@
+import ast
+import hashlib
+import json
+import re
+import zlib
+
+from flask import Response, request
+
+
+def build_snapshot(knowledge_graph_id, created_at, items, edges):
+    """
+    构建知识图谱快照，节点与边使用定长数组而不是对象，减少重复的字段名
+    :param knowledge_graph_id: 图谱ID，同时作为快照版本号，重新生成时递增
+    :param created_at: 图谱生成时间
+    :param items: [[节点ID, 名称, 描述], ...]
+    :param edges: [[关系ID, 起点节点ID, 终点节点ID, 关系类型], ...]
+    :return: 快照
+    """
+    return {
+        'knowledge_graph_id': knowledge_graph_id,
+        'created_at': created_at.isoformat(),
+        'items': items,
+        'edges': edges
+    }
+
+
+def dump_snapshot(snapshot):
+    """将快照序列化为紧凑的JSON字符串"""
+    return json.dumps(snapshot, ensure_ascii=False, separators=(',', ':'))
+
+
+def compress_snapshot(snapshot):
+    """压缩快照JSON字符串，用于写入数据库"""
+    return zlib.compress(snapshot.encode('utf-8'))
+
+
+def decompress_snapshot(blob):
+    """解压数据库中的快照，返回快照JSON字符串"""
+    return zlib.decompress(blob).decode('utf-8')
+
+
+def note_digest(content):
+    """计算笔记内容摘要，用于判断笔记是否已并入知识图谱"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def notes_fingerprint(note_digests):
+    """
+    计算章节笔记的整体指纹，笔记新增、修改或删除都会改变指纹
+    :param note_digests: {笔记ID: 内容摘要}
+    """
+    joined = ','.join(f"{note_id}:{note_digests[note_id]}" for note_id in sorted(note_digests, key=int))
+    return hashlib.sha256(joined.encode('utf-8')).hexdigest()
+
+
+def snapshot_graph_data(snapshot):
+    """将快照还原为按名称引用节点的{'items': [...], 'relations': [...]}，用于与新生成的内容合并"""
+    names = {item_id: name for item_id, name, _ in snapshot['items']}
+    return {
+        'items': [{'name': name, 'description': description} for _, name, description in snapshot['items']],
+        'relations': [{
+            'item_a': names[source],
+            'item_b': names[target],
+            'relation_type': relation_type
+        } for _, source, target, relation_type in snapshot['edges'] if source in names and target in names]
+    }
+
+
+def snapshot_response(version, snapshot, msg):
+    """
+    直接拼接快照JSON返回，不再解析和重新序列化
+    客户端携带的If-None-Match与快照版本一致时返回304
+    """
+    body = '{"msg":' + json.dumps(msg, ensure_ascii=False) + ',"data":' + snapshot + '}'
+    response = Response(body, mimetype='application/json')
+    response.set_etag(f"kg-{version}")
+    # 允许浏览器缓存，但每次使用前都要向服务端确认版本
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+# 节点与关系字段的最大长度，与数据表列长度一致
+ITEM_NAME_MAX_LENGTH = 50
+ITEM_DESCRIPTION_MAX_LENGTH = 150
+RELATION_TYPE_MAX_LENGTH = 50
+
+# 对象结尾多余的逗号，如{"name": "a",}
+TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+
+
+class GraphStreamParser:
+    """
+    增量解析大模型流式输出的知识图谱JSON
+    每个items/relations数组中的对象一闭合就立即解析并返回，不等待整个JSON结束；
+    JSON前后的说明文字、代码块标记会被跳过，无法修复的对象片段直接丢弃
+    """
+
+    def __init__(self, existing_names=()):
+        """
+        :param existing_names: 图谱中已有的节点名称，新输出的关系可以引用这些节点，同名节点不再重复输出
+        """
+        self.buffer = ''
+        self.position = 0
+        # 容器栈，元素为[容器类型, 所属的键, 对象起始位置]
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.last_string = None
+        self.pending_key = None
+        self.item_names = set(existing_names)
+        self.items = []
+        self.relations = []
+        # 引用的节点尚未出现的关系，等节点出现后再输出
+        self.pending_relations = []
+        # 增量识别出的items/relations对象数，包括重复或被丢弃的对象
+        self.parsed_objects = 0
+
+    def feed(self, content):
+        """
+        追加一段模型输出
+        :param content: 新增的文本
+        :return: 本段内容中闭合的节点与关系，[('item', 节点), ('relation', 关系), ...]
+        """
+        self.buffer += content
+        events = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    self.last_string = self.buffer[self.string_start:self.position]
+            elif not self.stack:
+                # 跳过JSON之前或之后的说明文字
+                if char == '{':
+                    self.stack.append(['{', None, self.position])
+            elif char == '"':
+                self.in_string = True
+                self.string_start = self.position + 1
+            elif char == ':':
+                self.pending_key = self.last_string
+            elif char in '{[':
+                parent = self.stack[-1]
+                key = self.pending_key if parent[0] == '{' else parent[1]
+                self.stack.append([char, key, self.position])
+                self.pending_key = None
+            elif char in '}]':
+                closed = self.stack.pop()
+                if closed[0] == '{' and self.stack and self.stack[-1][0] == '[':
+                    events.extend(self._on_object(self.stack[-1][1], self.buffer[closed[2]:self.position + 1]))
+            elif char == ',':
+                self.pending_key = None
+            self.position += 1
+        return events
+
+    def finish(self):
+        """
+        输出结束后调用，丢弃引用了不存在节点的关系
+        :return: {'items': [...], 'relations': [...]}
+        """
+        if not self.parsed_objects:
+            # 键名不是双引号字符串时无法增量识别数组，退化为整体解析一次
+            # 增量模式下只输出关系而没有新节点是正常情况，已识别出任何对象时不再整体解析，避免重复输出
+            start, end = self.buffer.find('{'), self.buffer.rfind('}')
+            data = self._load(self.buffer[start:end + 1]) if start != -1 and end > start else None
+            if isinstance(data, dict):
+                for key in ('items', 'relations'):
+                    for fragment in data.get(key) or []:
+                        if isinstance(fragment, dict):
+                            self._on_object(key, json.dumps(fragment, ensure_ascii=False))
+        for relation in self.pending_relations:
+            print(f"忽略引用了不存在节点的关系: {relation}")
+        self.pending_relations = []
+        return {'items': self.items, 'relations': self.relations}
+
+    def _on_object(self, key, fragment):
+        if key not in ('items', 'relations'):
+            return []
+        self.parsed_objects += 1
+        data = self._load(fragment)
+        if not isinstance(data, dict):
+            print(f"丢弃无法解析的知识图谱片段: {fragment}")
+            return []
+
+        if key == 'items':
+            name = str(data.get('name') or '').strip()[:ITEM_NAME_MAX_LENGTH]
+            if not name or name in self.item_names:
+                return []
+            item = {
+                'name': name,
+                'description': str(data.get('description') or '')[:ITEM_DESCRIPTION_MAX_LENGTH] or None
+            }
+            self.item_names.add(name)
+            self.items.append(item)
+            events = [('item', item)]
+            # 节点出现后输出此前等待它的关系
+            waiting, self.pending_relations = self.pending_relations, []
+            for relation in waiting:
+                events.extend(self._add_relation(relation))
+            return events
+
+        item_a = str(data.get('item_a') or '').strip()[:ITEM_NAME_MAX_LENGTH]
+        item_b = str(data.get('item_b') or '').strip()[:ITEM_NAME_MAX_LENGTH]
+        relation_type = str(data.get('relation_type') or '').strip()[:RELATION_TYPE_MAX_LENGTH]
+        if not item_a or not item_b or not relation_type:
+            print(f"丢弃字段不完整的关系: {fragment}")
+            return []
+        return self._add_relation({'item_a': item_a, 'item_b': item_b, 'relation_type': relation_type})
+
+    def _add_relation(self, relation):
+        if relation['item_a'] not in self.item_names or relation['item_b'] not in self.item_names:
+            self.pending_relations.append(relation)
+            return []
+        self.relations.append(relation)
+        return [('relation', relation)]
+
+    @staticmethod
+    def _load(fragment):
+        """解析单个对象片段，依次尝试标准JSON、去除多余逗号、Python字面量（单引号等）"""
+        candidates = (fragment, TRAILING_COMMA_PATTERN.sub(r'\1', fragment))
+        for candidate in candidates:
+            try:
+                return json.loads(candidate)
+            except ValueError:
+                pass
+        for candidate in candidates:
+            try:
+                return ast.literal_eval(candidate)
+            except (ValueError, SyntaxError):
+                pass
+        return None
@@ -0,0 +1,131 @@
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import MEDIA_PROCESSING_CONFIG
+from models.mistaken_question import MistakenQuestion
+from models.notes import Note
+from utils.exts import db
+from utils.media_utils import recognize_media
+from utils.redis_utils import RedisUtils
+
+# 待识别的原始媒体，字段为"记录类型:记录ID"，值为{'image', 'audio', 'attempts', 'queued_at'}
+PENDING_KEY = "media:enrichment:pending"
+
+# 支持异步识别的记录类型，识别结果写入对应的字段
+TARGETS = {
+    'note': Note,
+    'question': MistakenQuestion,
+}
+
+# 与请求内的并行识别使用不同的线程池，避免外层任务占满线程后等待内层任务
+_enrichment_executor = ThreadPoolExecutor(
+    max_workers=MEDIA_PROCESSING_CONFIG['enrichment_workers'],
+    thread_name_prefix='media-enrichment'
+)
+
+
+def _field(kind, row_id):
+    return f"{kind}:{row_id}"
+
+
+def defer_media_enrichment(kind, row_id, image=None, audio=None):
+    """
+    保存待识别的原始媒体，由后台线程补全识别结果
+    :param kind: 记录类型，note或question
+    :param row_id: 记录ID，调用方需先flush得到
+    :return: 是否保存成功，Redis不可用时返回False，调用方应改为同步识别
+    """
+    try:
+        client = RedisUtils().get_client()
+        if client is None:
+            return False
+        client.hset(PENDING_KEY, _field(kind, row_id), json.dumps({
+            'image': image,
+            'audio': audio,
+            'attempts': 0,
+            'queued_at': time.time()
+        }))
+        return True
+    except Exception as e:
+        print(f"保存待识别媒体失败，改为同步识别: {str(e)}")
+        return False
+
+
+def submit_media_enrichment(app, kind, row_id):
+    """记录提交后立即在后台线程中识别，不阻塞当前请求"""
+    _enrichment_executor.submit(run_media_enrichment, app, kind, row_id)
+
+
+def run_media_enrichment(app, kind, row_id):
+    """
+    识别一条记录的图片/录音并写回记录，失败时保留任务等待重试，超过最大次数后标记为失败
+    同一记录同一时间只会被一个线程处理
+    """
+    client = RedisUtils().get_client()
+    if client is None:
+        return
+
+    field = _field(kind, row_id)
+    lock_key = f"media:enrichment:lock:{field}"
+    lock_id = uuid.uuid4().hex
+    if not client.set(lock_key, lock_id, nx=True, ex=MEDIA_PROCESSING_CONFIG['enrichment_lock_ttl']):
+        return
+
+    try:
+        with app.app_context():
+            payload = client.hget(PENDING_KEY, field)
+            if payload is None:
+                return
+            payload = json.loads(payload)
+
+            row = TARGETS[kind].query.get(row_id)
+            if row is None or row.media_status != 'processing':
+                client.hdel(PENDING_KEY, field)
+                return
+
+            try:
+                media = recognize_media(image=payload.get('image'), audio=payload.get('audio'))
+                if 'image' in media:
+                    row.image_url, row.image_describe = media['image']
+                if 'audio' in media:
+                    row.audio_url, row.audio_describe = media['audio']
+                row.media_status = 'ready'
+                db.session.commit()
+                client.hdel(PENDING_KEY, field)
+            except Exception as e:
+                db.session.rollback()
+                payload['attempts'] += 1
+                logging.error(f"识别{field}的媒体失败（第{payload['attempts']}次）: {str(e)}")
+                if payload['attempts'] >= MEDIA_PROCESSING_CONFIG['enrichment_max_attempts']:
+                    row.media_status = 'failed'
+                    db.session.commit()
+                    client.hdel(PENDING_KEY, field)
+                else:
+                    payload['queued_at'] = time.time()
+                    client.hset(PENDING_KEY, field, json.dumps(payload))
+    finally:
+        if client.get(lock_key) == lock_id:
+            client.delete(lock_key)
+
+
+def retry_media_enrichment(app):
+    """
+    重新处理排队过久的任务，例如进程在识别完成前重启或上次识别失败
+    :return: 重新处理的任务数量
+    """
+    client = RedisUtils().get_client()
+    if client is None:
+        return 0
+
+    retried = 0
+    deadline = time.time() - MEDIA_PROCESSING_CONFIG['enrichment_retry_after']
+    for field, payload in client.hscan_iter(PENDING_KEY):
+        if json.loads(payload)['queued_at'] > deadline:
+            continue
+        kind, row_id = field.split(':', 1)
+        run_media_enrichment(app, kind, int(row_id))
+        retried += 1
+    return retried
@@ -0,0 +1,275 @@
+import base64
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+
+from sqlalchemy.exc import IntegrityError
+
+from config.settings import MEDIA_PROCESSING_CONFIG
+from llm.qwen import vl_chain, audio_chain
+from models.media_cache import MediaCache
+from utils.cos_utils import COSClient, preprocess_image
+from utils.exts import db
+from utils.redis_utils import RedisUtils
+
+
+# 并行处理同一请求中图片和录音的线程池
+_media_executor = ThreadPoolExecutor(
+    max_workers=MEDIA_PROCESSING_CONFIG['workers'],
+    thread_name_prefix='media'
+)
+
+
+def strip_data_url(base64_data):
+    """移除data:image/...;base64,头部信息"""
+    if isinstance(base64_data, str) and base64_data.startswith('data:'):
+        return base64_data.split(',', 1)[1] if ',' in base64_data else base64_data
+    return base64_data
+
+
+def hash_base64_media(base64_data):
+    """计算解码后媒体内容的SHA-256，相同内容不同编码方式得到相同的键"""
+    padding = len(base64_data) % 4
+    if padding:
+        base64_data += '=' * (4 - padding)
+    return hashlib.sha256(base64.b64decode(base64_data)).hexdigest()
+
+
+def _lookup(media_type, media_hash):
+    """依次查询Redis与数据库中的识别结果"""
+    redis_utils = RedisUtils()
+    cached = redis_utils.get_media_cache(media_type, media_hash)
+    if cached:
+        redis_utils.incr_counter(f"media_cache:{media_type}:hit")
+        return cached
+
+    record = MediaCache.query.filter_by(
+        media_type=media_type,
+        media_hash=media_hash
+    ).first()
+    if record:
+        cached = {'url': record.url, 'describe': record.describe}
+        redis_utils.set_media_cache(media_type, media_hash, cached)
+        redis_utils.incr_counter(f"media_cache:{media_type}:db_hit")
+        return cached
+
+    redis_utils.incr_counter(f"media_cache:{media_type}:miss")
+    return None
+
+
+def _store(media_type, media_hash, url, describe):
+    """写入识别结果，数据库记录使用保存点，避免并发写入冲突影响外层事务"""
+    RedisUtils().set_media_cache(media_type, media_hash, {'url': url, 'describe': describe})
+    try:
+        with db.session.begin_nested():
+            record = MediaCache.query.filter_by(
+                media_type=media_type,
+                media_hash=media_hash
+            ).first()
+            if record:
+                record.url = url
+                record.describe = describe
+            else:
+                db.session.add(MediaCache(
+                    media_type=media_type,
+                    media_hash=media_hash,
+                    url=url,
+                    describe=describe
+                ))
+    except IntegrityError:
+        logging.info(f"媒体缓存记录已由其他请求写入: {media_type}:{media_hash}")
+
+
+def upload_image(base64_data, prefix='chat_images/'):
+    """
+    上传图片，相同内容的图片直接复用已有的COS地址
+    :param base64_data: base64编码的图片数据
+    :param prefix: 文件夹前缀
+    :return: 图片的访问URL
+    """
+    base64_data = strip_data_url(base64_data)
+    media_hash = hash_base64_media(base64_data)
+    cached = _lookup('image', media_hash)
+    if cached:
+        return cached['url']
+
+    url = COSClient().upload_base64_image(base64_data, prefix)
+    _store('image', media_hash, url, None)
+    return url
+
+
+def _prepare_image(base64_data):
+    """解码并预处理图片，记录预处理前后的字节数"""
+    padding = len(base64_data) % 4
+    if padding:
+        base64_data += '=' * (4 - padding)
+    image = preprocess_image(base64.b64decode(base64_data))
+
+    redis_utils = RedisUtils()
+    redis_utils.incr_counter("image_preprocess:images")
+    redis_utils.incr_counter("image_preprocess:original_bytes", len(image.original))
+    redis_utils.incr_counter("image_preprocess:processed_bytes", len(image.data))
+    return image
+
+
+def _recognize_image_remote(base64_data, cached, prefix):
+    """上传并识别图片，只访问COS和模型，不访问数据库，可在后台线程中执行"""
+    # 上传和识别使用同一份缩放后的图片
+    image = _prepare_image(base64_data)
+
+    # 图片以data URL直接传给视觉模型，与COS上传并行，模型无需再从COS下载刚上传的图片
+    # 仅上传过（如头像）但未识别的图片复用已有地址
+    upload = None
+    if not cached:
+        cos_client = COSClient()
+        upload = cos_client.submit(cos_client.upload_image, image, prefix)
+    try:
+        describe = vl_chain.invoke(image.to_data_url())
+    except Exception:
+        if upload is not None:
+            upload.cancel()
+        raise
+    url = upload.result() if upload is not None else cached['url']
+    return url, describe
+
+
+def _recognize_audio_remote(base64_data, cached, prefix):
+    """上传并识别录音，语音识别需要读取COS地址，两步只能先后执行"""
+    url = cached['url'] if cached else COSClient().upload_base64_audio(base64_data, prefix)
+    return url, audio_chain.invoke(url)
+
+
+def recognize_image(base64_data, prefix='chat_images/'):
+    """
+    上传并识别图片，命中缓存时跳过上传和模型调用
+    :param base64_data: base64编码的图片数据
+    :param prefix: 文件夹前缀
+    :return: (图片URL, 图片识别结果)
+    """
+    base64_data = strip_data_url(base64_data)
+    media_hash = hash_base64_media(base64_data)
+    cached = _lookup('image', media_hash)
+    if cached and cached.get('describe'):
+        return cached['url'], cached['describe']
+
+    url, describe = _recognize_image_remote(base64_data, cached, prefix)
+    _store('image', media_hash, url, describe)
+    return url, describe
+
+
+def recognize_audio(base64_data, prefix='chat_audios/'):
+    """
+    上传并识别录音，命中缓存时跳过上传和模型调用
+    :param base64_data: base64编码的录音数据
+    :param prefix: 文件夹前缀
+    :return: (录音URL, 语音识别结果)
+    """
+    base64_data = strip_data_url(base64_data)
+    media_hash = hash_base64_media(base64_data)
+    cached = _lookup('audio', media_hash)
+    if cached and cached.get('describe'):
+        return cached['url'], cached['describe']
+
+    url, describe = _recognize_audio_remote(base64_data, cached, prefix)
+    _store('audio', media_hash, url, describe)
+    return url, describe
+
+
+def recognize_media(image=None, audio=None, image_prefix='chat_images/', audio_prefix='chat_audios/'):
+    """
+    并行上传并识别同一请求中的图片和录音，总耗时取决于较慢的一项而不是两项之和
+    缓存查询和结果写入在当前线程中执行，后台线程只访问COS和模型
+    任一项失败或超时都会抛出异常，调用方回滚后不会留下只处理了一半的记录；
+    已完成的一项仍会写入缓存，重试时无需重新处理
+    :param image: base64编码的图片数据，可为空
+    :param audio: base64编码的录音数据，可为空
+    :return: {'image': (URL, 识别结果), 'audio': (URL, 识别结果)}，只包含传入的媒体
+    """
+    results = {}
+    pending = {}
+    branches = (
+        ('image', image, image_prefix, _recognize_image_remote, '图片'),
+        ('audio', audio, audio_prefix, _recognize_audio_remote, '录音'),
+    )
+    for media_type, base64_data, prefix, remote, label in branches:
+        if not base64_data:
+            continue
+        base64_data = strip_data_url(base64_data)
+        media_hash = hash_base64_media(base64_data)
+        cached = _lookup(media_type, media_hash)
+        if cached and cached.get('describe'):
+            results[media_type] = (cached['url'], cached['describe'])
+            continue
+        deadline = time.time() + MEDIA_PROCESSING_CONFIG[f'{media_type}_timeout']
+        future = _media_executor.submit(remote, base64_data, cached, prefix)
+        pending[media_type] = (media_hash, future, deadline, label)
+
+    errors = []
+    for media_type, (media_hash, future, deadline, label) in pending.items():
+        try:
+            url, describe = future.result(timeout=max(0, deadline - time.time()))
+        except FutureTimeoutError:
+            # 已在执行的任务无法取消，会继续占用线程直到上传和识别结束，结果只写入Redis缓存供重试使用
+            if not future.cancel():
+                future.add_done_callback(partial(_cache_late_result, media_type, media_hash))
+            errors.append(f"{label}处理超时")
+            continue
+        except Exception as e:
+            errors.append(f"{label}处理失败: {str(e)}")
+            continue
+        _store(media_type, media_hash, url, describe)
+        results[media_type] = (url, describe)
+
+    if errors:
+        raise Exception('; '.join(errors))
+    return results
+
+
+def _cache_late_result(media_type, media_hash, future):
+    """超时后才完成的识别结果写入Redis缓存，在后台线程中执行，不访问数据库"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    url, describe = future.result()
+    RedisUtils().set_media_cache(media_type, media_hash, {'url': url, 'describe': describe})
+
+
+def get_media_cache_stats():
+    """获取媒体缓存命中率统计"""
+    stats = {}
+    for media_type in ('image', 'audio'):
+        counters = RedisUtils().get_counters([
+            f"media_cache:{media_type}:hit",
+            f"media_cache:{media_type}:db_hit",
+            f"media_cache:{media_type}:miss"
+        ])
+        hit = counters[f"media_cache:{media_type}:hit"]
+        db_hit = counters[f"media_cache:{media_type}:db_hit"]
+        miss = counters[f"media_cache:{media_type}:miss"]
+        total = hit + db_hit + miss
+        stats[media_type] = {
+            'redis_hits': hit,
+            'db_hits': db_hit,
+            'misses': miss,
+            'hit_rate': round((hit + db_hit) / total, 4) if total else 0
+        }
+    return stats
+
+
+def get_image_preprocess_stats():
+    """获取图片预处理节省的字节数统计"""
+    counters = RedisUtils().get_counters([
+        "image_preprocess:images",
+        "image_preprocess:original_bytes",
+        "image_preprocess:processed_bytes"
+    ])
+    original_bytes = counters["image_preprocess:original_bytes"]
+    processed_bytes = counters["image_preprocess:processed_bytes"]
+    return {
+        'images': counters["image_preprocess:images"],
+        'original_bytes': original_bytes,
+        'processed_bytes': processed_bytes,
+        'bytes_saved': original_bytes - processed_bytes,
+        'saved_ratio': round(1 - processed_bytes / original_bytes, 4) if original_bytes else 0
+    }
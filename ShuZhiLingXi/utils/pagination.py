@@ -0,0 +1,67 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import request
+
+from config.settings import PAGINATION_CONFIG
+from utils.exts import db
+
+
+def encode_cursor(sort_value, row_id):
+    """将最后一条记录的(排序时间, 主键)编码为游标"""
+    payload = json.dumps([sort_value.isoformat(), row_id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解析游标，返回(排序时间, 主键)"""
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+
+def keyset_paginate(query, sort_column, id_column, descending=False):
+    """
+    按(排序时间, 主键)进行游标分页，请求未携带cursor或limit参数时返回全部记录
+    :param query: 已添加过滤条件的查询
+    :param sort_column: 排序的时间列
+    :param id_column: 主键列，用于排序时间相同时确定顺序
+    :param descending: 是否倒序，倒序时游标指向更早的记录
+    :return: (记录列表, 下一页游标)，没有更多记录时游标为None
+    """
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    if not cursor and limit is None:
+        return query.all(), None
+
+    page_size = min(max(limit or PAGINATION_CONFIG['default_page_size'], 1), PAGINATION_CONFIG['max_page_size'])
+
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        if descending:
+            query = query.filter(db.or_(
+                sort_column < sort_value,
+                db.and_(sort_column == sort_value, id_column < row_id)
+            ))
+        else:
+            query = query.filter(db.or_(
+                sort_column > sort_value,
+                db.and_(sort_column == sort_value, id_column > row_id)
+            ))
+
+    # 多取一条用于判断是否还有下一页
+    items = query.limit(page_size + 1).all()
+    if len(items) <= page_size:
+        return items, None
+
+    items = items[:page_size]
+    last = items[-1]
+    return items, encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
@@ -1,7 +1,7 @@
 import json
 import time
 from redis import Redis, ConnectionError
-from config.settings import REDIS_CONFIG, CACHE_CONFIG
+from config.settings import REDIS_CONFIG, CACHE_CONFIG, SUMMARY_CONFIG
 
 class RedisUtils:
     _instance = None
@@ -155,4 +155,87 @@ class RedisUtils:
             f"notes:summary:{chapter_id}",
             summary,
             CACHE_CONFIG['notes_summary_ttl']
-        ) 
\ No newline at end of file
+        )
+
+    def delete_notes_summary_cache(self, chapter_id):
+        """删除笔记总结缓存"""
+        return self.delete_cache(f"notes:summary:{chapter_id}")
+
+    def get_summary_chunk_cache(self, chunk_hash):
+        """获取笔记分块总结缓存"""
+        return self.get_cache(f"notes:summary:chunk:{chunk_hash}")
+
+    def set_summary_chunk_cache(self, chunk_hash, summary):
+        """设置笔记分块总结缓存"""
+        self.set_cache(
+            f"notes:summary:chunk:{chunk_hash}",
+            summary,
+            SUMMARY_CONFIG['chunk_cache_ttl']
+        )
+
+    def get_media_cache(self, media_type, media_hash):
+        """获取媒体识别结果缓存"""
+        return self.get_cache(f"media:{media_type}:{media_hash}")
+
+    def set_media_cache(self, media_type, media_hash, data):
+        """设置媒体识别结果缓存"""
+        self.set_cache(
+            f"media:{media_type}:{media_hash}",
+            data,
+            CACHE_CONFIG['media_cache_ttl']
+        )
+
+    def get_knowledge_graph_cache(self, user_id, chapter_id):
+        """获取知识图谱快照缓存，返回{'version': 图谱ID, 'snapshot': 快照JSON}"""
+        try:
+            client = self.get_client()
+            if client is None:
+                return None
+            return client.hgetall(f"knowledge_graph:{user_id}:{chapter_id}") or None
+        except Exception as e:
+            print(f"获取知识图谱缓存失败: {str(e)}")
+            return None
+
+    def set_knowledge_graph_cache(self, user_id, chapter_id, version, snapshot):
+        """设置知识图谱快照缓存，版本与快照在同一事务中替换"""
+        try:
+            client = self.get_client()
+            if client is None:
+                return False
+            key = f"knowledge_graph:{user_id}:{chapter_id}"
+            pipe = client.pipeline(transaction=True)
+            pipe.delete(key)
+            pipe.hset(key, mapping={'version': version, 'snapshot': snapshot})
+            pipe.expire(key, CACHE_CONFIG['knowledge_graph_ttl'])
+            pipe.execute()
+            return True
+        except Exception as e:
+            print(f"设置知识图谱缓存失败: {str(e)}")
+            return False
+
+    def delete_knowledge_graph_cache(self, user_id, chapter_id):
+        """删除知识图谱快照缓存"""
+        return self.delete_cache(f"knowledge_graph:{user_id}:{chapter_id}")
+
+    def incr_counter(self, key, amount=1):
+        """累加统计计数"""
+        try:
+            client = self.get_client()
+            if client is None:
+                return None
+            return client.incrby(f"metrics:{key}", amount)
+        except Exception as e:
+            print(f"累加计数失败: {str(e)}")
+            return None
+
+    def get_counters(self, keys):
+        """批量获取统计计数"""
+        try:
+            client = self.get_client()
+            if client is None:
+                return {key: 0 for key in keys}
+            values = client.mget([f"metrics:{key}" for key in keys])
+            return {key: int(value or 0) for key, value in zip(keys, values)}
+        except Exception as e:
+            print(f"获取计数失败: {str(e)}")
+            return {key: 0 for key in keys}
@@ -0,0 +1,94 @@
+from html import escape
+
+from flask import request
+from sqlalchemy.dialects.mysql import match
+
+from config.settings import SEARCH_CONFIG
+from utils.exts import db
+
+
+def split_keyword(keyword):
+    """按空白拆分关键词，并去掉全文检索布尔模式中的引号"""
+    return [term.replace('"', '') for term in keyword.split() if term.replace('"', '')]
+
+
+def use_fulltext(keyword):
+    """所有关键词都不短于ngram分词长度时才能命中全文索引"""
+    terms = split_keyword(keyword)
+    return bool(terms) and all(len(term) >= SEARCH_CONFIG['ngram_token_size'] for term in terms)
+
+
+def search_condition(columns, keyword):
+    """
+    构建搜索条件和相关度表达式
+    :param columns: 参与搜索的列，需与全文索引的列完全一致
+    :param keyword: 搜索关键词
+    :return: (过滤条件, 相关度表达式)
+    """
+    if use_fulltext(keyword):
+        # 每个关键词作为短语必须出现，ngram分词下等价于子串匹配
+        against = ' '.join(f'+"{term}"' for term in split_keyword(keyword))
+        relevance = match(*columns, against=against).in_boolean_mode()
+        return relevance, relevance
+
+    # 单字关键词无法使用ngram索引，退化为LIKE匹配
+    pattern = '%' + keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return db.or_(*[column.like(pattern) for column in columns]), db.literal(0)
+
+
+def paginate_search(query):
+    """
+    按页返回搜索结果，请求未携带page或page_size参数时返回全部结果
+    :param query: 已排序的查询
+    :return: (结果列表, 页码, 每页结果数, 是否还有下一页)
+    """
+    page = request.args.get('page', type=int)
+    page_size = request.args.get('page_size', type=int)
+    if page is None and page_size is None:
+        hits = query.all()
+        return hits, 1, len(hits), False
+
+    page = max(page or 1, 1)
+    page_size = min(max(page_size or SEARCH_CONFIG['default_page_size'], 1), SEARCH_CONFIG['max_page_size'])
+    # 多取一条用于判断是否还有下一页
+    hits = query.offset((page - 1) * page_size).limit(page_size + 1).all()
+    return hits[:page_size], page, page_size, len(hits) > page_size
+
+
+def highlight(text, keyword):
+    """
+    截取关键词附近的内容作为摘要，关键词使用<em>标记，其余内容做HTML转义
+    :return: 摘要，未包含关键词时返回None
+    """
+    if not text:
+        return None
+
+    terms = split_keyword(keyword) or [keyword]
+    lower_text = text.lower()
+    positions = [(lower_text.find(term.lower()), term) for term in terms]
+    positions = [(pos, term) for pos, term in positions if pos >= 0]
+    if not positions:
+        return None
+
+    pos, term = min(positions)
+    radius = SEARCH_CONFIG['snippet_radius']
+    start = max(pos - radius, 0)
+    end = min(pos + len(term) + radius, len(text))
+    snippet = text[start:end]
+
+    # 依次标记摘要中出现的所有关键词
+    result = []
+    index = 0
+    lower_snippet = snippet.lower()
+    while index < len(snippet):
+        hits = [(lower_snippet.find(t.lower(), index), t) for t in terms]
+        hits = [(p, t) for p, t in hits if p >= 0]
+        if not hits:
+            result.append(escape(snippet[index:]))
+            break
+        p, t = min(hits)
+        result.append(escape(snippet[index:p]))
+        result.append(f"<em>{escape(snippet[p:p + len(t)])}</em>")
+        index = p + len(t)
+
+    return ('...' if start > 0 else '') + ''.join(result) + ('...' if end < len(text) else '')
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import time
+import uuid
+
+from utils.redis_utils import RedisUtils
+
+# 执行中的生成任务的锁过期时间（秒），每输出一帧会续期
+LOCK_TTL = 120
+# 生成结束后保留输出帧的时间（秒），供仍在读取的请求读完
+FRAMES_TTL = 60
+# 等待执行者输出时单次阻塞读取的时间（毫秒）
+READ_BLOCK_MS = 1000
+
+
+class SingleFlight:
+    """基于Redis的请求合并：相同用户、接口、资源和输入的并发请求只触发一次大模型生成，
+    后到的请求订阅执行中请求的输出帧"""
+
+    def __init__(self, endpoint, user_id, resource_id, payload):
+        fingerprint = hashlib.sha256(
+            json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+        ).hexdigest()[:16]
+        self.lock_key = f"singleflight:{endpoint}:{user_id}:{resource_id}:{fingerprint}"
+
+    def stream(self, producer):
+        """
+        合并流式生成
+        :param producer: 无参可调用对象，返回输出SSE帧的生成器
+        :return: SSE帧生成器
+        """
+        client = RedisUtils().get_client()
+        if client is None:
+            # Redis不可用时退化为直接生成
+            yield from producer()
+            return
+
+        flight_id = uuid.uuid4().hex
+        try:
+            acquired = client.set(self.lock_key, flight_id, nx=True, ex=LOCK_TTL)
+        except Exception as e:
+            print(f"获取请求合并锁失败: {str(e)}")
+            yield from producer()
+            return
+
+        if acquired:
+            yield from self._lead(client, flight_id, producer)
+            return
+
+        leader_id = client.get(self.lock_key)
+        if leader_id is None:
+            # 执行者刚好结束，重新作为执行者生成
+            yield from self.stream(producer)
+            return
+        yield from self._follow(client, leader_id)
+
+    def _frames_key(self, flight_id):
+        return f"{self.lock_key}:frames:{flight_id}"
+
+    def _followers_key(self, flight_id):
+        return f"{self.lock_key}:followers:{flight_id}"
+
+    def _publish(self, client, frames_key, fields):
+        """写入一条输出帧，每次写入都续期，执行者异常退出时输出帧也会过期"""
+        try:
+            client.xadd(frames_key, fields)
+            client.expire(frames_key, LOCK_TTL + FRAMES_TTL)
+            client.expire(self.lock_key, LOCK_TTL)
+        except Exception as e:
+            print(f"写入合并输出帧失败: {str(e)}")
+
+    def _has_followers(self, client, flight_id):
+        try:
+            return int(client.get(self._followers_key(flight_id)) or 0) > 0
+        except Exception as e:
+            print(f"读取合并请求数失败: {str(e)}")
+            return False
+
+    def _lead(self, client, flight_id, producer):
+        frames_key = self._frames_key(flight_id)
+        frames = producer()
+        completed = False
+        try:
+            for frame in frames:
+                self._publish(client, frames_key, {'frame': frame})
+                yield frame
+            completed = True
+        finally:
+            try:
+                # 执行者的客户端断开但仍有请求在等待输出时，继续生成直到结束，等待方能收到完整输出
+                if not completed and self._has_followers(client, flight_id):
+                    for frame in frames:
+                        self._publish(client, frames_key, {'frame': frame})
+            finally:
+                # 无人等待时显式关闭生成器，使上游大模型调用立即中止
+                frames.close()
+                try:
+                    client.xadd(frames_key, {'end': '1'})
+                    client.expire(frames_key, FRAMES_TTL)
+                    if client.get(self.lock_key) == flight_id:
+                        client.delete(self.lock_key)
+                except Exception as e:
+                    print(f"结束请求合并失败: {str(e)}")
+
+    def _follow(self, client, leader_id):
+        frames_key = self._frames_key(leader_id)
+        followers_key = self._followers_key(leader_id)
+        client.incr(followers_key)
+        client.expire(followers_key, LOCK_TTL)
+        try:
+            last_id = '0-0'
+            deadline = time.time() + LOCK_TTL
+            while time.time() < deadline:
+                entries = client.xread({frames_key: last_id}, count=100, block=READ_BLOCK_MS)
+                if not entries:
+                    # 执行者异常退出且未写入结束标记
+                    if client.get(self.lock_key) != leader_id and not client.exists(frames_key):
+                        return
+                    continue
+
+                deadline = time.time() + LOCK_TTL
+                client.expire(followers_key, LOCK_TTL)
+                for entry_id, fields in entries[0][1]:
+                    last_id = entry_id
+                    if 'end' in fields:
+                        return
+                    yield fields['frame']
+        finally:
+            try:
+                client.decr(followers_key)
+            except Exception as e:
+                print(f"更新合并请求数失败: {str(e)}")
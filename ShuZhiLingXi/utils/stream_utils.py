@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+
+from flask import Response
+
+from utils.exts import db
+
+
+def release_db_connection():
+    """提交当前请求的事务并归还数据库连接，流式输出期间不再占用连接池"""
+    db.session.commit()
+    db.session.remove()
+
+
+@contextmanager
+def short_transaction(app):
+    """在新的应用上下文中执行一次短事务，结束后立即归还数据库连接"""
+    with app.app_context():
+        try:
+            yield db.session
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def sse_response(frames):
+    """构建SSE响应，frames不依赖请求上下文，响应返回后请求会话即被释放"""
+    return Response(
+        frames,
+        content_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Credentials': 'true'
+        }
+    )
@@ -0,0 +1,385 @@
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, date
+
+from sqlalchemy.dialects.mysql import insert
+
+from config.settings import TOKEN_LEDGER_CONFIG
+from models.token_usage import TokenUsageDaily, TokenLedgerCheckpoint
+from models.user import User
+from utils.exts import db
+from utils.redis_utils import RedisUtils
+
+LEDGER_KEY = TOKEN_LEDGER_CONFIG['stream_key']
+FLUSH_LOCK_KEY = f"{LEDGER_KEY}:flush_lock"
+RESERVATIONS_KEY = "token:reservations"
+RESERVATION_EXPIRY_KEY = "token:reservations:expiry"
+
+# 余额大于0时预留额度，镜像未加载返回-1，余额不足返回0
+# KEYS: 余额镜像, 预留记录, 预留过期时间 ARGV: 预留ID, 预留额度, 用户ID, 过期时间戳
+RESERVE_SCRIPT = """
+local balance = redis.call('GET', KEYS[1])
+if not balance then
+    return -1
+end
+if tonumber(balance) <= 0 then
+    return 0
+end
+redis.call('DECRBY', KEYS[1], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3] .. ':' .. ARGV[2])
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+return 1
+"""
+
+# 按实际用量结算预留：退还差额并追加消耗流水；预留已过期退还时按实际用量重新扣减
+# KEYS: 余额镜像, 预留记录, 预留过期时间, 消耗流水 ARGV: 预留ID, 实际用量, 用户ID, 日期
+SETTLE_SCRIPT = """
+local actual = tonumber(ARGV[2])
+local refund = -actual
+local reserved = redis.call('HGET', KEYS[2], ARGV[1])
+if reserved then
+    local amount = tonumber(string.sub(reserved, string.find(reserved, ':') + 1))
+    refund = amount - actual
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+end
+if refund ~= 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('INCRBY', KEYS[1], refund)
+end
+if actual > 0 then
+    redis.call('XADD', KEYS[4], '*', 'user_id', ARGV[3], 'tokens', actual, 'day', ARGV[4])
+end
+return refund
+"""
+
+# 扣减余额镜像并追加消耗流水，镜像不存在时只追加流水，重新加载镜像时会扣除该流水
+# KEYS: 余额镜像, 消耗流水 ARGV: 消耗token数, 用户ID, 日期
+RECORD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('DECRBY', KEYS[1], ARGV[1])
+end
+redis.call('XADD', KEYS[2], '*', 'user_id', ARGV[2], 'tokens', ARGV[1], 'day', ARGV[3])
+"""
+
+# 按数据库余额重建余额镜像：扣除已落库位置之后尚未落库的流水和尚未结算的预留
+# KEYS: 余额镜像, 消耗流水, 预留记录 ARGV: 数据库余额, 用户ID, 已落库位置, 过期时间（秒）, 是否仅在镜像不存在时写入
+RELOAD_SCRIPT = """
+if ARGV[5] == '1' then
+    local current = redis.call('GET', KEYS[1])
+    if current then
+        return tonumber(current)
+    end
+end
+local balance = tonumber(ARGV[1])
+for _, entry in ipairs(redis.call('XRANGE', KEYS[2], '(' .. ARGV[3], '+')) do
+    local fields = entry[2]
+    local user_id, tokens
+    for i = 1, #fields, 2 do
+        if fields[i] == 'user_id' then
+            user_id = fields[i + 1]
+        elseif fields[i] == 'tokens' then
+            tokens = tonumber(fields[i + 1])
+        end
+    end
+    if user_id == ARGV[2] then
+        balance = balance - tokens
+    end
+end
+for _, reserved in ipairs(redis.call('HVALS', KEYS[3])) do
+    local separator = string.find(reserved, ':')
+    if string.sub(reserved, 1, separator - 1) == ARGV[2] then
+        balance = balance - tonumber(string.sub(reserved, separator + 1))
+    end
+end
+redis.call('SET', KEYS[1], balance, 'EX', ARGV[4])
+return balance
+"""
+
+
+def _balance_key(user_id):
+    return f"token:balance:{user_id}"
+
+
+def _apply_token_usage(user_id, total_tokens, day):
+    """在数据库中累加指定日期的用量并扣减用户余额，由调用方提交事务"""
+    # 按(用户, 日期)原子累加当日用量，并发请求不会插入重复的当日记录
+    stmt = insert(TokenUsageDaily).values(
+        user_id=user_id,
+        day=day,
+        spand=total_tokens,
+        updated_at=datetime.utcnow()
+    )
+    stmt = stmt.on_duplicate_key_update(
+        spand=TokenUsageDaily.spand + stmt.inserted.spand,
+        updated_at=stmt.inserted.updated_at
+    )
+    db.session.execute(stmt)
+
+    # 在数据库中直接扣减余额，不依赖请求中已加载的用户对象
+    User.query.filter_by(user_id=user_id).update(
+        {'token_balance': User.token_balance - total_tokens},
+        synchronize_session=False
+    )
+
+
+def _last_flushed_entry_id():
+    checkpoint = TokenLedgerCheckpoint.query.get(LEDGER_KEY)
+    return checkpoint.last_entry_id if checkpoint else '0-0'
+
+
+def _reload_balance(client, user_id, db_balance, last_entry_id, only_missing):
+    """按数据库余额重建余额镜像，返回镜像中的余额"""
+    return int(client.register_script(RELOAD_SCRIPT)(
+        keys=[_balance_key(user_id), LEDGER_KEY, RESERVATIONS_KEY],
+        args=[db_balance, user_id, last_entry_id, TOKEN_LEDGER_CONFIG['balance_mirror_ttl'],
+              1 if only_missing else 0]
+    ))
+
+
+def get_token_balance(user_id):
+    """
+    获取用户token余额，优先读取Redis中的余额镜像，不存在时从数据库加载
+    加载时扣除尚未落库的流水和尚未结算的预留；镜像会过期，并在每批流水落库后按数据库余额重建
+    :param user_id: 用户ID
+    :return: 余额，用户不存在时返回0
+    """
+    try:
+        client = RedisUtils().get_client()
+        if client is not None:
+            balance = client.get(_balance_key(user_id))
+            if balance is not None:
+                return int(balance)
+    except Exception as e:
+        print(f"读取token余额镜像失败: {str(e)}")
+        client = None
+
+    user = User.query.get(user_id)
+    if not user:
+        return 0
+    if client is None:
+        return user.token_balance
+
+    try:
+        # 并发加载时只有第一个写入生效，避免覆盖已扣减的镜像
+        return _reload_balance(client, user_id, user.token_balance, _last_flushed_entry_id(), only_missing=True)
+    except Exception as e:
+        print(f"写入token余额镜像失败: {str(e)}")
+        return user.token_balance
+
+
+def record_token_usage(user_id, total_tokens):
+    """
+    记录一次大模型调用的token消耗：扣减Redis余额镜像并追加消耗流水，由后台任务批量落库
+    Redis不可用时直接写入数据库，此时由调用方提交事务
+    :param user_id: 用户ID
+    :param total_tokens: 本次消耗的token数
+    """
+    if total_tokens <= 0:
+        return
+
+    today = datetime.utcnow().date()
+    try:
+        client = RedisUtils().get_client()
+        if client is not None:
+            # 原子地扣减镜像并追加流水，镜像恰好过期时由下次加载扣除该流水
+            client.register_script(RECORD_SCRIPT)(
+                keys=[_balance_key(user_id), LEDGER_KEY],
+                args=[total_tokens, user_id, today.isoformat()]
+            )
+            return
+    except Exception as e:
+        print(f"写入token流水失败，直接写入数据库: {str(e)}")
+
+    _apply_token_usage(user_id, total_tokens, today)
+
+
+class TokenReservation:
+    """
+    一次生成的token预留：生成前原子地检查余额并预扣估算额度，生成后按实际用量结算
+    同一用户并发发起多个生成时，后发起的请求能看到先发起请求的预扣，不会超额消费
+    """
+
+    def __init__(self, user_id, reservation_id):
+        self.user_id = user_id
+        self.reservation_id = reservation_id
+        self.settled = False
+
+    @classmethod
+    def reserve(cls, user_id, estimate=None):
+        """
+        预留token额度
+        :param user_id: 用户ID
+        :param estimate: 预留额度，默认使用配置中的估算值
+        :return: 预留对象，余额不足时返回None
+        """
+        if estimate is None:
+            estimate = TOKEN_LEDGER_CONFIG['reservation_estimate']
+
+        try:
+            client = RedisUtils().get_client()
+            if client is not None:
+                reservation_id = uuid.uuid4().hex
+                script = client.register_script(RESERVE_SCRIPT)
+                keys = [_balance_key(user_id), RESERVATIONS_KEY, RESERVATION_EXPIRY_KEY]
+                args = [reservation_id, estimate, user_id, int(time.time()) + TOKEN_LEDGER_CONFIG['reservation_ttl']]
+                result = script(keys=keys, args=args)
+                if result == -1:
+                    # 镜像尚未加载，从数据库加载后重试
+                    get_token_balance(user_id)
+                    result = script(keys=keys, args=args)
+                if result == 1:
+                    return cls(user_id, reservation_id)
+                if result == 0:
+                    return None
+        except Exception as e:
+            print(f"预留token失败，改为检查数据库余额: {str(e)}")
+
+        # Redis不可用时退化为检查数据库余额，结算时直接写库
+        user = User.query.get(user_id)
+        if not user or user.token_balance <= 0:
+            return None
+        return cls(user_id, None)
+
+    def settle(self, total_tokens):
+        """
+        按实际用量结算，退还多预留的额度并记录消耗，重复调用无效
+        Redis不可用时直接写入数据库，此时由调用方提交事务
+        :param total_tokens: 实际消耗的token数
+        """
+        if self.settled:
+            return
+        self.settled = True
+
+        if self.reservation_id is not None:
+            try:
+                client = RedisUtils().get_client()
+                if client is not None:
+                    client.register_script(SETTLE_SCRIPT)(
+                        keys=[_balance_key(self.user_id), RESERVATIONS_KEY, RESERVATION_EXPIRY_KEY, LEDGER_KEY],
+                        args=[self.reservation_id, max(total_tokens, 0), self.user_id,
+                              datetime.utcnow().date().isoformat()]
+                    )
+                    return
+            except Exception as e:
+                print(f"结算token预留失败: {str(e)}")
+
+        record_token_usage(self.user_id, total_tokens)
+
+    def release(self):
+        """未发生生成时退还全部预留额度，已结算时无效"""
+        if self.settled or self.reservation_id is None:
+            self.settled = True
+            return
+        self.settle(0)
+
+    def guard(self, frames):
+        """
+        包装输出帧生成器，结束时退还未结算的预留
+        合并请求中等待其他请求输出的一方不会触发生成，由此退还其预留
+        """
+        try:
+            yield from frames
+        finally:
+            self.release()
+
+
+def reserve_tokens(user_id, estimate=None):
+    """预留token额度，余额不足时返回None"""
+    return TokenReservation.reserve(user_id, estimate)
+
+
+def release_expired_reservations():
+    """
+    退还超过有效期仍未结算的预留，例如客户端在开始读取响应前断开
+    :return: 退还的预留数量
+    """
+    client = RedisUtils().get_client()
+    if client is None:
+        return 0
+
+    released = 0
+    script = client.register_script(SETTLE_SCRIPT)
+    for reservation_id in client.zrangebyscore(RESERVATION_EXPIRY_KEY, '-inf', int(time.time())):
+        reserved = client.hget(RESERVATIONS_KEY, reservation_id)
+        if reserved is None:
+            client.zrem(RESERVATION_EXPIRY_KEY, reservation_id)
+            continue
+        user_id = reserved.split(':', 1)[0]
+        script(
+            keys=[_balance_key(user_id), RESERVATIONS_KEY, RESERVATION_EXPIRY_KEY, LEDGER_KEY],
+            args=[reservation_id, 0, user_id, datetime.utcnow().date().isoformat()]
+        )
+        released += 1
+    return released
+
+
+def flush_token_ledger():
+    """
+    将Redis中的token消耗流水按(用户, 日期)汇总后批量写入数据库，需在应用上下文中调用
+    已落库位置与用量、余额在同一事务中提交，进程在任意位置崩溃后重放都不会重复或丢失流水
+    :return: 本次落库的流水条数
+    """
+    client = RedisUtils().get_client()
+    if client is None:
+        return 0
+
+    lock_id = uuid.uuid4().hex
+    if not client.set(FLUSH_LOCK_KEY, lock_id, nx=True, ex=TOKEN_LEDGER_CONFIG['flush_lock_ttl']):
+        return 0
+
+    flushed = 0
+    try:
+        for _ in range(TOKEN_LEDGER_CONFIG['max_batches']):
+            last_entry_id = _last_flushed_entry_id()
+
+            entries = client.xrange(
+                LEDGER_KEY,
+                min=f"({last_entry_id}",
+                max='+',
+                count=TOKEN_LEDGER_CONFIG['batch_size']
+            )
+            if not entries:
+                break
+
+            usage = defaultdict(int)
+            for _, fields in entries:
+                usage[(int(fields['user_id']), fields['day'])] += int(fields['tokens'])
+
+            try:
+                # 按用户ID顺序加锁，避免多行更新之间死锁
+                for (user_id, day), total_tokens in sorted(usage.items()):
+                    _apply_token_usage(user_id, total_tokens, date.fromisoformat(day))
+
+                db.session.merge(TokenLedgerCheckpoint(
+                    name=LEDGER_KEY,
+                    last_entry_id=entries[-1][0],
+                    updated_at=datetime.utcnow()
+                ))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+            # 已落库的流水可以删除，最后一条保留作为下次读取的起点
+            client.xtrim(LEDGER_KEY, minid=entries[-1][0])
+            flushed += len(entries)
+
+            # 按数据库余额校准涉及用户的镜像，修正镜像丢失后重新加载产生的偏差和其他途径的余额变更
+            user_ids = {user_id for user_id, _ in usage}
+            balances = User.query.with_entities(User.user_id, User.token_balance).filter(
+                User.user_id.in_(user_ids)
+            ).all()
+            for user_id, token_balance in balances:
+                _reload_balance(client, user_id, token_balance, entries[-1][0], only_missing=False)
+            db.session.commit()
+            logging.info(f"落库token流水{len(entries)}条，涉及{len(usage)}个(用户, 日期)")
+
+            if len(entries) < TOKEN_LEDGER_CONFIG['batch_size']:
+                break
+    finally:
+        if client.get(FLUSH_LOCK_KEY) == lock_id:
+            client.delete(FLUSH_LOCK_KEY)
+
+    return flushed